@@ -0,0 +1,81 @@
+# Path matrix backend against the dict of dicts one: time to compute
+# the paths of the whole topology (IncrementalPaths builds them with
+# networkx, MatrixPaths with scipy.sparse.csgraph) and time of full
+# Shortest_Path_Heuristic tree builds on each.
+#
+# Needs numpy and scipy.
+#
+# Usage: python bench_matrix.py [size ...]
+import sys
+import random
+
+from common import random_topology, timeit
+from algorithms import Shortest_Path_Heuristic
+from paths import IncrementalPaths, MatrixPaths
+
+SIZES = [250, 500, 1000, 2000]
+ROUNDS = 5
+
+
+def make_stream(graph, n_clients, rand):
+    nodes = list(graph.nodes())
+    return {"src": {"dpid": rand.choice(nodes)},
+            "clients": dict((dpid, set([1]))
+                            for dpid in rand.sample(nodes, n_clients)),
+            "m_tree": {}}
+
+
+def bench(size, rand):
+    graph = random_topology(size, seed=rand.randint(0, 2 ** 31))
+    dict_time, engine = timeit(IncrementalPaths, graph)
+    matrix = MatrixPaths(graph)
+    matrix_time = timeit(matrix.refresh)[0]
+    # Same hop counts from both
+    for src in rand.sample(list(graph.nodes()), 10):
+        for dst in graph.nodes():
+            assert engine.pathlens[src][dst] == matrix.pathlens[src][dst]
+    algorithm = Shortest_Path_Heuristic()
+    results = []
+    for n_clients in (size / 10, size / 2):
+        tree_dict = 0.0
+        tree_matrix = 0.0
+        cost_dict = 0
+        cost_matrix = 0
+        for i in xrange(ROUNDS):
+            stream = make_stream(graph, n_clients, rand)
+            elapsed, (tree, mod_nodes) = timeit(
+                algorithm._topology_changed_handler, stream,
+                engine.paths, engine.pathlens, None)
+            tree_dict += elapsed
+            cost_dict += len(tree) - 1
+            elapsed, (tree, mod_nodes) = timeit(
+                algorithm._topology_changed_handler, stream,
+                matrix.paths, matrix.pathlens, None)
+            tree_matrix += elapsed
+            cost_matrix += len(tree) - 1
+        results.append((n_clients, tree_dict / ROUNDS * 1000,
+                        tree_matrix / ROUNDS * 1000,
+                        float(cost_dict) / ROUNDS,
+                        float(cost_matrix) / ROUNDS))
+    return dict_time, matrix_time, results
+
+
+def main(sizes):
+    rand = random.Random(0)
+    print "%8s %10s %11s %8s %8s %12s %12s %8s %10s %10s" % \
+        ("switches", "dict(s)", "matrix(s)", "speedup", "clients",
+         "tree_dict", "tree_matrix", "speedup", "cost_dict", "cost_mat")
+    for size in sizes:
+        dict_time, matrix_time, results = bench(size, rand)
+        for n_clients, tree_dict, tree_matrix, cost_dict, cost_matrix \
+                in results:
+            print "%8d %10.3f %11.3f %7.1fx %8d %10.2fms %10.2fms " \
+                "%7.1fx %10.1f %10.1f" % \
+                (size, dict_time, matrix_time,
+                 dict_time / max(matrix_time, 1e-9), n_clients, tree_dict,
+                 tree_matrix, tree_dict / max(tree_matrix, 1e-9),
+                 cost_dict, cost_matrix)
+
+
+if __name__ == "__main__":
+    main([int(arg) for arg in sys.argv[1:]] or SIZES)
@@ -0,0 +1,237 @@
+# Packet-in dispatch rate of Wrapper._packet_in_handler as shipped,
+# against the handler as it was before the fixed offset classifier,
+# which parsed every packet with ryu's packet library.
+#
+# The shipped handler is driven as ryu-manager would: a packet-in event
+# from a stub datapath, the limiter asked about every packet, once as
+# configured by default and once enabled with buckets the load stays
+# under. Events go to stubbed observers that read what the app receiving
+# them reads: the addresses for Switching, the parsed packet for
+# ARPProxy and Streaming. Hosts are known, as they are once discovery
+# has run, the handlers still look them up. What the handlers print goes
+# to a sink, logging is at ryu-manager's default INFO.
+#
+# Usage: python bench_packetin.py [packets]
+import sys
+import struct
+import random
+import logging
+
+from ryu.lib import addrconv
+from ryu.lib.packet import packet, ethernet, arp, ipv4, udp, lldp
+from ryu.controller import ofp_event
+from ryu.ofproto import ofproto_v1_3, ofproto_v1_3_parser
+
+from common import timeit
+from addrs import *
+from events import *
+from ratelimit import PacketInLimiter
+from wrapper import Wrapper
+
+PACKETS = 100000
+# Share of each kind of packet-in
+MIX = [("switching", 0.6), ("arp", 0.2), ("streaming", 0.1),
+       ("lldp", 0.1)]
+DPID = 1
+IN_PORT = 1
+
+
+def frame(kind, rand):
+    src = "00:00:00:00:%02x:%02x" % (rand.randint(0, 255),
+                                     rand.randint(1, 255))
+    src_ip = "10.0.%d.%d" % (rand.randint(0, 255), rand.randint(1, 254))
+    pkt = packet.Packet()
+    if kind == "switching":
+        pkt.add_protocol(ethernet.ethernet(ethertype=0x0800,
+                                           dst="00:00:00:00:00:01", src=src))
+        pkt.add_protocol(ipv4.ipv4(src=src_ip, dst="10.0.0.1", proto=17))
+        pkt.add_protocol(udp.udp(src_port=5000, dst_port=5000))
+    elif kind == "arp":
+        pkt.add_protocol(ethernet.ethernet(ethertype=0x0806,
+                                           dst=ETHERNET_FLOOD, src=src))
+        pkt.add_protocol(arp.arp(opcode=arp.ARP_REQUEST, src_mac=src,
+                                 src_ip=src_ip, dst_mac="00:00:00:00:00:00",
+                                 dst_ip="10.0.0.1"))
+    elif kind == "streaming":
+        stream_id = rand.randint(1, 255)
+        pkt.add_protocol(ethernet.ethernet(
+            ethertype=0x0800, dst="01:00:5e:01:00:%02x" % stream_id,
+            src=src))
+        pkt.add_protocol(ipv4.ipv4(src=src_ip, dst="225.1.0.%d" % stream_id,
+                                   proto=17))
+        pkt.add_protocol(udp.udp(src_port=5000, dst_port=5000))
+    else:
+        pkt.add_protocol(ethernet.ethernet(ethertype=0x88cc, dst=LLDP,
+                                           src=src))
+        tlvs = (lldp.ChassisID(subtype=lldp.ChassisID.SUB_LOCALLY_ASSIGNED,
+                               chassis_id="dpid:1"),
+                lldp.PortID(subtype=lldp.PortID.SUB_PORT_COMPONENT,
+                            port_id=struct.pack("!I", 1)),
+                lldp.TTL(ttl=120), lldp.End())
+        pkt.add_protocol(lldp.lldp(tlvs))
+    pkt.serialize()
+    return src, str(pkt.data)
+
+
+class StubDatapath(object):
+
+    def __init__(self, dpid):
+        super(StubDatapath, self).__init__()
+        self.id = dpid
+        self.ofproto = ofproto_v1_3
+        self.ofproto_parser = ofproto_v1_3_parser
+
+    def send_msg(self, msg):
+        return True
+
+
+class Sink(object):
+
+    def write(self, data):
+        pass
+
+
+class Observers(object):
+    # Stands in for the apps the handler sends its events to
+
+    def __init__(self):
+        super(Observers, self).__init__()
+        self.events = 0
+
+    def __call__(self, ev):
+        if isinstance(ev, Event_Switching_PacketIn):
+            ev.eth_src
+            ev.eth_dst
+        elif isinstance(ev, Event_ARP_PacketIn):
+            ev.pkt.get_protocol(arp.arp)
+        elif isinstance(ev, Event_Streaming_PacketIn):
+            ev.pkt.get_protocol(ipv4.ipv4)
+        else:
+            return
+        self.events += 1
+
+
+def stub_wrapper(hosts, limiter_conf):
+    # The Wrapper app without the apps and config file it starts with
+    wrapper = Wrapper.__new__(Wrapper)
+    wrapper.name = "Wrapper"
+    wrapper.logger = logging.getLogger(wrapper.name)
+    wrapper.limiter = PacketInLimiter()
+    wrapper.limiter.config(limiter_conf)
+    wrapper.hostmac = {DPID: hosts}
+    wrapper.send_event_to_observers = Observers()
+    return wrapper
+
+
+def old_is_multicast(haddr):
+    array = struct.unpack('6B', addrconv.mac.text_to_bin(haddr))
+    addr_int = 0
+    for i in array:
+        addr_int <<= 8
+        addr_int += i
+    return addr_int & ETH_STREAMING_MASK == ETH_STREAMING_ADDR_INT
+
+
+def old_packet_in_handler(self, ev):
+    # Wrapper._packet_in_handler as it parsed every packet
+    msg = ev.msg
+    datapath = msg.datapath
+    in_port = msg.match["in_port"]
+
+    pkt = packet.Packet(msg.data)
+    arp_protocol = pkt.get_protocol(arp.arp)
+    ip_protocol = pkt.get_protocol(ipv4.ipv4)
+
+    eth_src = pkt.get_protocol(ethernet.ethernet).src
+    eth_dst = pkt.get_protocol(ethernet.ethernet).dst
+
+    if eth_dst == LLDP:
+        return
+
+    hosts = self.hostmac.get(datapath.id)
+    if hosts is not None and eth_src not in hosts:
+        src_ip = None
+        if arp_protocol is not None:
+            src_ip = arp_protocol.src_ip
+        elif ip_protocol is not None:
+            src_ip = ip_protocol.src
+        if src_ip is not None:
+            print "disc ip%s mac%s" % (src_ip, eth_src)
+            hosts.add(eth_src)
+            host = Host(eth_src, src_ip, datapath.id, in_port)
+            self.send_event_to_observers(EventHostReg(host))
+
+    if eth_dst == HOST_DIS_ETH_SRC:
+        self.logger.info("recv HOST_DIS_ETH_SRC")
+        return
+
+    if arp_protocol:
+        self.send_event_to_observers(Event_ARP_PacketIn(msg, pkt))
+        return
+
+    if eth_dst == ETHERNET_FLOOD:
+        return
+    elif old_is_multicast(eth_dst):
+        print "Streaming"
+        self.send_event_to_observers(Event_Streaming_PacketIn(msg, pkt))
+    else:
+        print "Switching"
+        self.send_event_to_observers(Event_Switching_PacketIn(msg, pkt))
+
+
+def dispatch(handler, wrapper, evs):
+    stdout = sys.stdout
+    sys.stdout = Sink()
+    try:
+        for ev in evs:
+            handler(wrapper, ev)
+    finally:
+        sys.stdout = stdout
+    return wrapper.send_event_to_observers.events
+
+
+def main(n_packets):
+    logging.getLogger().setLevel(logging.INFO)
+    rand = random.Random(0)
+    kinds = []
+    for kind, share in MIX:
+        kinds.extend([kind] * int(n_packets * share))
+    rand.shuffle(kinds)
+    frames = [frame(kind, rand) for kind in kinds]
+    datapath = StubDatapath(DPID)
+    match = ofproto_v1_3_parser.OFPMatch(in_port=IN_PORT)
+    evs = []
+    for src, data in frames:
+        msg = ofproto_v1_3_parser.OFPPacketIn(
+            datapath, buffer_id=ofproto_v1_3.OFP_NO_BUFFER,
+            total_len=len(data), reason=ofproto_v1_3.OFPR_NO_MATCH,
+            table_id=0, cookie=0, match=match, data=data)
+        evs.append(ofp_event.EventOFPPacketIn(msg))
+    known = set(src for src, data in frames)
+    known_raw = set(addrconv.mac.text_to_bin(src) for src in known)
+    # Rates the load stays under, every packet-in passes
+    limited = {"packet_in_limit": True,
+               "packet_in_rate": 10 * n_packets,
+               "source_rate": 10 * n_packets}
+    runs = [("parsed", old_packet_in_handler, stub_wrapper(known, {})),
+            ("shipped", Wrapper._packet_in_handler,
+             stub_wrapper(known_raw, {})),
+            ("limited", Wrapper._packet_in_handler,
+             stub_wrapper(known_raw, limited))]
+    results = []
+    for name, handler, wrapper in runs:
+        elapsed, events = timeit(dispatch, handler, wrapper, evs)
+        results.append((name, elapsed, events))
+    # All of them must pass on the same events
+    assert len(set(events for name, elapsed, events in results)) == 1
+    parsed_time = results[0][1]
+    print "%10s %10s %10s %14s %8s" % ("handler", "packets", "events",
+                                       "packets/s", "speedup")
+    for name, elapsed, events in results:
+        print "%10s %10d %10d %14.0f %7.1fx" % \
+            (name, len(evs), events, len(evs) / elapsed,
+             parsed_time / elapsed)
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else PACKETS)
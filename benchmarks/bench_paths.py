@@ -0,0 +1,68 @@
+# Update time of the path engine against topology size.
+#
+# For every size a random edge is flapped (deleted then re-added) and the
+# time spent to bring paths/pathlens up to date is compared between a
+# full nx.shortest_path recompute and IncrementalPaths.
+#
+# Usage: python bench_paths.py [size ...]
+import sys
+import random
+
+import networkx as nx
+
+from common import random_topology, timeit
+from paths import IncrementalPaths
+
+SIZES = [50, 100, 200, 400, 800]
+FLAPS = 20
+
+
+def full_recompute(graph):
+    paths = nx.shortest_path(graph)
+    pathlens = {}
+    for src in paths:
+        pathlens[src] = {}
+        for dst in paths[src]:
+            pathlens[src][dst] = len(paths[src][dst])
+    return paths, pathlens
+
+
+def bench(size, rand):
+    graph = random_topology(size, seed=rand.randint(0, 2 ** 31))
+    engine = IncrementalPaths(graph.copy())
+    edges = list(graph.edges())
+    full_time = 0.0
+    inc_time = 0.0
+    updated = engine.updated
+    for i in xrange(FLAPS):
+        u, v = rand.choice(edges)
+        graph.remove_edge(u, v)
+        full_time += timeit(full_recompute, graph)[0]
+        graph.add_edge(u, v)
+        full_time += timeit(full_recompute, graph)[0]
+        inc_time += timeit(engine.remove_edge, u, v)[0]
+        inc_time += timeit(engine.add_edge, u, v)[0]
+    assert engine.pathlens == full_recompute(graph)[1]
+    updates = FLAPS * 2
+    return {"size": size,
+            "edges": len(edges),
+            "full_ms": full_time / updates * 1000,
+            "incremental_ms": inc_time / updates * 1000,
+            "sources_per_update": float(engine.updated - updated) / updates}
+
+
+def main(sizes):
+    rand = random.Random(0)
+    print "%8s %8s %12s %16s %10s %10s" % ("switches", "links", "full(ms)",
+                                           "incremental(ms)", "speedup",
+                                           "src/update")
+    for size in sizes:
+        r = bench(size, rand)
+        print "%8d %8d %12.2f %16.2f %9.1fx %10.1f" % \
+            (r["size"], r["edges"], r["full_ms"], r["incremental_ms"],
+             r["full_ms"] / max(r["incremental_ms"], 1e-9),
+             r["sources_per_update"])
+
+
+if __name__ == "__main__":
+    main([int(arg) for arg in sys.argv[1:]] or SIZES)
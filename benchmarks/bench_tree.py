@@ -0,0 +1,105 @@
+# Full tree rebuild time of Shortest_Path_Heuristic, as run on topology
+# changes, against the former scan over (tree node x pending client).
+#
+# Runs over the mininet/sample*.json topologies and larger synthetic
+# graphs with a growing number of receiving switches.
+#
+# Usage: python bench_tree.py [size ...]
+import os
+import sys
+import random
+
+from common import SAMPLES, load_topology, random_topology, timeit
+from algorithms import Shortest_Path_Heuristic
+from paths import IncrementalPaths
+
+SIZES = [100, 200, 400]
+ROUNDS = 5
+
+
+def legacy_build(stream, paths, pathlens):
+    # _topology_changed_handler before the heap rewrite
+    new_tree = {}
+    new_tree[stream["src"]["dpid"]] = {"parent": -1,
+                                       "children": set()}
+    in_nodes = set(new_tree.keys())
+    pending = stream["clients"].keys()
+    while len(pending) != 0:
+        next_to_add = None
+        branch = None
+        dist = 2 ** 31
+        for node in in_nodes:
+            if node in pathlens:
+                for to_add in pending:
+                    if to_add in pathlens[node] and \
+                            pathlens[node][to_add] < dist:
+                                next_to_add = to_add
+                                branch = node
+                                dist = pathlens[node][to_add]
+        if next_to_add is None:
+            return None
+        pending.remove(next_to_add)
+        for i in xrange(pathlens[branch][next_to_add]):
+            node = paths[branch][next_to_add][i]
+            if node not in new_tree:
+                parent = paths[branch][next_to_add][i-1]
+                new_tree[node] = {"parent": parent,
+                                  "children": set()}
+            if i < pathlens[branch][next_to_add]-1:
+                child = paths[branch][next_to_add][i+1]
+                new_tree[node]["children"].add(child)
+            in_nodes.add(node)
+    return new_tree
+
+
+def make_stream(graph, n_clients, rand):
+    nodes = list(graph.nodes())
+    src = rand.choice(nodes)
+    clients = rand.sample(nodes, min(n_clients, len(nodes)))
+    return {"src": {"dpid": src},
+            "clients": dict((dpid, set([1])) for dpid in clients),
+            "m_tree": {}}
+
+
+def bench(name, graph, n_clients, rand):
+    engine = IncrementalPaths(graph)
+    algorithm = Shortest_Path_Heuristic()
+    legacy_time = 0.0
+    heap_time = 0.0
+    legacy_cost = 0
+    heap_cost = 0
+    for i in xrange(ROUNDS):
+        stream = make_stream(graph, n_clients, rand)
+        elapsed, tree = timeit(legacy_build, stream,
+                               engine.paths, engine.pathlens)
+        legacy_time += elapsed
+        legacy_cost += len(tree) - 1
+        elapsed, (tree, mod_nodes) = timeit(
+            algorithm._topology_changed_handler, stream,
+            engine.paths, engine.pathlens, None)
+        heap_time += elapsed
+        heap_cost += len(tree) - 1
+    print "%-14s %7d %8d %12.2f %10.2f %9.1fx %10.1f %10.1f" % \
+        (name, graph.number_of_nodes(), n_clients,
+         legacy_time / ROUNDS * 1000, heap_time / ROUNDS * 1000,
+         legacy_time / max(heap_time, 1e-9),
+         float(legacy_cost) / ROUNDS, float(heap_cost) / ROUNDS)
+
+
+def main(sizes):
+    rand = random.Random(0)
+    print "%-14s %7s %8s %12s %10s %10s %10s %10s" % \
+        ("topology", "nodes", "clients", "legacy(ms)", "heap(ms)",
+         "speedup", "legacy_cost", "heap_cost")
+    for fname in SAMPLES:
+        graph = load_topology(fname)
+        bench(os.path.basename(fname), graph, graph.number_of_nodes() / 2,
+              rand)
+    for size in sizes:
+        graph = random_topology(size, seed=rand.randint(0, 2 ** 31))
+        for n_clients in (size / 10, size / 2, size):
+            bench("synthetic", graph, n_clients, rand)
+
+
+if __name__ == "__main__":
+    main([int(arg) for arg in sys.argv[1:]] or SIZES)
@@ -0,0 +1,70 @@
+import os
+import sys
+import json
+import time
+import random
+
+import networkx as nx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Controller modules use flat imports (events, addrs, ...), as they do
+# when started from ryu/ by ryu-manager
+sys.path.insert(0, os.path.join(ROOT, "ryu"))
+# For topogen, topo.py next to it needs mininet
+sys.path.append(os.path.join(ROOT, "mininet"))
+
+from links import link_attrs
+
+SAMPLES = [os.path.join(ROOT, "mininet", name)
+           for name in ("sample.json", "sample2.json", "sample3.json")]
+
+
+def load_topology(fname):
+    with open(fname) as f:
+        topo = json.load(f)
+    graph = nx.Graph()
+    for node_info in topo["nodes"]:
+        # Hosts are attached to "ext" switches only, like mininet/topo.py
+        graph.add_node(node_info["id"], type=node_info.get("type", "ext"))
+    defaults = link_attrs(topo.get("defaults", {}).get("link"))
+    for link_info in topo["links"]:
+        # bw, delay and jitter of the link as edge attributes
+        graph.add_edge(link_info["src"], link_info["dst"],
+                       **link_attrs(link_info.get("args"), defaults))
+    return graph
+
+
+def generated_topology(model, seed=None, **params):
+    # One of the topogen models, params are those of its function
+    import topogen
+    if model == "fattree":
+        topo = topogen.fattree(**params)
+    elif model == "waxman":
+        topo = topogen.waxman(seed=seed, **params)
+    elif model == "ba":
+        topo = topogen.barabasi_albert(seed=seed, **params)
+    elif model == "transit-stub":
+        topo = topogen.transit_stub(seed=seed, **params)
+    else:
+        raise ValueError("unknown topology model %s" % model)
+    graph = nx.Graph()
+    for node_id, node_type, as_ in topo.nodes:
+        graph.add_node(node_id, type=node_type)
+    defaults = link_attrs(topo.defaults)
+    for src, dst, args in topo.links:
+        graph.add_edge(src, dst, **link_attrs(args, defaults))
+    return graph
+
+
+def random_topology(n, degree=4, seed=None):
+    # Connected graph with dpids starting at 1, like the sample topologies
+    rand = random.Random(seed)
+    graph = nx.connected_watts_strogatz_graph(n, max(degree, 2), 0.3,
+                                              seed=rand.randint(0, 2 ** 31))
+    return nx.relabel_nodes(graph, dict((i, i+1) for i in xrange(n)))
+
+
+def timeit(func, *args, **kwargs):
+    begin = time.time()
+    result = func(*args, **kwargs)
+    return time.time() - begin, result
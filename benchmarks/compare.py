@@ -0,0 +1,92 @@
+# Compares two result files of suite.py, e.g. of two commits. Every
+# metric is lower-is-better; run times are noisy and get their own
+# threshold and a floor below which changes are noise. Exits with 1 when
+# a metric regressed.
+#
+# Usage: python compare.py base.json new.json [--threshold PCT]
+#                          [--time-threshold PCT] [--min-time MS] [--all]
+import sys
+import json
+import argparse
+
+
+def time_ms(name, value):
+    # Value of a run time metric in ms, None for other metrics
+    if name.endswith("_time_s"):
+        return value * 1000
+    if "_ms_" in name:
+        return value
+    return None
+
+
+def change(old, new):
+    if old == new:
+        return 0.0
+    if old == 0:
+        return float("inf")
+    return (new - old) * 100.0 / old
+
+
+def compare(base, new, threshold, time_threshold, min_time, show_all):
+    regressions = 0
+    print "base %s (%s), new %s (%s)" % (base.get("revision"), base["time"],
+                                         new.get("revision"), new["time"])
+    print "%-20s %-26s %12s %12s %9s" % ("case", "metric", "base", "new",
+                                         "change")
+    for name in sorted(set(base["cases"]) | set(new["cases"])):
+        if name not in base["cases"] or name not in new["cases"]:
+            print "%-20s only in %s" % (name, "base" if name in base["cases"]
+                                        else "new")
+            continue
+        old_metrics = base["cases"][name]["metrics"]
+        new_metrics = new["cases"][name]["metrics"]
+        for metric in sorted(set(old_metrics) & set(new_metrics)):
+            old = old_metrics[metric]
+            curr = new_metrics[metric]
+            pct = change(old, curr)
+            limit = threshold
+            noise = False
+            if time_ms(metric, old) is not None:
+                limit = time_threshold
+                noise = abs(time_ms(metric, curr - old)) < min_time
+            mark = ""
+            if noise:
+                pass
+            elif pct > limit:
+                mark = " REGRESSION"
+                regressions += 1
+            elif pct < -limit:
+                mark = " improved"
+            if mark or show_all:
+                print "%-20s %-26s %12.3f %12.3f %+8.1f%%%s" % \
+                    (name, metric, old, curr, pct, mark)
+    print "%d regression(s)" % regressions
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("base")
+    parser.add_argument("new")
+    parser.add_argument("--threshold", type=float, default=0.0,
+                        help="allowed increase in percent, counts and "
+                             "costs are deterministic for a seed")
+    parser.add_argument("--time-threshold", type=float, default=25.0,
+                        help="allowed increase of run times in percent")
+    parser.add_argument("--min-time", type=float, default=1.0,
+                        help="run time changes below this many ms are "
+                             "noise")
+    parser.add_argument("--all", action="store_true",
+                        help="show unchanged metrics too")
+    args = parser.parse_args()
+    with open(args.base) as f:
+        base = json.load(f)
+    with open(args.new) as f:
+        new = json.load(f)
+    if compare(base, new, args.threshold, args.time_threshold,
+               args.min_time, args.all):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
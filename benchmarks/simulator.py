@@ -0,0 +1,490 @@
+# In-process controller simulator. Drives ARPProxy, Switching and
+# Streaming with synthesized topology, host, packet-in and stream events,
+# without Mininet, switches or VLC. Datapaths are fakes that record every
+# OpenFlow message and answer barriers right away.
+#
+# Reports events/s and OpenFlow messages per event for every phase of
+# the scenario and the latency of every event handler. Events are the
+# ones the scenario injects, "handled" also counts the events the apps
+# raise themselves and the barrier replies.
+#
+# Usage: python simulator.py [-f topo.json | -n switches] [--streams N]
+#                            [--clients N] [--failures N] [--seed N]
+#                            [--conf conf.json] [--json out.json]
+import json
+import time
+import logging
+import random
+import struct
+import argparse
+from collections import deque
+
+from common import SAMPLES, load_topology, random_topology
+from ryu.controller import ofp_event
+from ryu.controller import handler
+from ryu.ofproto import ofproto_v1_3, ofproto_v1_3_parser
+from ryu.lib.dpid import dpid_to_str
+from ryu.lib.port_no import port_no_to_str
+from ryu.lib.packet import packet, ethernet, arp, ipv4, udp
+from ryu.topology.event import *
+
+from arp_proxy import ARPProxy
+from switching import Switching
+from streaming import Streaming
+from batcher import FlowBatcher
+from links import link_attrs
+from metrics import *
+from events import *
+
+# Port of the host on every switch that has one, links come after it
+HOST_PORT = 1
+
+OFPT_NAMES = dict((value, name[5:])
+                  for name, value in vars(ofproto_v1_3).items()
+                  if name.startswith("OFPT_"))
+
+DEFAULT_CONF = {
+    "Streaming": {"default_band": 10, "link_bw": 10},
+    "FlowBatcher": {"mode": "barrier"}
+}
+
+
+class FakeDatapath(object):
+    # Enough of ryu.controller.controller.Datapath for the apps
+
+    def __init__(self, sim, dpid):
+        super(FakeDatapath, self).__init__()
+        self.sim = sim
+        self.id = dpid
+        self.address = ("sim", dpid)
+        self.ofproto = ofproto_v1_3
+        self.ofproto_parser = ofproto_v1_3_parser
+        self.xid = 0
+
+    def set_xid(self, msg):
+        self.xid = (self.xid + 1) & self.ofproto.MAX_XID
+        msg.set_xid(self.xid)
+        return self.xid
+
+    def send_msg(self, msg):
+        if msg.xid is None:
+            self.set_xid(msg)
+        msg.serialize()
+        return self.send(msg.buf)
+
+    def send(self, buf):
+        buf = str(buf)
+        offset = 0
+        while offset < len(buf):
+            version, msg_type, msg_len, xid = \
+                struct.unpack_from("!BBHI", buf, offset)
+            self.sim.record(self, msg_type, xid)
+            offset += msg_len
+        return True
+
+
+class FakeDPSet(object):
+
+    def __init__(self):
+        super(FakeDPSet, self).__init__()
+        self.dps = {}
+
+    def get(self, dpid):
+        return self.dps.get(dpid)
+
+    def get_all(self):
+        return self.dps.items()
+
+
+class FakePort(object):
+
+    def __init__(self, dpid, port_no):
+        super(FakePort, self).__init__()
+        self.dpid = dpid
+        self.port_no = port_no
+
+    def to_dict(self):
+        return {"dpid": dpid_to_str(self.dpid),
+                "port_no": port_no_to_str(self.port_no),
+                "hw_addr": "00:00:00:00:00:00",
+                "name": "s%d-eth%d" % (self.dpid, self.port_no)}
+
+
+class FakeSwitch(object):
+
+    def __init__(self, dpid, ports):
+        super(FakeSwitch, self).__init__()
+        self.dpid = dpid
+        self.ports = [FakePort(dpid, port_no) for port_no in ports]
+
+    def to_dict(self):
+        return {"dpid": dpid_to_str(self.dpid),
+                "ports": [port.to_dict() for port in self.ports]}
+
+
+class FakeLink(object):
+
+    def __init__(self, src, src_port, dst, dst_port):
+        super(FakeLink, self).__init__()
+        self.src = FakePort(src, src_port)
+        self.dst = FakePort(dst, dst_port)
+
+    def to_dict(self):
+        return {"src": self.src.to_dict(), "dst": self.dst.to_dict()}
+
+
+class Simulator(object):
+    # Plays the part of ryu-manager and the Wrapper app: owns the apps,
+    # delivers events to their handlers one at a time and stands in for
+    # the switches
+
+    def __init__(self, graph, conf=None):
+        super(Simulator, self).__init__()
+        self.graph = graph
+        self.conf = conf if conf is not None else DEFAULT_CONF
+        self.dpset = FakeDPSet()
+        self.queue = deque()
+        # Ports like mininet numbers them, the host first
+        self.hosts = {}
+        self.port_of = {}
+        next_port = {}
+        for dpid in sorted(graph.nodes()):
+            next_port[dpid] = 1
+            if graph.node[dpid].get("type", "ext") == "ext":
+                hid = len(self.hosts) + 1
+                self.hosts[dpid] = Host("00:00:00:00:%02x:%02x" %
+                                        (hid / 256, hid % 256),
+                                        "192.18.%d.%d" % (hid / 256,
+                                                          hid % 256),
+                                        dpid, HOST_PORT)
+                next_port[dpid] = HOST_PORT + 1
+        for u, v in sorted(graph.edges()):
+            for a, b in ((u, v), (v, u)):
+                self.port_of[(a, b)] = next_port[a]
+                next_port[a] += 1
+
+        self.batcher = FlowBatcher()
+        self.arp_proxy = ARPProxy()
+        self.switching = Switching()
+        self.streaming = Streaming()
+        self.apps = [self.batcher, self.arp_proxy, self.switching,
+                     self.streaming]
+        for app in self.apps:
+            handler.register_instance(app)
+            app.send_event_to_observers = self.publish
+            app.send_event = self._send_event
+            name = app.__class__.__name__
+            if name in self.conf:
+                app.config(self.conf[name])
+        self.batcher.reg_DPSet(self.dpset)
+        self.arp_proxy.reg_DPSet(self.dpset)
+        self.arp_proxy.set_wrapper(self)
+        self.switching.reg_DPSet(self.dpset)
+        self.switching.set_wrapper(self)
+        self.switching.reg_batcher(self.batcher)
+        self.switching.reg_link_costs(self.streaming.link_costs)
+        self.switching.reg_ids(self.streaming.ids)
+        self.switching.enable_multipath()
+        self.streaming.reg_DPSet(self.dpset)
+        self.streaming.reg_batcher(self.batcher)
+        # Link attributes the topology came with, as from a topology file
+        for u, v, data in graph.edges(data=True):
+            if "bw" in data:
+                self.streaming.link_costs.set_attrs(u, v, link_attrs(data))
+
+        # Current phase and its counters
+        self.phase = None
+        self.phases = []
+        # "App.handler" -> Histogram of handler run time
+        self.handlers = {}
+        # event class -> [events, messages]
+        self.events = {}
+        # OFPT name -> messages
+        self.msg_types = {}
+        self.msgs = 0
+
+    # Wrapper interface used by the apps
+    def get_flood_ports(self):
+        return [(dpid, host.port_no) for dpid, host in self.hosts.items()
+                if dpid in self.dpset.dps]
+
+    def _send_event(self, name, ev, state=None):
+        self.publish(ev)
+
+    def publish(self, ev, state=None):
+        self.queue.append(ev)
+
+    def inject(self, ev):
+        if self.phase is not None:
+            self.phase["events"] += 1
+        self.publish(ev)
+
+    def record(self, datapath, msg_type, xid):
+        self.msgs += 1
+        name = OFPT_NAMES.get(msg_type, str(msg_type))
+        self.msg_types[name] = self.msg_types.get(name, 0) + 1
+        if msg_type == ofproto_v1_3.OFPT_BARRIER_REQUEST:
+            reply = ofproto_v1_3_parser.OFPBarrierReply(datapath)
+            reply.xid = xid
+            self.publish(ofp_event.EventOFPBarrierReply(reply))
+
+    def run(self):
+        while len(self.queue) != 0:
+            self.dispatch(self.queue.popleft())
+        # Client batches wait for a hub timer that never fires here,
+        # recomputes for a hub thread polling the pool
+        if len(self.streaming.client_batches) != 0:
+            self.dispatch(EventStreamBatchFlush())
+            self.run()
+        elif len(self.streaming.recompute_jobs) != 0:
+            job = self.streaming.recompute_jobs[0]
+            job.result.wait()
+            self.dispatch(EventStreamRecomputeDone(job))
+            self.run()
+
+    def dispatch(self, ev):
+        name = ev.__class__.__name__
+        msgs = self.msgs
+        for app in self.apps:
+            for h in app.get_handlers(ev):
+                begin = time.time()
+                h(ev)
+                key = "%s.%s" % (app.__class__.__name__, h.__name__)
+                if key not in self.handlers:
+                    self.handlers[key] = Histogram(LATENCY_BOUNDS)
+                self.handlers[key].add(time.time() - begin)
+        counts = self.events.setdefault(name, [0, 0])
+        counts[0] += 1
+        counts[1] += self.msgs - msgs
+        if self.phase is not None:
+            self.phase["handled"] += 1
+
+    def begin_phase(self, name):
+        self.end_phase()
+        self.phase = {"name": name, "events": 0, "handled": 0,
+                      "msgs": self.msgs,
+                      "time": time.time()}
+
+    def end_phase(self):
+        if self.phase is None:
+            return
+        self.run()
+        phase = self.phase
+        phase["time"] = time.time() - phase["time"]
+        phase["msgs"] = self.msgs - phase["msgs"]
+        self.phases.append(phase)
+        self.phase = None
+
+    # Synthesized events
+    def switch_enter(self, dpid):
+        self.dpset.dps[dpid] = FakeDatapath(self, dpid)
+        ports = [self.port_of[(dpid, v)] for v in self.graph.neighbors(dpid)]
+        if dpid in self.hosts:
+            ports.append(HOST_PORT)
+        self.inject(EventSwitchEnter(FakeSwitch(dpid, sorted(ports))))
+
+    def switch_leave(self, dpid):
+        ports = [self.port_of[(dpid, v)] for v in self.graph.neighbors(dpid)]
+        del self.dpset.dps[dpid]
+        self.inject(EventSwitchLeave(FakeSwitch(dpid, sorted(ports))))
+
+    def link_add(self, u, v):
+        # LLDP finds both directions
+        for a, b in ((u, v), (v, u)):
+            self.inject(EventLinkAdd(FakeLink(a, self.port_of[(a, b)],
+                                               b, self.port_of[(b, a)])))
+
+    def link_delete(self, u, v):
+        for a, b in ((u, v), (v, u)):
+            self.inject(EventLinkDelete(FakeLink(a, self.port_of[(a, b)],
+                                                  b, self.port_of[(b, a)])))
+
+    def host_reg(self, dpid):
+        self.inject(EventHostReg(self.hosts[dpid]))
+
+    def packet_in(self, dpid, in_port, pkt):
+        datapath = self.dpset.get(dpid)
+        ofproto = datapath.ofproto
+        parser = datapath.ofproto_parser
+        pkt.serialize()
+        msg = parser.OFPPacketIn(datapath,
+                                 buffer_id=ofproto.OFP_NO_BUFFER,
+                                 total_len=len(pkt.data),
+                                 reason=ofproto.OFPR_NO_MATCH,
+                                 table_id=0,
+                                 cookie=0,
+                                 match=parser.OFPMatch(in_port=in_port),
+                                 data=pkt.data)
+        return msg
+
+    def arp_request(self, src, dst):
+        src_host = self.hosts[src]
+        dst_host = self.hosts[dst]
+        pkt = packet.Packet()
+        pkt.add_protocol(ethernet.ethernet(ethertype=0x0806,
+                                           dst="ff:ff:ff:ff:ff:ff",
+                                           src=src_host.mac))
+        pkt.add_protocol(arp.arp(opcode=arp.ARP_REQUEST,
+                                 src_mac=src_host.mac,
+                                 src_ip=src_host.ip,
+                                 dst_mac="00:00:00:00:00:00",
+                                 dst_ip=dst_host.ip))
+        msg = self.packet_in(src, src_host.port_no, pkt)
+        self.inject(Event_ARP_PacketIn(msg, pkt))
+
+    def unicast(self, src, dst):
+        src_host = self.hosts[src]
+        dst_host = self.hosts[dst]
+        pkt = packet.Packet()
+        pkt.add_protocol(ethernet.ethernet(ethertype=0x0800,
+                                           dst=dst_host.mac,
+                                           src=src_host.mac))
+        pkt.add_protocol(ipv4.ipv4(src=src_host.ip, dst=dst_host.ip,
+                                   proto=17))
+        pkt.add_protocol(udp.udp(src_port=5000, dst_port=5000))
+        msg = self.packet_in(src, src_host.port_no, pkt)
+        self.inject(Event_Switching_PacketIn(msg, pkt))
+
+    def source_enter(self, stream_id, dpid, rate=100):
+        host = self.hosts[dpid]
+        self.inject(EventStreamSourceEnter(stream_id, host.mac, dpid,
+                                            host.port_no, "sim.ts", rate))
+
+    def source_leave(self, stream_id):
+        self.inject(EventStreamSourceLeave(stream_id))
+
+    def client_enter(self, stream_id, dpid):
+        host = self.hosts[dpid]
+        self.inject(EventStreamClientEnter(stream_id, host.mac, dpid,
+                                            host.port_no))
+
+    def client_leave(self, stream_id, dpid):
+        host = self.hosts[dpid]
+        self.inject(EventStreamClientLeave(stream_id, host.mac, dpid,
+                                            host.port_no))
+
+    def report(self):
+        d = {
+            "phases": self.phases,
+            "events": dict((name, {"count": count, "msgs": msgs})
+                           for name, (count, msgs) in self.events.items()),
+            "handlers": dict((name, hist.to_dict())
+                             for name, hist in self.handlers.items()),
+            "msg_types": self.msg_types
+        }
+        return d
+
+    def __str__(self):
+        lines = ["%-12s %8s %8s %9s %10s %8s %10s" %
+                 ("phase", "events", "handled", "time(s)", "events/s",
+                  "msgs", "msgs/event")]
+        for phase in self.phases:
+            rate = phase["events"] / phase["time"] if phase["time"] else 0
+            per_event = float(phase["msgs"]) / max(phase["events"], 1)
+            lines.append("%-12s %8d %8d %9.3f %10.1f %8d %10.2f" %
+                         (phase["name"], phase["events"], phase["handled"],
+                          phase["time"], rate, phase["msgs"], per_event))
+        lines.append("")
+        lines.append("%-48s %7s %9s %9s %9s" %
+                     ("handler", "count", "mean(ms)", "p99(ms)", "max(ms)"))
+        for name, hist in sorted(self.handlers.items(),
+                                 key=lambda item: -item[1].sum):
+            lines.append("%-48s %7d %9.3f %9.3f %9.3f" %
+                         (name, hist.count, hist.mean() * 1000,
+                          hist.percentile(99) * 1000, hist.max * 1000))
+        lines.append("")
+        lines.append("messages: %s" % ", ".join(
+            "%s=%d" % item for item in sorted(self.msg_types.items())))
+        return "\n".join(lines)
+
+
+def run_scenario(sim, n_streams, n_clients, n_failures, seed=None):
+    # Topology comes up, hosts talk, streams start and gather clients,
+    # links fail and come back, then everybody leaves
+    rand = random.Random(seed)
+    hosts = sorted(sim.hosts.keys())
+
+    sim.begin_phase("topology")
+    for dpid in sorted(sim.graph.nodes()):
+        sim.switch_enter(dpid)
+    for u, v in sorted(sim.graph.edges()):
+        sim.link_add(u, v)
+    for dpid in hosts:
+        sim.host_reg(dpid)
+
+    sim.begin_phase("arp")
+    for src in hosts:
+        sim.arp_request(src, rand.choice(hosts))
+
+    sim.begin_phase("unicast")
+    for src in hosts:
+        dst = rand.choice(hosts)
+        if dst != src:
+            sim.unicast(src, dst)
+
+    streams = {}
+    sim.begin_phase("sources")
+    for stream_id in xrange(1, n_streams + 1):
+        src = rand.choice(hosts)
+        streams[stream_id] = (src, rand.sample(hosts,
+                                               min(n_clients, len(hosts))))
+        sim.source_enter(stream_id, src)
+
+    sim.begin_phase("joins")
+    for stream_id, (src, clients) in sorted(streams.items()):
+        for dpid in clients:
+            sim.client_enter(stream_id, dpid)
+
+    failed = rand.sample(sorted(sim.graph.edges()),
+                         min(n_failures, sim.graph.number_of_edges()))
+    sim.begin_phase("failures")
+    for u, v in failed:
+        sim.link_delete(u, v)
+
+    sim.begin_phase("recoveries")
+    for u, v in failed:
+        sim.link_add(u, v)
+
+    sim.begin_phase("leaves")
+    for stream_id, (src, clients) in sorted(streams.items()):
+        for dpid in clients:
+            sim.client_leave(stream_id, dpid)
+        sim.source_leave(stream_id)
+    sim.end_phase()
+    return sim
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-f", help="topology JSON, like mininet/sample.json",
+                        default=SAMPLES[0])
+    parser.add_argument("-n", type=int, help="random topology size")
+    parser.add_argument("--streams", type=int, default=10)
+    parser.add_argument("--clients", type=int, default=10)
+    parser.add_argument("--failures", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--conf", help="JSON with per app config")
+    parser.add_argument("--json", help="write the report to this file")
+    args = parser.parse_args()
+    # The apps log every flow at debug level
+    logging.basicConfig()
+    logging.getLogger().handlers[0].setLevel(logging.WARNING)
+
+    if args.n is not None:
+        graph = random_topology(args.n, seed=args.seed)
+    else:
+        graph = load_topology(args.f)
+    conf = None
+    if args.conf is not None:
+        with open(args.conf) as f:
+            conf = json.load(f)
+    sim = Simulator(graph, conf)
+    run_scenario(sim, args.streams, args.clients, args.failures, args.seed)
+    print sim
+    if args.json is not None:
+        with open(args.json, "w") as f:
+            json.dump(sim.report(), f, indent=2, sort_keys=True)
+
+
+if __name__ == "__main__":
+    main()
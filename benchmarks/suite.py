@@ -0,0 +1,318 @@
+# Benchmark suite for the multicast tree builders and the cost of
+# programming their trees. Every case runs the controller apps in the
+# simulator over one topology:
+#   topology, sources, joins   streams come up with their first clients
+#   rebuild                    full tree builds of every stream, alone
+#   churn                      viewers join and leave, one event at a time
+#   failures, recoveries       links fail and come back
+#   leaves                     everybody leaves
+# and records for every cal_flows_for_stream call its run time, the cost
+# of the resulting tree, the switches that got flow/group/meter mods and
+# the OpenFlow messages sent. Results are stored as JSON, compare.py
+# compares two of them.
+#
+# A case is a dict like the ones in CASES, --cases loads a JSON list of
+# them. "topology" is {"file": name in mininet/ or a path}, {"model":
+# "random", "n", "degree"} or a topogen model with the parameters of its
+# function. "trace" may name a JSON list of ["join"|"leave", stream_id,
+# dpid] to replay instead of the generated churn.
+#
+# Usage: python suite.py [--cases cases.json] [--case NAME ...]
+#                        [-o results.json]
+import os
+import sys
+import json
+import time
+import random
+import logging
+import argparse
+import subprocess
+
+from common import ROOT, load_topology, generated_topology, \
+    random_topology
+from simulator import Simulator, DEFAULT_CONF
+from ryu.ofproto import ofproto_v1_3
+from ryu.topology.event import EventLinkAdd
+
+from metrics import *
+
+CASES = [
+    {"name": "sample-sph", "topology": {"file": "sample.json"},
+     "streams": 3, "clients": 10, "churn": 100, "failures": 2},
+    {"name": "fattree6-sph", "topology": {"model": "fattree", "k": 6},
+     "streams": 5, "clients": 20, "churn": 200, "failures": 4},
+    {"name": "fattree6-kmb", "topology": {"model": "fattree", "k": 6},
+     "streams": 5, "clients": 20, "churn": 200, "failures": 4,
+     "algorithm": "kmb"},
+    {"name": "ba200-sph", "topology": {"model": "ba", "n": 200, "m": 2},
+     "streams": 10, "clients": 30, "churn": 300, "failures": 5},
+    {"name": "waxman300-failover",
+     "topology": {"model": "waxman", "n": 300, "degree": 4},
+     "streams": 10, "clients": 30, "churn": 300, "failures": 5,
+     "conf": {"Streaming": {"make_before_break": True, "failover": True},
+              "FlowBatcher": {"mode": "bundle"}}},
+    {"name": "transit-stub-sph",
+     "topology": {"model": "transit-stub", "transits": 3,
+                  "transit_nodes": 4, "stubs": 2, "stub_nodes": 6},
+     "streams": 10, "clients": 30, "churn": 300, "failures": 5},
+    {"name": "transit-stub-cost",
+     "topology": {"model": "transit-stub", "transits": 3,
+                  "transit_nodes": 4, "stubs": 2, "stub_nodes": 6},
+     "streams": 10, "clients": 30, "churn": 300, "failures": 5,
+     "conf": {"Streaming": {"link_cost": "composite"}}},
+]
+
+# Message types that leave the switch state alone, anything else
+# (flow/group/meter mods, bundles of them) modifies the switch
+PASSIVE_TYPES = set([ofproto_v1_3.OFPT_BARRIER_REQUEST,
+                     ofproto_v1_3.OFPT_PACKET_OUT])
+
+
+def make_graph(spec, seed):
+    spec = dict(spec)
+    if "file" in spec:
+        fname = spec["file"]
+        if not os.path.exists(fname):
+            fname = os.path.join(ROOT, "mininet", fname)
+        return load_topology(fname)
+    model = spec.pop("model")
+    if model == "random":
+        return random_topology(spec["n"], spec.get("degree", 4), seed)
+    return generated_topology(model, seed=seed, **spec)
+
+
+def case_conf(case):
+    conf = dict((name, dict(app_conf))
+                for name, app_conf in DEFAULT_CONF.items())
+    for name, app_conf in case.get("conf", {}).items():
+        conf.setdefault(name, {}).update(app_conf)
+    if "algorithm" in case:
+        conf["Streaming"]["algorithm"] = case["algorithm"]
+    return conf
+
+
+def churn_trace(streams, hosts, n_events, rand):
+    # Viewers join and leave with even odds, a stream without viewers
+    # gets a join. streams: stream_id -> set of client dpids, kept as the
+    # trace leaves them.
+    trace = []
+    for i in xrange(n_events):
+        stream_id = rand.choice(sorted(streams.keys()))
+        members = streams[stream_id]
+        others = [dpid for dpid in hosts if dpid not in members]
+        if len(others) != 0 and (len(members) == 0 or rand.random() < 0.5):
+            dpid = rand.choice(others)
+            members.add(dpid)
+            trace.append(("join", stream_id, dpid))
+        else:
+            dpid = rand.choice(sorted(members))
+            members.discard(dpid)
+            trace.append(("leave", stream_id, dpid))
+    return trace
+
+
+class Recorder(object):
+    # Wraps Streaming.cal_flows_for_stream and Simulator.record of one
+    # simulator to measure every tree update
+
+    def __init__(self, sim):
+        super(Recorder, self).__init__()
+        self.sim = sim
+        self.time = Histogram(LATENCY_BOUNDS)
+        self.calls = 0
+        self.cost = 0
+        self.mod_dpids = 0
+        self.msgs = 0
+        self.touched = set()
+        self._cal = sim.streaming.cal_flows_for_stream
+        self._record = sim.record
+        sim.streaming.cal_flows_for_stream = self.cal_flows_for_stream
+        sim.record = self.record
+
+    def record(self, datapath, msg_type, xid):
+        if msg_type not in PASSIVE_TYPES:
+            self.touched.add(datapath.id)
+        self._record(datapath, msg_type, xid)
+
+    def cal_flows_for_stream(self, stream_id, ev, callback=None):
+        self.touched = set()
+        msgs = self.sim.msgs
+        begin = time.time()
+        self._cal(stream_id, ev, callback)
+        self.time.add(time.time() - begin)
+        self.calls += 1
+        self.cost += len(self.sim.streaming.streams[stream_id]["m_tree"]) - 1
+        self.mod_dpids += len(self.touched)
+        self.msgs += self.sim.msgs - msgs
+
+    def metrics(self):
+        calls = max(self.calls, 1)
+        d = {
+            "flows_calls": self.calls,
+            "flows_time_ms_mean": self.time.sum / calls * 1000,
+            "flows_time_ms_p99": (self.time.percentile(99) or 0) * 1000,
+            "flows_cost_mean": float(self.cost) / calls,
+            "flows_mod_dpids_mean": float(self.mod_dpids) / calls,
+            "flows_mod_dpids_total": self.mod_dpids,
+            "flows_msgs_mean": float(self.msgs) / calls,
+            "flows_msgs_total": self.msgs
+        }
+        return d
+
+
+def rebuild(sim, rounds=3):
+    # Full builds of every stream by its own algorithm, as done on
+    # topology changes, without touching the installed trees
+    streaming = sim.streaming
+    hist = Histogram(LATENCY_BOUNDS)
+    cost = 0
+    ev = EventLinkAdd(None)
+    for i in xrange(rounds):
+        for stream_id, stream in sorted(streaming.streams.items()):
+            if len(stream["clients"]) == 0:
+                continue
+            algorithm = streaming.algorithms.get(stream["algorithm"])
+            begin = time.time()
+            new_tree, mod_nodes = algorithm.cal(stream, streaming.paths,
+                                                streaming.pathlens, ev)
+            hist.add(time.time() - begin)
+            if new_tree is not None:
+                cost += len(new_tree) - 1
+    builds = max(hist.count, 1)
+    d = {
+        "tree_builds": hist.count,
+        "tree_build_ms_mean": hist.sum / builds * 1000,
+        "tree_build_ms_max": (hist.max or 0) * 1000,
+        "tree_cost_mean": float(cost) / builds
+    }
+    return d
+
+
+def run_case(case):
+    seed = case.get("seed", 1)
+    rand = random.Random(seed)
+    graph = make_graph(case["topology"], seed)
+    sim = Simulator(graph, case_conf(case))
+    recorder = Recorder(sim)
+    hosts = sorted(sim.hosts.keys())
+
+    sim.begin_phase("topology")
+    for dpid in sorted(graph.nodes()):
+        sim.switch_enter(dpid)
+    for u, v in sorted(graph.edges()):
+        sim.link_add(u, v)
+    for dpid in hosts:
+        sim.host_reg(dpid)
+
+    streams = {}
+    sim.begin_phase("sources")
+    for stream_id in xrange(1, case["streams"] + 1):
+        sim.source_enter(stream_id, rand.choice(hosts))
+        streams[stream_id] = set(rand.sample(hosts, min(case["clients"],
+                                                        len(hosts))))
+
+    sim.begin_phase("joins")
+    for stream_id, clients in sorted(streams.items()):
+        for dpid in sorted(clients):
+            sim.client_enter(stream_id, dpid)
+    sim.end_phase()
+    metrics = rebuild(sim)
+
+    if "trace" in case:
+        with open(case["trace"]) as f:
+            trace = [tuple(step) for step in json.load(f)]
+    else:
+        trace = churn_trace(streams, hosts, case.get("churn", 0), rand)
+    sim.begin_phase("churn")
+    for op, stream_id, dpid in trace:
+        if op == "join":
+            sim.client_enter(stream_id, dpid)
+        else:
+            sim.client_leave(stream_id, dpid)
+        # One tree update per viewer
+        sim.run()
+
+    failed = rand.sample(sorted(graph.edges()),
+                         min(case.get("failures", 0),
+                             graph.number_of_edges()))
+    sim.begin_phase("failures")
+    for u, v in failed:
+        sim.link_delete(u, v)
+    sim.begin_phase("recoveries")
+    for u, v in failed:
+        sim.link_add(u, v)
+
+    sim.begin_phase("leaves")
+    for stream_id in sorted(sim.streaming.streams.keys()):
+        for dpid in sorted(sim.streaming.streams[stream_id]["clients"]):
+            sim.client_leave(stream_id, dpid)
+        sim.source_leave(stream_id)
+    sim.end_phase()
+
+    metrics.update(recorder.metrics())
+    for phase in sim.phases:
+        metrics["%s_msgs" % phase["name"]] = phase["msgs"]
+        metrics["%s_time_s" % phase["name"]] = phase["time"]
+    result = {
+        "case": case,
+        "switches": graph.number_of_nodes(),
+        "links": graph.number_of_edges(),
+        "metrics": metrics,
+        "flows_time": recorder.time.to_dict(),
+        "simulator": sim.report()
+    }
+    return result
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short",
+                                        "HEAD"], cwd=ROOT).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--cases", help="JSON list of cases, instead of "
+                                        "the built-in ones")
+    parser.add_argument("--case", action="append",
+                        help="only run the named case")
+    parser.add_argument("-o", help="write the results to this file")
+    args = parser.parse_args()
+    logging.basicConfig()
+    logging.getLogger().handlers[0].setLevel(logging.WARNING)
+
+    cases = CASES
+    if args.cases is not None:
+        with open(args.cases) as f:
+            cases = json.load(f)
+    if args.case is not None:
+        cases = [case for case in cases if case["name"] in args.case]
+
+    results = {
+        "revision": git_revision(),
+        "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "python": sys.version.split()[0],
+        "cases": {}
+    }
+    print "%-20s %8s %10s %10s %11s %11s %10s %10s" % \
+        ("case", "switches", "build(ms)", "tree_cost", "update(ms)",
+         "mod_dpids", "msgs/upd", "time(s)")
+    for case in cases:
+        begin = time.time()
+        result = run_case(case)
+        results["cases"][case["name"]] = result
+        m = result["metrics"]
+        print "%-20s %8d %10.3f %10.1f %11.3f %11.1f %10.1f %10.2f" % \
+            (case["name"], result["switches"], m["tree_build_ms_mean"],
+             m["tree_cost_mean"], m["flows_time_ms_mean"],
+             m["flows_mod_dpids_mean"], m["flows_msgs_mean"],
+             time.time() - begin)
+    if args.o is not None:
+        with open(args.o, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+
+if __name__ == "__main__":
+    main()
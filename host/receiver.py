@@ -1,4 +1,5 @@
 import socket
+import time
 import struct
 import eventlet
 import logging
@@ -8,6 +9,8 @@ BUFF_SIZE = 1024
 WINDOW_SIZE = 500
 PRINT_F = 1.0
 PERCENT_SYMBLE = '%'
+#Gaps between two packets longer than this (s) are logged as outages
+OUTAGE_GAP = 0.1
 
 struct1 = struct.Struct('2q6i984s')
 
@@ -26,6 +29,8 @@ class LiveStream(object):
 	__globalPacketLossRate = 0.0	#Globle packet loss rate
 	__currentPacketLossRate = 0.0	#In the last minute period, the packet loss rate
 	__currentJitter = 0.0
+	lastArrival = 0.0
+	maxOutage = 0.0
 
 	def __init__(self, flow_id, remainPacket):
 		self.__RECBuffer = []
@@ -131,6 +136,7 @@ def printThread(liveStream):
 			liveStream.getCurrentPacketLossRate(), 
 			PERCENT_SYMBLE)
 		print liveStream.totalLossCount
+		print 'stream%d longest outage: %.3fs'%(liveStream.flow_id, liveStream.maxOutage)
  
 if __name__ == '__main__':
 	#setup logging
@@ -157,10 +163,17 @@ if __name__ == '__main__':
 			block_id = unpack_data[0]
 			remainPacket = unpack_data[1]
 
+			now = time.time()
 			if flow_id in flow_map:
 				liveStream = flow_map.get(flow_id)
 				liveStream.currentBlock_id = block_id
 				liveStream.calPacketLoss()
+				#Recovery time of a tree migration shows up as an outage
+				gap = now - liveStream.lastArrival
+				if gap > OUTAGE_GAP:
+					myLoggging.info('flow_id: %d outage %.3fs, block_id: %d'%(flow_id, 
+						gap, block_id))
+					liveStream.maxOutage = max(liveStream.maxOutage, gap)
 			else:
 				liveStream = LiveStream(flow_id, remainPacket)
 				liveStream.currentBlock_id = block_id
@@ -169,6 +182,7 @@ if __name__ == '__main__':
 				thread = pool.spawn(printThread, liveStream)
 
 				flow_map[flow_id] = liveStream
+			liveStream.lastArrival = now
 
 		except socket.timeout:
 			print 'no more stream or network error'
@@ -13,6 +13,7 @@ from mininet.cli import CLI
 from mininet.log import setLogLevel, info
 
 from rpc import RPC
+import topogen
 
 
 def parseJSON(args):
@@ -22,8 +23,7 @@ def parseJSON(args):
 
 
 def genNet(args):
-    print "Generator Mode has not been implemented yet."
-    exit(1)
+    return topogen.generate(args).to_dict()
 
 
 def getPortNo(intf):
@@ -307,9 +307,7 @@ if __name__ == "__main__":
                           help="Use the input network file to construct topology")
     parser_i.set_defaults(func=parseJSON)
     parser_g = subparsers.add_parser("gen", help="Generator Mode")
-    parser_g.add_argument("-a",
-                          metavar="arguments",
-                          help="Generate and use a new network topology")
+    topogen.add_arguments(parser_g)
     parser_g.set_defaults(func=genNet)
     args = parser.parse_args()
     topo = args.func(args)
@@ -0,0 +1,347 @@
+# Synthetic topologies in the JSON schema of sample.json:
+#   fattree       k-ary fat-tree, edge switches take the hosts
+#   waxman        random geometric graph, link delay follows distance
+#   ba            Barabasi-Albert preferential attachment
+#   transit-stub  GT-ITM like multi-AS network, one AS per domain
+#
+# Needs neither Mininet nor networkx, generated graphs are connected and
+# switch ids start at 1. Large networks are written out node by node.
+#
+# Usage: python topogen.py model [options] -o out.json
+import sys
+import json
+import math
+import time
+import random
+import argparse
+
+DEFAULT_LINK = {
+    "bw": 10,
+    "delay": "5ms",
+    "jitter": "2ms",
+    "loss": 0,
+    "max_queue_size": 800
+}
+# The NAT switch of topo.py uses this dpid
+MAX_NODES = 0xffffff - 1
+
+MODELS = ("fattree", "waxman", "ba", "transit-stub")
+
+
+class Topology(object):
+    # nodes: [(id, type, as)], links: [(src, dst, args or None)]
+
+    def __init__(self, description, defaults=None):
+        super(Topology, self).__init__()
+        self.description = description
+        self.defaults = defaults if defaults is not None else DEFAULT_LINK
+        self.nodes = []
+        self.links = []
+        self.as_count = 0
+
+    def add_node(self, node_type, as_):
+        node_id = len(self.nodes) + 1
+        self.nodes.append((node_id, node_type, as_))
+        self.as_count = max(self.as_count, as_)
+        return node_id
+
+    def add_link(self, src, dst, args=None):
+        self.links.append((src, dst, args))
+
+    def link_args(self, **kwargs):
+        # TCLink arguments of a link that differs from the defaults
+        args = dict(self.defaults)
+        args.update(kwargs)
+        return args
+
+    def summary(self):
+        d = {
+            "Description": self.description,
+            "Gen-time": time.strftime("%Y-%m-%d %H:%M"),
+            "Node-count": len(self.nodes),
+            "Link-count": len(self.links),
+            "As-count": self.as_count
+        }
+        return d
+
+    def to_dict(self):
+        d = {
+            "summary": self.summary(),
+            "defaults": {"link": self.defaults},
+            "nodes": [node_dict(node) for node in self.nodes],
+            "links": [link_dict(link) for link in self.links]
+        }
+        return d
+
+    def write(self, f):
+        # One node or link per line, only the JSON text is streamed: the
+        # node and link lists are held in memory as for to_dict
+        f.write('{\n    "summary": %s,\n' % json.dumps(self.summary(),
+                                                        sort_keys=True))
+        f.write('    "defaults": %s,\n' %
+                json.dumps({"link": self.defaults}, sort_keys=True))
+        f.write('    "nodes": [')
+        sep = "\n"
+        for node in self.nodes:
+            f.write(sep + "        " + json.dumps(node_dict(node),
+                                                  sort_keys=True))
+            sep = ",\n"
+        f.write('\n    ],\n    "links": [')
+        sep = "\n"
+        for link in self.links:
+            f.write(sep + "        " + json.dumps(link_dict(link),
+                                                  sort_keys=True))
+            sep = ",\n"
+        f.write('\n    ]\n}\n')
+
+
+def node_dict(node):
+    node_id, node_type, as_ = node
+    return {"id": node_id, "type": node_type, "as": as_}
+
+
+def link_dict(link):
+    src, dst, args = link
+    d = {"src": src, "dst": dst}
+    if args is not None:
+        d["args"] = args
+    return d
+
+
+class _Components(object):
+    # Union-find over node ids
+
+    def __init__(self):
+        super(_Components, self).__init__()
+        self.parent = {}
+
+    def find(self, node):
+        root = node
+        while self.parent.get(root, root) != root:
+            root = self.parent[root]
+        while node != root:
+            self.parent[node], node = root, self.parent.get(node, node)
+        return root
+
+    def union(self, a, b):
+        a = self.find(a)
+        b = self.find(b)
+        if a != b:
+            self.parent[a] = b
+            return True
+        return False
+
+
+def connect(topo, nodes, rand, args=None):
+    # Links every component of nodes to the largest one
+    comps = _Components()
+    node_set = set(nodes)
+    for src, dst, link_args in topo.links:
+        if src in node_set and dst in node_set:
+            comps.union(src, dst)
+    members = {}
+    for node in nodes:
+        members.setdefault(comps.find(node), []).append(node)
+    groups = sorted(members.values(), key=len, reverse=True)
+    for group in groups[1:]:
+        topo.add_link(rand.choice(group), rand.choice(groups[0]), args)
+
+
+def random_domain(topo, nodes, degree, rand, args=None):
+    # Connected random graph: a random spanning tree plus chords up to
+    # the average degree
+    order = list(nodes)
+    rand.shuffle(order)
+    links = set()
+    for i in xrange(1, len(order)):
+        other = order[rand.randint(0, i - 1)]
+        links.add((min(order[i], other), max(order[i], other)))
+    target = min(len(nodes) * degree / 2,
+                 len(nodes) * (len(nodes) - 1) / 2)
+    while len(links) < target:
+        a, b = rand.sample(order, 2)
+        links.add((min(a, b), max(a, b)))
+    for src, dst in sorted(links):
+        topo.add_link(src, dst, args)
+
+
+def fattree(k):
+    # k pods of k/2 edge and k/2 aggregation switches, (k/2)^2 cores. A
+    # pod is an AS, the cores are the last one.
+    if k < 2 or k % 2 != 0:
+        raise ValueError("fat-tree needs an even k")
+    half = k / 2
+    topo = Topology("%d-ary fat-tree" % k)
+    pods = []
+    for pod in xrange(k):
+        edges = [topo.add_node("ext", pod + 1) for i in xrange(half)]
+        aggs = [topo.add_node("inn", pod + 1) for i in xrange(half)]
+        pods.append((edges, aggs))
+    cores = [topo.add_node("inn", k + 1) for i in xrange(half * half)]
+    for edges, aggs in pods:
+        for edge in edges:
+            for agg in aggs:
+                topo.add_link(edge, agg)
+        for i, agg in enumerate(aggs):
+            for core in cores[i*half:(i+1)*half]:
+                topo.add_link(agg, core)
+    return topo
+
+
+def waxman(n, alpha=0.4, beta=0.1, degree=None, seed=None):
+    # Nodes spread over the unit square, a link between u and v with
+    # probability alpha * exp(-d(u, v) / (beta * L)). With degree given,
+    # alpha is scaled to that mean degree so large networks stay sparse.
+    # Candidate pairs are drawn with geometric skips over alpha, so the
+    # cost follows the number of links rather than n^2.
+    rand = random.Random(seed)
+    topo = Topology("Waxman network, %d nodes" % n)
+    points = {}
+    for i in xrange(n):
+        node = topo.add_node("ext", 1)
+        points[node] = (rand.random(), rand.random())
+    size = math.sqrt(2)
+    if degree is not None:
+        # Mean of exp(-d / (beta * L)) over random pairs
+        samples = 2000
+        mean = sum(math.exp(-_distance(
+            (rand.random(), rand.random()),
+            (rand.random(), rand.random())) / (beta * size))
+            for i in xrange(samples)) / samples
+        alpha = min(1.0, degree / ((n - 1) * mean))
+    nodes = sorted(points.keys())
+    log_q = math.log(1 - alpha) if alpha < 1 else None
+    for i, u in enumerate(nodes):
+        j = i
+        while True:
+            if log_q is None:
+                j += 1
+            else:
+                j += 1 + int(math.log(1 - rand.random()) / log_q)
+            if j >= len(nodes):
+                break
+            v = nodes[j]
+            dist = _distance(points[u], points[v])
+            if rand.random() < math.exp(-dist / (beta * size)):
+                topo.add_link(u, v, _delay_args(topo, dist))
+    connect(topo, nodes, rand)
+    return topo
+
+
+def _distance(a, b):
+    return math.sqrt((a[0] - b[0]) ** 2 + (a[1] - b[1]) ** 2)
+
+
+def _delay_args(topo, dist):
+    # Propagation delay over a square of 2000km sides
+    return topo.link_args(delay="%dms" % max(1, int(dist * 10)))
+
+
+def barabasi_albert(n, m=2, seed=None):
+    # Every new node links to m existing ones picked by degree, from a
+    # clique of m+1 nodes
+    if n <= m:
+        raise ValueError("Barabasi-Albert needs more than m nodes")
+    rand = random.Random(seed)
+    topo = Topology("Barabasi-Albert network, %d nodes, m=%d" % (n, m))
+    nodes = [topo.add_node("ext", 1) for i in xrange(m + 1)]
+    # Every node once per link end
+    ends = []
+    for i in xrange(len(nodes)):
+        for j in xrange(i + 1, len(nodes)):
+            topo.add_link(nodes[i], nodes[j])
+            ends += [nodes[i], nodes[j]]
+    for i in xrange(n - m - 1):
+        node = topo.add_node("ext", 1)
+        targets = set()
+        while len(targets) < m:
+            targets.add(rand.choice(ends))
+        for target in sorted(targets):
+            topo.add_link(target, node)
+            ends += [target, node]
+    return topo
+
+
+def transit_stub(transits=2, transit_nodes=4, stubs=3, stub_nodes=8,
+                 degree=3, seed=None):
+    # Transit domains are fully meshed with each other, every transit
+    # node carries stubs stub domains. Each domain is an AS; transit
+    # switches are "inn", stub switches take the hosts.
+    rand = random.Random(seed)
+    topo = Topology("Transit-stub network, %d transit domains" % transits)
+    core_args = topo.link_args(bw=100, delay="10ms")
+    transit_args = topo.link_args(bw=100, delay="2ms")
+    uplink_args = topo.link_args(bw=50, delay="5ms")
+    as_ = 0
+    domains = []
+    for t in xrange(transits):
+        as_ += 1
+        nodes = [topo.add_node("inn", as_) for i in xrange(transit_nodes)]
+        random_domain(topo, nodes, degree, rand, transit_args)
+        domains.append(nodes)
+    for i in xrange(len(domains)):
+        for j in xrange(i + 1, len(domains)):
+            topo.add_link(rand.choice(domains[i]), rand.choice(domains[j]),
+                          core_args)
+    for nodes in domains:
+        for transit in nodes:
+            for s in xrange(stubs):
+                as_ += 1
+                stub = [topo.add_node("ext", as_)
+                        for i in xrange(stub_nodes)]
+                random_domain(topo, stub, degree, rand)
+                topo.add_link(transit, rand.choice(stub), uplink_args)
+    return topo
+
+
+def add_arguments(parser):
+    parser.add_argument("model", choices=MODELS)
+    parser.add_argument("-n", type=int, default=100,
+                        help="switches, waxman and ba")
+    parser.add_argument("-k", type=int, default=4, help="fat-tree arity")
+    parser.add_argument("-m", type=int, default=2,
+                        help="links of every new ba node")
+    parser.add_argument("--alpha", type=float, default=0.4)
+    parser.add_argument("--beta", type=float, default=0.1)
+    parser.add_argument("--degree", type=float,
+                        help="mean degree, waxman alpha is scaled to it")
+    parser.add_argument("--transits", type=int, default=2)
+    parser.add_argument("--transit-nodes", type=int, default=4)
+    parser.add_argument("--stubs", type=int, default=3,
+                        help="stub domains per transit node")
+    parser.add_argument("--stub-nodes", type=int, default=8)
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("-o", metavar="out_file",
+                        help="write the topology to this file")
+
+
+def generate(args):
+    if args.model == "fattree":
+        topo = fattree(args.k)
+    elif args.model == "waxman":
+        topo = waxman(args.n, args.alpha, args.beta, args.degree, args.seed)
+    elif args.model == "ba":
+        topo = barabasi_albert(args.n, args.m, args.seed)
+    else:
+        topo = transit_stub(args.transits, args.transit_nodes, args.stubs,
+                            args.stub_nodes, seed=args.seed)
+    if len(topo.nodes) > MAX_NODES:
+        raise ValueError("%d switches do not fit in the dpid space" %
+                         len(topo.nodes))
+    if args.o is not None:
+        with open(args.o, "w") as f:
+            topo.write(f)
+    return topo
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="SDN Demo - Topology "
+                                                 "Generator")
+    add_arguments(parser)
+    args = parser.parse_args()
+    topo = generate(args)
+    if args.o is None:
+        topo.write(sys.stdout)
+    else:
+        print "%d switches, %d links written to %s" % \
+            (len(topo.nodes), len(topo.links), args.o)
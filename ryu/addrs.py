@@ -40,12 +40,7 @@ def eth_text_to_int(eth_text):
     if eth_text == 0:
         return 0
     assert isinstance(eth_text, str)
-    array = struct.unpack('6B', addrconv.mac.text_to_bin(eth_text))
-    eth_int = 0
-    for i in array:
-        eth_int <<= 8
-        eth_int += i
-    return eth_int
+    return int(eth_text.replace(":", ""), 16)
 
 
 def is_multicast(haddr):
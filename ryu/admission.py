@@ -0,0 +1,189 @@
+import time
+from collections import deque
+
+# What happens to a stream or viewer that does not fit:
+#   "off": everything is admitted
+#   "reject": turned down
+#   "queue": viewers wait until their branch has room, sources are
+#            turned down
+#   "downrate": the stream is metered down at its source to what fits,
+#               turned down below min_rate
+ADMISSION_MODES = ("off", "reject", "queue", "downrate")
+
+
+def make_decision(kind, rate, reason=None):
+    d = {"decision": kind, "rate": rate}
+    if reason is not None:
+        d["reason"] = reason
+    return d
+
+
+class AdmissionControl(object):
+    # Checks the rate of a stream against the bandwidth left on the
+    # links it would take: every link of the switch for a new source
+    # (it must fit through one of them), the branch from the tree to
+    # the new viewer's switch for a join. Links are filled to limit of
+    # their bw, loads are those of Streaming.link_load.
+
+    def __init__(self, network):
+        super(AdmissionControl, self).__init__()
+        # Streaming, for streams, paths, loads and capacities
+        self.network = network
+        self.mode = "off"
+        self.limit = 1.0
+        # Kbps, meter bands are set in whole Mbps
+        self.min_rate = 1000
+        self.queue_size = 100
+        self.queue_timeout = 60.0
+        # (queued time, EventStreamClientEnter) of waiting viewers
+        self.queue = deque()
+        # decision -> count
+        self.counts = {}
+        self.expired = 0
+
+    def config(self, conf):
+        mode = conf.get("admission", "off")
+        if mode not in ADMISSION_MODES:
+            print "unknown admission mode %s, using off" % mode
+            mode = "off"
+        self.mode = mode
+        self.limit = conf.get("admission_limit", 1.0)
+        self.min_rate = conf.get("admission_min_rate", 1000)
+        self.queue_size = conf.get("admission_queue_size", 100)
+        self.queue_timeout = conf.get("admission_queue_timeout", 60.0)
+
+    def residual(self, link, extra=None):
+        load = self.network.link_load(link)
+        if extra is not None:
+            load += extra.get(link, 0)
+        return self.limit * self.network.link_capacity(link) - load
+
+    def branch_links(self, stream, dpid):
+        # Links the tree would grow by for a viewer at dpid, None when
+        # the tree cannot reach it
+        m_tree = stream["m_tree"]
+        if dpid in m_tree:
+            return set()
+        paths = self.network.paths
+        pathlens = self.network.pathlens
+        engine = getattr(paths, "engine", None)
+        if hasattr(engine, "nearest_node"):
+            branch = engine.nearest_node(m_tree.keys(), dpid)
+        else:
+            branch = None
+            for node in m_tree.keys():
+                dist = pathlens.get(node, {}).get(dpid)
+                if dist is not None and \
+                        (branch is None or dist < pathlens[branch][dpid]):
+                    branch = node
+        if branch is None:
+            return None
+        path = paths[branch][dpid]
+        return set((min(u, v), max(u, v)) for u, v in zip(path, path[1:]))
+
+    def fit(self, rate, residual, what):
+        # Decision for rate against the bandwidth left, what names the
+        # bottleneck for the reason
+        if rate <= residual:
+            return make_decision("admitted", rate)
+        reason = "%s has %d of %d Kbps left" % (what, max(residual, 0), rate)
+        if self.mode == "downrate":
+            new_rate = int(residual / 1000) * 1000
+            if new_rate >= self.min_rate:
+                return make_decision("downrated", new_rate, reason)
+        return make_decision("rejected", rate, reason)
+
+    def check_source(self, ev):
+        if self.mode == "off":
+            return self.count(make_decision("admitted", ev.rate))
+        links = self.network.dpid_to_links.get(ev.src_dpid, ())
+        if len(links) == 0:
+            return self.count(make_decision("admitted", ev.rate))
+        link = max(links, key=self.residual)
+        return self.count(self.fit(ev.rate, self.residual(link),
+                                   "link %d-%d" % link))
+
+    def check_client(self, ev, extra=None):
+        stream = self.network.streams[ev.stream_id]
+        rate = self.network.stream_rate(ev.stream_id)
+        if self.mode == "off":
+            return self.count(make_decision("admitted", rate))
+        links = self.branch_links(stream, ev.dpid)
+        # Kept for pending_loads while the join waits in a batch
+        ev.branch = links
+        if links is None:
+            # Nothing to reserve, the tree will fail to reach it anyway
+            return self.count(make_decision("admitted", rate))
+        if len(links) == 0:
+            return self.count(make_decision("admitted", rate))
+        link = min(links, key=lambda link: self.residual(link, extra))
+        result = self.fit(rate, self.residual(link, extra),
+                          "link %d-%d" % link)
+        if result["decision"] == "rejected" and self.mode == "queue":
+            if len(self.queue) < self.queue_size:
+                self.queue.append((time.time(), ev))
+                result["decision"] = "queued"
+                result["position"] = len(self.queue)
+        return self.count(result)
+
+    def count(self, result):
+        kind = result["decision"]
+        self.counts[kind] = self.counts.get(kind, 0) + 1
+        return result
+
+    def admit_queued(self, extra=None):
+        # Viewers of the queue that fit now, in order. The branches of
+        # the ones admitted are counted for the ones after them.
+        if len(self.queue) == 0:
+            return []
+        now = time.time()
+        admitted = []
+        waiting = deque()
+        extra = dict(extra or {})
+        while len(self.queue) != 0:
+            queued, ev = self.queue.popleft()
+            if now - queued > self.queue_timeout or \
+                    ev.stream_id not in self.network.streams:
+                self.expired += 1
+                continue
+            stream = self.network.streams[ev.stream_id]
+            links = self.branch_links(stream, ev.dpid)
+            rate = self.network.stream_rate(ev.stream_id)
+            if links is not None and len(links) != 0 and \
+                    min(self.residual(link, extra) for link in links) < rate:
+                waiting.append((queued, ev))
+                continue
+            for link in links or ():
+                extra[link] = extra.get(link, 0) + rate
+            ev.branch = links
+            ev.admission = self.count(make_decision("admitted", rate))
+            admitted.append(ev)
+        self.queue = waiting
+        return admitted
+
+    def pending_loads(self, joins, stream_id=None):
+        # link -> Kbps the branches of joins admitted but not in their
+        # trees yet will carry, once per stream. The links of stream_id
+        # are left out, another viewer of it shares them.
+        stream_links = {}
+        for ev in joins:
+            if ev.stream_id == stream_id or \
+                    ev.stream_id not in self.network.streams:
+                continue
+            stream_links.setdefault(ev.stream_id, set()).update(
+                getattr(ev, "branch", None) or ())
+        extra = {}
+        for other, links in stream_links.items():
+            rate = self.network.stream_rate(other)
+            for link in links:
+                extra[link] = extra.get(link, 0) + rate
+        return extra
+
+    def to_dict(self):
+        d = {
+            "mode": self.mode,
+            "counts": self.counts,
+            "queued": len(self.queue),
+            "expired": self.expired
+        }
+        return d
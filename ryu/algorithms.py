@@ -1,62 +1,156 @@
-from copy import deepcopy
+import time
+from functools import partial
+from heapq import heappush, heappop
 
+from paths import LazyPaths, MatrixPaths
+from trees import MulticastTree
 
+# name -> tree builder class, filled by register_algorithm
+TREE_ALGORITHMS = {}
+
+
+def register_algorithm(name):
+    def _register(cls):
+        cls.name = name
+        TREE_ALGORITHMS[name] = cls
+        return cls
+    return _register
+
+
+class AlgorithmRegistry(object):
+    # Tree builder instances, created on first use, and the build
+    # statistics of each of them
+
+    def __init__(self, network, default="sph"):
+        super(AlgorithmRegistry, self).__init__()
+        # Gives the builders access to graph, link load and capacity
+        self.network = network
+        self.default = default
+        self.instances = {}
+        # name -> {builds, failures, time, cost, load}, time/cost/load
+        # are summed over builds, last_* hold the latest build
+        self.stats = {}
+
+    def get(self, name=None):
+        if name is None:
+            name = self.default
+        if name not in self.instances:
+            if name in TREE_ALGORITHMS:
+                self.instances[name] = TREE_ALGORITHMS[name](self.network)
+            else:
+                print "unknown tree algorithm %s, using %s" % \
+                    (name, self.default)
+                self.instances[name] = self.get(self.default)
+        return self.instances[name]
+
+    def cal(self, name, stream, paths, pathlens, ev):
+        algorithm = self.get(name)
+        begin = time.time()
+        new_tree, mod_nodes = algorithm.cal(stream, paths, pathlens, ev)
+        self.record(name, stream, new_tree, time.time() - begin)
+        return new_tree, mod_nodes
+
+    def record(self, name, stream, new_tree, elapsed):
+        # Build statistics, also for trees built in another process
+        algorithm = self.get(name)
+        stats = self.stats.setdefault(algorithm.name, {"builds": 0,
+                                                       "failures": 0,
+                                                       "time": 0.0,
+                                                       "cost": 0,
+                                                       "load": 0})
+        stats["builds"] += 1
+        stats["time"] += elapsed
+        if new_tree is None:
+            stats["failures"] += 1
+        else:
+            # Every tree node but the source holds one link
+            cost = len(new_tree) - 1
+            stats["cost"] += cost
+            stats["load"] += cost * stream["rate"]
+            stats["last_cost"] = cost
+        stats["last_time"] = elapsed
+
+
+@register_algorithm("sph")
 class Shortest_Path_Heuristic(object):
 
-    def __init__(self):
+    def __init__(self, network=None):
         super(Shortest_Path_Heuristic, self).__init__()
+        self.network = network
         self.event_map = {"EventSwitchLeave": "_topology_changed_handler",
                           "EventLinkAdd": "_topology_changed_handler",
                           "EventLinkDelete": "_topology_changed_handler",
+                          "EventStreamRebalance":
+                              "_topology_changed_handler",
                           "EventStreamSourceEnter": "_source_enter_handler",
                           "EventStreamSourceLeave": "_source_leave_handler",
                           "EventStreamClientEnter": "_client_enter_handler",
-                          "EventStreamClientLeave": "_client_leave_handler"}
+                          "EventStreamClientLeave": "_client_leave_handler",
+                          "EventStreamClientBatch": "_client_batch_handler"}
 
     # Make sure paths && pathlens is up to date
     def cal(self, stream, paths, pathlens, ev):
         ev_name = ev.__class__.__name__
         func_name = self.event_map.get(ev_name)
         if func_name is None:
-            print "%s not in event_map of Shortest_Path_Heuristic" % ev_name
-            exit(1)
+            print "%s not in event_map of %s, rebuilding tree" % \
+                (ev_name, self.__class__.__name__)
+            func_name = "_topology_changed_handler"
         new_tree = getattr(self, func_name)(stream, paths, pathlens, ev)
         return new_tree
 
     def _topology_changed_handler(self, stream, paths, pathlens, ev):
-        new_tree = {}
-        mod_nodes = set()
-        new_tree[stream["src"]["dpid"]] = {"parent": -1,
-                                           "children": set()}
-        in_nodes = set(new_tree.keys())
-        pending = stream["clients"].keys()
+        new_tree = MulticastTree()
+        new_tree.add_node(stream["src"]["dpid"], -1)
+        if not self._grow(new_tree, set(stream["clients"].keys()),
+                          paths, pathlens):
+            print "Error: cannot build multicast tree"
+            return None, None
+        return new_tree, self._diff(stream, new_tree)
+
+    def _grow(self, new_tree, pending, paths, pathlens):
+        # Prim-style growth: best[client] is the distance from the tree to
+        # a pending client, the heap holds (dist, client, branch) and is
+        # only fed by nodes that just joined the tree. Stale entries are
+        # skipped when popped. Ties are broken by dpid.
+        engine = getattr(pathlens, "engine", None)
+        if isinstance(engine, MatrixPaths):
+            return self._grow_matrix(new_tree, pending, engine)
+        best = {}
+        heap = []
+        self._push_candidates(new_tree.keys(), pending, pathlens, best, heap)
         while len(pending) != 0:
             next_to_add = None
-            branch = None
-            dist = 2 ** 31
-            for node in in_nodes:
-                if node in pathlens:
-                    for to_add in pending:
-                        if to_add in pathlens[node] and \
-                                pathlens[node][to_add] < dist:
-                                    next_to_add = to_add
-                                    branch = node
-                                    dist = pathlens[node][to_add]
+            while len(heap) != 0:
+                dist, to_add, branch = heappop(heap)
+                if to_add in pending and best[to_add] == dist:
+                    next_to_add = to_add
+                    break
             if next_to_add is None:
-                print "Error: cannot build multicast tree"
-                return None, None
+                return False
+            pending.remove(next_to_add)
+            joined = self._graft(new_tree, paths[branch][next_to_add])
+            self._push_candidates(joined, pending, pathlens, best, heap)
+        return True
+
+    def _grow_matrix(self, new_tree, pending, engine):
+        # Same growth with the distances as vectors, only the paths of
+        # the chosen branches are built
+        search = engine.nearest(pending)
+        search.add(new_tree.keys())
+        while len(pending) != 0:
+            found = search.pop()
+            if found is None:
+                return False
+            next_to_add, branch = found
             pending.remove(next_to_add)
-            for i in xrange(pathlens[branch][next_to_add]):
-                node = paths[branch][next_to_add][i]
-                if node not in new_tree:
-                    parent = paths[branch][next_to_add][i-1]
-                    new_tree[node] = {"parent": parent,
-                                      "children": set()}
-                if i < pathlens[branch][next_to_add]-1:
-                    child = paths[branch][next_to_add][i+1]
-                    new_tree[node]["children"].add(child)
-                in_nodes.add(node)
+            search.add(self._graft(new_tree,
+                                   engine.path(branch, next_to_add)))
+        return True
+
+    def _diff(self, stream, new_tree):
         # Diff between prev_tree and new_tree
+        mod_nodes = set()
         mod_nodes.update(set(stream["m_tree"].keys()) ^ set(new_tree.keys()))
         to_check = set(stream["m_tree"].keys()) & set(new_tree.keys())
         for node in to_check:
@@ -66,31 +160,59 @@ class Shortest_Path_Heuristic(object):
                     prev_stat["children"] != curr_stat["children"]:
                         mod_nodes.add(node)
                         continue
-        return new_tree, mod_nodes
+        return mod_nodes
+
+    def _graft(self, new_tree, path):
+        # Hang path (starting from a tree node) onto the tree,
+        # returns the nodes that joined the tree
+        joined = []
+        for i, node in enumerate(path):
+            if node not in new_tree:
+                new_tree.add_node(node, path[i-1])
+                joined.append(node)
+        return joined
+
+    def _push_candidates(self, nodes, pending, pathlens, best, heap):
+        for node in nodes:
+            if node not in pathlens:
+                continue
+            lens = pathlens[node]
+            for to_add in pending:
+                dist = lens.get(to_add)
+                if dist is not None and dist < best.get(to_add, 2 ** 31):
+                    best[to_add] = dist
+                    heappush(heap, (dist, to_add, node))
 
     def _source_enter_handler(self, stream, paths, pathlens, ev):
-        new_tree = {}
-        new_tree[ev.src_dpid] = {"parent": -1,
-                                 "children": set()}
+        new_tree = MulticastTree()
+        new_tree.add_node(ev.src_dpid, -1)
         mod_nodes = set([ev.src_dpid])
         return new_tree, mod_nodes
 
     def _source_leave_handler(self, stream, paths, pathlens, ev):
-        new_tree = {}
+        new_tree = MulticastTree()
         mod_nodes = set(stream["m_tree"].keys())
         return new_tree, mod_nodes
 
     def _client_enter_handler(self, stream, paths, pathlens, ev):
-        new_tree = deepcopy(stream["m_tree"])
+        new_tree = stream["m_tree"].fork()
         mod_nodes = set()
-        tree = set(new_tree.keys())
         next_to_add = ev.dpid
         client_port = ev.out_port
         mod_nodes.add(next_to_add)
-        if next_to_add not in tree:
+        engine = getattr(pathlens, "engine", None)
+        if next_to_add not in new_tree and isinstance(engine, MatrixPaths):
+            branch = engine.nearest_node(new_tree.keys(), next_to_add)
+            if branch is None:
+                print "Error: cannot build multicast tree"
+                return None, None
+            path = engine.path(branch, next_to_add)
+            self._graft(new_tree, path)
+            mod_nodes.update(path)
+        elif next_to_add not in new_tree:
             branch = None
             dist = 2 ** 31
-            for tree_node in tree:
+            for tree_node in new_tree.keys():
                 if next_to_add in pathlens[tree_node] and \
                         pathlens[tree_node][next_to_add] < dist:
                             branch = tree_node
@@ -98,33 +220,182 @@ class Shortest_Path_Heuristic(object):
             if branch is None:
                 print "Error: cannot build multicast tree"
                 return None, None
-            for i in xrange(pathlens[branch][next_to_add]):
-                node = paths[branch][next_to_add][i]
-                if node not in new_tree:
-                    parent = paths[branch][next_to_add][i-1]
-                    new_tree[node] = {"parent": parent,
-                                      "children": set()}
-                if i < pathlens[branch][next_to_add]-1:
-                    child = paths[branch][next_to_add][i+1]
-                    new_tree[node]["children"].add(child)
-                mod_nodes.add(node)
+            path = paths[branch][next_to_add]
+            self._graft(new_tree, path)
+            mod_nodes.update(path)
         return new_tree, mod_nodes
 
     def _client_leave_handler(self, stream, paths, pathlens, ev):
-        new_tree = deepcopy(stream["m_tree"])
+        new_tree = stream["m_tree"].fork()
         mod_nodes = set()
         curr_node = ev.dpid
         rm_port = ev.out_port
         mod_nodes.add(curr_node)
         if len(stream["clients"][ev.dpid]) != 0:
-            return mod_nodes
+            return new_tree, mod_nodes
+        self._prune(new_tree, stream, curr_node, mod_nodes)
+        return new_tree, mod_nodes
+
+    def _client_batch_handler(self, stream, paths, pathlens, ev):
+        new_tree = stream["m_tree"].fork()
+        mod_nodes = set(ev.changed)
+        for node in ev.left:
+            if node in new_tree:
+                self._prune(new_tree, stream, node, mod_nodes)
+        pending = set(node for node in ev.joined if node not in new_tree)
+        if not self._grow(new_tree, pending, paths, pathlens):
+            print "Error: cannot build multicast tree"
+            return None, None
+        mod_nodes.update(new_tree.modified)
+        return new_tree, mod_nodes
+
+    def _prune(self, new_tree, stream, curr_node, mod_nodes):
+        # Remove the branch leading to a switch that has no client left
         children = new_tree[curr_node]["children"]
         parent = new_tree[curr_node]["parent"]
         while len(children) == 0 and parent != -1:
-            del new_tree[curr_node]
-            new_tree[parent]["children"].remove(curr_node)
+            new_tree.remove_node(curr_node)
+            mod_nodes.add(curr_node)
             curr_node = parent
+            mod_nodes.add(curr_node)
+            # Switches still serving clients stay in the tree
+            if len(stream["clients"].get(curr_node, ())) != 0:
+                break
             children = new_tree[curr_node]["children"]
             parent = new_tree[curr_node]["parent"]
-            mod_nodes.add(curr_node)
-        return new_tree, mod_nodes
+
+
+@register_algorithm("kmb")
+class KMB_Steiner_Tree(Shortest_Path_Heuristic):
+    # Kou-Markowsky-Berman Steiner tree approximation for full rebuilds,
+    # single joins and leaves are grafted/pruned like the heuristic does
+
+    def _topology_changed_handler(self, stream, paths, pathlens, ev):
+        src_dpid = stream["src"]["dpid"]
+        terminals = set(stream["clients"].keys())
+        terminals.add(src_dpid)
+        # MST of the metric closure over the terminals (Prim)
+        closure_edges = []
+        dist = {}
+        nearest = {}
+        pending = set(terminals)
+        pending.remove(src_dpid)
+        node = src_dpid
+        while len(pending) != 0:
+            if node not in pathlens:
+                break
+            lens = pathlens[node]
+            for to_add in pending:
+                d = lens.get(to_add)
+                if d is not None and d < dist.get(to_add, 2 ** 31):
+                    dist[to_add] = d
+                    nearest[to_add] = node
+            reachable = [t for t in pending if t in dist]
+            if len(reachable) == 0:
+                break
+            node = min(reachable, key=lambda t: (dist[t], t))
+            pending.remove(node)
+            closure_edges.append((nearest[node], node))
+        if len(pending) != 0:
+            print "Error: cannot build multicast tree"
+            return None, None
+        # Expand closure edges into shortest paths
+        adj = {src_dpid: set()}
+        for u, v in closure_edges:
+            path = paths[u][v]
+            for i in xrange(len(path)-1):
+                adj.setdefault(path[i], set()).add(path[i+1])
+                adj.setdefault(path[i+1], set()).add(path[i])
+        # Spanning tree of the expanded subgraph rooted at the source,
+        # links are unit cost so a BFS tree is a minimum one
+        new_tree = MulticastTree()
+        new_tree.add_node(src_dpid, -1)
+        queue = [src_dpid]
+        for node in queue:
+            for neighbor in sorted(adj[node]):
+                if neighbor not in new_tree:
+                    new_tree.add_node(neighbor, node)
+                    queue.append(neighbor)
+        # Prune non-terminal leaves
+        leaves = [n for n, stat in new_tree.items()
+                  if len(stat["children"]) == 0 and n not in terminals]
+        while len(leaves) != 0:
+            node = leaves.pop()
+            parent = new_tree[node]["parent"]
+            new_tree.remove_node(node)
+            if len(new_tree[parent]["children"]) == 0 and \
+                    parent not in terminals:
+                        leaves.append(parent)
+        return new_tree, self._diff(stream, new_tree)
+
+
+@register_algorithm("bandwidth")
+class Bandwidth_Aware_Heuristic(Shortest_Path_Heuristic):
+    # Shortest path heuristic over link costs that grow with the load the
+    # streams already put on a link. Links that would go above threshold
+    # of their capacity with this stream are only used when there is no
+    # way around them.
+
+    threshold = 0.8
+    # Extra cost per unit of utilisation, keeps trees off busy links
+    # even when they are still below threshold
+    load_cost = 1.0
+
+    def __init__(self, network=None):
+        super(Bandwidth_Aware_Heuristic, self).__init__(network)
+        # Copy of the network graph with the load and capacity of every
+        # link, and the versions it was taken at
+        self.graph = None
+        self.graph_key = None
+
+    def cal(self, stream, paths, pathlens, ev):
+        if self.network is None:
+            return super(Bandwidth_Aware_Heuristic, self).cal(stream, paths,
+                                                              pathlens, ev)
+        # The stream's own load counts at the rate link_load counted it
+        rate = self.network.stream_rate(stream["id"])
+        # Paths of a rebalance keep off the hot links like the engine
+        # of Rebalancer.paths passed in
+        hot = frozenset()
+        if ev.__class__.__name__ == "EventStreamRebalance":
+            hot = self.network.rebalancer.hot
+        engine = LazyPaths(self.weighted_graph(),
+                           capacity=len(stream["clients"]) + 1,
+                           weight=partial(self.link_weight, stream, rate,
+                                          hot))
+        return super(Bandwidth_Aware_Heuristic, self).cal(stream,
+                                                          engine.paths,
+                                                          engine.pathlens,
+                                                          ev)
+
+    def weighted_graph(self):
+        # Copied again only when the links change, loads only read again
+        # when a link cost or load moved
+        network = self.network
+        costs = network.link_costs
+        key = (network.path_engine.version, costs.version,
+               costs.loads_version)
+        if key == self.graph_key:
+            return self.graph
+        if self.graph_key is None or self.graph_key[0] != key[0]:
+            self.graph = network.graph.copy()
+        for u, v, data in self.graph.edges(data=True):
+            link = (u, v) if u < v else (v, u)
+            data["load"] = network.link_load(link)
+            data["capacity"] = network.link_capacity(link)
+        self.graph_key = key
+        return self.graph
+
+    def link_weight(self, stream, rate, hot, u, v, data):
+        # Cost of a link for stream, its own load taken out
+        link = (u, v) if u < v else (v, u)
+        load = data["load"]
+        if link in stream["links"]:
+            load -= rate
+        util = float(load + rate) / data["capacity"]
+        weight = 1 + self.load_cost * util
+        if util > self.threshold:
+            weight += self.graph.number_of_nodes()
+        if link in hot:
+            weight += self.graph.number_of_nodes() * weight
+        return weight
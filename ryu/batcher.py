@@ -0,0 +1,183 @@
+import logging
+import time
+
+from ryu.base import app_manager
+from ryu.controller import ofp_event, dpset
+from ryu.controller.handler import MAIN_DISPATCHER
+from ryu.controller.handler import set_ev_cls
+from ryu.ofproto import ofproto_v1_3
+
+from metrics import *
+
+# Messages queued for a datapath are written out
+#   "none": as they are, in a single write
+#   "barrier": followed by a barrier, the batch completes on its reply
+#   "bundle": inside an atomic bundle and followed by a barrier
+BATCH_MODES = ("none", "barrier", "bundle")
+
+
+class FlowBatcher(app_manager.RyuApp):
+    # Collects the messages of one update per datapath and writes each
+    # datapath's share at once on flush(). Apps queue with send() instead
+    # of datapath.send_msg() and call flush() when their update is done,
+    # the callback given to flush() runs when every switch has confirmed.
+    OFP_VERSIONS = [ofproto_v1_3.OFP_VERSION]
+
+    def __init__(self, *args, **kwargs):
+        super(FlowBatcher, self).__init__(*args, **kwargs)
+        self.logger.setLevel(logging.DEBUG)
+        self.mode = "barrier"
+        # dpid -> (datapath, [msg]) waiting for the next flush
+        self.pending = {}
+        # dpid -> barrier xid -> _Batch waiting for its reply
+        self.outstanding = {}
+        # dpid -> last bundle id
+        self.bundle_ids = {}
+        self.batch_sizes = Histogram(SIZE_BOUNDS)
+        # Time from flush to barrier reply
+        self.barrier_latency = Histogram(LATENCY_BOUNDS)
+        self.errors = 0
+
+    def config(self, conf):
+        self.conf = conf
+        mode = conf.get("mode", "barrier")
+        if mode not in BATCH_MODES:
+            print "unknown batch mode %s, using barrier" % mode
+            mode = "barrier"
+        self.mode = mode
+
+    def reg_DPSet(self, dpset):
+        self.dpset = dpset
+
+    def send(self, datapath, msg):
+        self.pending.setdefault(datapath.id, (datapath, []))[1].append(msg)
+
+    def flush(self, callback=None):
+        # callback(ok) runs once all datapaths written to have confirmed,
+        # ok is False if any of them reported an error
+        waiter = _Waiter(len(self.pending), callback)
+        if len(self.pending) == 0:
+            waiter.done(True)
+            return waiter
+        pending = self.pending
+        self.pending = {}
+        for dpid, (datapath, msgs) in pending.items():
+            self._write(datapath, msgs, waiter)
+        return waiter
+
+    def _write(self, datapath, msgs, waiter):
+        parser = datapath.ofproto_parser
+        self.batch_sizes.add(len(msgs))
+        if self.mode == "bundle":
+            msgs = self._bundle(datapath, msgs)
+        barrier = None
+        if self.mode != "none":
+            barrier = parser.OFPBarrierRequest(datapath)
+            msgs.append(barrier)
+        bufs = []
+        first_xid = None
+        for msg in msgs:
+            datapath.set_xid(msg)
+            msg.serialize()
+            bufs.append(str(msg.buf))
+            if first_xid is None:
+                first_xid = msg.xid
+        if not datapath.send("".join(bufs)):
+            waiter.done(False)
+            return
+        if barrier is None:
+            waiter.done(True)
+            return
+        batch = _Batch(first_xid, barrier.xid, waiter)
+        self.outstanding.setdefault(datapath.id, {})[barrier.xid] = batch
+
+    def _bundle(self, datapath, msgs):
+        # Meter mods cannot go into a bundle. They lead (add/modify) or
+        # trail (delete) the flows using them, keep them on that side.
+        ofproto = datapath.ofproto
+        parser = datapath.ofproto_parser
+        bundle_id = (self.bundle_ids.get(datapath.id, 0) + 1) % (2 ** 32)
+        self.bundle_ids[datapath.id] = bundle_id
+        flags = ofproto.ONF_BF_ATOMIC | ofproto.ONF_BF_ORDERED
+        before = []
+        inside = []
+        after = []
+        for msg in msgs:
+            if isinstance(msg, (parser.OFPFlowMod, parser.OFPGroupMod)):
+                inside.append(parser.ONFBundleAddMsg(datapath, bundle_id,
+                                                     flags, msg, []))
+            elif len(inside) == 0:
+                before.append(msg)
+            else:
+                after.append(msg)
+        if len(inside) == 0:
+            return before + after
+        opened = parser.ONFBundleCtrlMsg(datapath, bundle_id,
+                                         ofproto.ONF_BCT_OPEN_REQUEST,
+                                         flags, [])
+        commit = parser.ONFBundleCtrlMsg(datapath, bundle_id,
+                                         ofproto.ONF_BCT_COMMIT_REQUEST,
+                                         flags, [])
+        return before + [opened] + inside + [commit] + after
+
+    @set_ev_cls(ofp_event.EventOFPBarrierReply, MAIN_DISPATCHER)
+    def _barrier_reply_handler(self, ev):
+        dpid = ev.msg.datapath.id
+        batch = self.outstanding.get(dpid, {}).pop(ev.msg.xid, None)
+        if batch is None:
+            return
+        self.barrier_latency.add(time.time() - batch.sent)
+        batch.waiter.done(batch.ok)
+
+    @set_ev_cls(ofp_event.EventOFPErrorMsg, MAIN_DISPATCHER)
+    def _error_msg_handler(self, ev):
+        msg = ev.msg
+        for batch in self.outstanding.get(msg.datapath.id, {}).values():
+            if batch.first_xid <= msg.xid <= batch.last_xid:
+                self.errors += 1
+                batch.ok = False
+                self.logger.info("dp%d rejected a batched message, "
+                                 "type=%d code=%d", msg.datapath.id,
+                                 msg.type, msg.code)
+                return
+
+    @set_ev_cls(dpset.EventDP, dpset.DPSET_EV_DISPATCHER)
+    def _dp_handler(self, ev):
+        if ev.enter:
+            return
+        # No reply will come from a switch that is gone
+        dpid = ev.dp.id
+        self.pending.pop(dpid, None)
+        self.bundle_ids.pop(dpid, None)
+        for batch in self.outstanding.pop(dpid, {}).values():
+            batch.waiter.done(False)
+
+
+class _Batch(object):
+    # Messages written to one datapath in one flush
+
+    def __init__(self, first_xid, last_xid, waiter):
+        super(_Batch, self).__init__()
+        self.first_xid = first_xid
+        self.last_xid = last_xid
+        self.waiter = waiter
+        self.sent = time.time()
+        self.ok = True
+
+
+class _Waiter(object):
+    # Counts down the datapaths of one flush
+
+    def __init__(self, count, callback):
+        super(_Waiter, self).__init__()
+        self.count = count
+        self.callback = callback
+        self.ok = True
+
+    def done(self, ok):
+        self.ok = self.ok and ok
+        self.count -= 1
+        if self.count <= 0 and self.callback is not None:
+            callback = self.callback
+            self.callback = None
+            callback(self.ok)
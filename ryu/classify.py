@@ -0,0 +1,71 @@
+import struct
+
+from ryu.lib import addrconv
+
+from addrs import *
+
+ETH_TYPE_IP = 0x0800
+ETH_TYPE_ARP = 0x0806
+ETH_TYPE_8021Q = 0x8100
+
+# Packet-in classes, in the order Wrapper checks them
+PKT_SHORT = 0
+PKT_LLDP = 1
+PKT_HOST_DIS = 2
+PKT_ARP = 3
+PKT_FLOOD = 4
+PKT_STREAMING = 5
+PKT_SWITCHING = 6
+
+# Raw addresses the destination MAC is compared against
+LLDP_BIN = addrconv.mac.text_to_bin(LLDP)
+HOST_DIS_BIN = addrconv.mac.text_to_bin(HOST_DIS_ETH_SRC)
+FLOOD_BIN = addrconv.mac.text_to_bin(ETHERNET_FLOOD)
+# Leading bytes of the MACs of streams, ETH_STREAMING_ADDR_INT under
+# ETH_STREAMING_MASK
+STREAMING_PREFIX = struct.pack("!Q", ETH_STREAMING_ADDR_INT)[2:6]
+
+_unpack_short = struct.Struct("!H").unpack_from
+
+
+def classify(data):
+    # (class, ethertype, offset of the layer 3 header) of an Ethernet
+    # frame, read at fixed offsets without parsing the packet. A single
+    # 802.1Q tag is skipped.
+    if len(data) < 14:
+        return PKT_SHORT, None, None
+    ethertype = _unpack_short(data, 12)[0]
+    offset = 14
+    if ethertype == ETH_TYPE_8021Q and len(data) >= 18:
+        ethertype = _unpack_short(data, 16)[0]
+        offset = 18
+    if data.startswith(LLDP_BIN):
+        return PKT_LLDP, ethertype, offset
+    if data.startswith(HOST_DIS_BIN):
+        return PKT_HOST_DIS, ethertype, offset
+    if ethertype == ETH_TYPE_ARP:
+        return PKT_ARP, ethertype, offset
+    if data.startswith(FLOOD_BIN):
+        return PKT_FLOOD, ethertype, offset
+    if data.startswith(STREAMING_PREFIX):
+        return PKT_STREAMING, ethertype, offset
+    return PKT_SWITCHING, ethertype, offset
+
+
+def raw_eth_dst(data):
+    return addrconv.mac.bin_to_text(data[0:6])
+
+
+def raw_eth_src(data):
+    return addrconv.mac.bin_to_text(data[6:12])
+
+
+def raw_src_ip(data, ethertype, offset):
+    # Sender address of ARP or source address of IPv4 as text, None for
+    # anything else or a truncated header
+    if ethertype == ETH_TYPE_ARP and len(data) >= offset + 18:
+        return addrconv.ipv4.bin_to_text(data[offset+14:offset+18])
+    if ethertype == ETH_TYPE_IP and len(data) >= offset + 20:
+        return addrconv.ipv4.bin_to_text(data[offset+12:offset+16])
+    return None
+
@@ -1,13 +1,32 @@
 from ryu.controller import event
 from ryu.lib.dpid import dpid_to_str
+from ryu.lib.port_no import port_no_to_str
+from ryu.lib.packet import packet
+
+from classify import raw_eth_src, raw_eth_dst
 
 
 class EventPacketIn(event.EventBase):
+    # pkt is only parsed out of msg.data once a handler asks for it
 
-    def __init__(self, msg, pkt):
+    def __init__(self, msg, pkt=None):
         super(EventPacketIn, self).__init__()
         self.msg = msg
-        self.pkt = pkt
+        self._pkt = pkt
+
+    @property
+    def pkt(self):
+        if self._pkt is None:
+            self._pkt = packet.Packet(self.msg.data)
+        return self._pkt
+
+    @property
+    def eth_src(self):
+        return raw_eth_src(self.msg.data)
+
+    @property
+    def eth_dst(self):
+        return raw_eth_dst(self.msg.data)
 
 
 class Event_ARP_PacketIn(EventPacketIn):
@@ -28,6 +47,30 @@ class Event_Streaming_PacketIn(EventPacketIn):
         super(Event_Streaming_PacketIn, self).__init__(*args, **kwargs)
 
 
+class Host(object):
+    # This is data class passed by EventHostXXX
+
+    def __init__(self, mac, ip, dpid, port_no):
+        super(Host, self).__init__()
+        self.mac = mac
+        self.ip = ip
+        self.dpid = dpid
+        self.port_no = port_no
+
+    def to_dict(self):
+        d = {
+            "mac": self.mac,
+            "ip": self.ip,
+            "dpid": dpid_to_str(self.dpid),
+            "port_no": port_no_to_str(self.port_no)
+        }
+        return d
+
+    def __str__(self):
+        msg = 'Host<mac=%s,ip=%s>' % (self.mac, self.ip)
+        return msg
+
+
 class EventHostReg(event.EventBase):
 
     def __init__(self, host):
@@ -195,3 +238,77 @@ class EventStreamBandwidthChange(event.EventBase):
         self.stream_id = stream_id
         self.dpid = dpid
         self.bandwidth = bandwidth
+
+
+class EventStreamAdmissionRequest(event.EventRequestBase):
+    # Admission of an EventStreamSourceEnter or EventStreamClientEnter,
+    # the ones let in are passed on to the observers
+
+    def __init__(self, ev):
+        super(EventStreamAdmissionRequest, self).__init__()
+        self.dst = "Streaming"
+        self.ev = ev
+
+    def __str__(self):
+        return "EventStreamAdmissionRequest<src=%s, %s>" % \
+            (self.src, self.ev.__class__.__name__)
+
+
+class EventStreamAdmissionReply(event.EventReplyBase):
+
+    def __init__(self, dst, decision):
+        super(EventStreamAdmissionReply, self).__init__(dst)
+        # {decision, rate, reason}
+        self.decision = decision
+
+    def __str__(self):
+        return "EventStreamAdmissionReply<dst=%s, %s>" % \
+            (self.dst, self.decision)
+
+
+class EventStreamClientBatch(event.EventBase):
+    # Net effect of the client joins and leaves of a stream collected
+    # over one batching window, clients already applied to the stream
+
+    def __init__(self, stream_id, joined, left, changed):
+        super(EventStreamClientBatch, self).__init__()
+        self.stream_id = stream_id
+        # dpids that got their first client
+        self.joined = joined
+        # dpids that lost their last client
+        self.left = left
+        # dpids whose client ports changed
+        self.changed = changed
+
+
+class EventStreamBatchFlush(event.EventBase):
+
+    def __init__(self):
+        super(EventStreamBatchFlush, self).__init__()
+
+
+class EventStreamRebalance(event.EventBase):
+    # Streams being moved off hot links, their trees are built anew
+
+    def __init__(self, stream_ids):
+        super(EventStreamRebalance, self).__init__()
+        self.stream_ids = stream_ids
+
+
+class EventTrafficChanged(event.EventBase):
+    # New rates measured by the stats collector
+
+    def __init__(self, loads, rates):
+        super(EventTrafficChanged, self).__init__()
+        # link(src<dst) -> Kbps
+        self.loads = loads
+        # stream_id -> Kbps at the source
+        self.rates = rates
+
+
+class EventStreamRecomputeDone(event.EventBase):
+    # The process pool of a tree recompute has finished
+
+    def __init__(self, job):
+        super(EventStreamRecomputeDone, self).__init__()
+        self.job = job
@@ -0,0 +1,278 @@
+from collections import deque
+
+from ryu.ofproto import ether
+
+from flows import *
+from ids import IdAllocator
+
+# Detour flows sit above the stream flows, a detour may enter a switch
+# through the same port as the tree
+DETOUR_PRIORITY = StreamFlowProgrammer.PRIORITY + 1
+# Detour VLAN ids come after the version tags and are unique per stream
+DETOUR_VID_BASE = MAX_VERSION + 1
+DETOUR_VID_MAX = 4095
+
+
+def detour_path(graph, src, dst):
+    # Shortest path from src to dst that does not take the link src-dst
+    if src not in graph or dst not in graph:
+        return None
+    prev = {src: None}
+    queue = deque([src])
+    while len(queue) != 0:
+        node = queue.popleft()
+        for neighbor in graph.neighbors(node):
+            if neighbor in prev or (node == src and neighbor == dst):
+                continue
+            prev[neighbor] = node
+            if neighbor == dst:
+                path = [dst]
+                while prev[path[-1]] is not None:
+                    path.append(prev[path[-1]])
+                return path[::-1]
+            queue.append(neighbor)
+    return None
+
+
+class DetourPlanner(object):
+    # Backup paths for the links of the multicast trees, one detour per
+    # tree node around the link to its parent. Detours are kept per
+    # tree version key and only the ones of nodes that changed or that
+    # ran over a failed link get recomputed.
+
+    def __init__(self, graph, ids=None):
+        super(DetourPlanner, self).__init__()
+        self.graph = graph
+        # Fast failover group ids, shared with the other apps
+        self.ids = ids if ids is not None else IdAllocator()
+        # key -> child -> {"parent", "path", "vid", "group"}
+        self.detours = {}
+        # dpid -> set((key, child)) of the detours passing the switch
+        self.nodes = {}
+        # stream_id -> set(vid)
+        self.vids = {}
+        # key -> children left without a detour
+        self.uncovered = {}
+
+    def get(self, key, child):
+        return self.detours.get(key, {}).get(child)
+
+    def plan(self, key, tree, nodes):
+        # Brings the detours of the given tree nodes up to date and
+        # returns the dpids whose detour entries changed
+        dpids = set()
+        detours = self.detours.setdefault(key, {})
+        uncovered = self.uncovered.setdefault(key, set())
+        for child in nodes:
+            stat = tree.get(child)
+            detour = detours.get(child)
+            uncovered.discard(child)
+            if stat is None or stat["parent"] == -1:
+                if detour is not None:
+                    dpids |= self._drop(key, child)
+                continue
+            if detour is not None and detour["parent"] == stat["parent"] \
+                    and self._valid(detour["path"]):
+                continue
+            if detour is not None:
+                dpids |= self._drop(key, child)
+            path = detour_path(self.graph, stat["parent"], child)
+            if path is None:
+                uncovered.add(child)
+                continue
+            vid = self._alloc_vid(key_stream_id(key))
+            if vid is None:
+                print "no detour tag left for stream%d" % key_stream_id(key)
+                continue
+            detours[child] = {"parent": stat["parent"],
+                              "path": path,
+                              "vid": vid,
+                              "group": self.ids.alloc(stat["parent"], "group",
+                                                      "failover",
+                                                      (key, child))}
+            for node in path:
+                self.nodes.setdefault(node, set()).add((key, child))
+            dpids |= set(path)
+        if len(detours) == 0:
+            del self.detours[key]
+        if len(uncovered) == 0:
+            del self.uncovered[key]
+        return dpids
+
+    def drop(self, key):
+        dpids = set()
+        for child in self.detours.get(key, {}).keys():
+            dpids |= self._drop(key, child)
+        self.detours.pop(key, None)
+        self.uncovered.pop(key, None)
+        return dpids
+
+    def broken(self, src, dst):
+        # key -> children whose detour runs over the link src-dst
+        using = self.nodes.get(src, set()) & self.nodes.get(dst, set())
+        broken = {}
+        for key, child in using:
+            path = self.detours[key][child]["path"]
+            for i in xrange(len(path) - 1):
+                if set(path[i:i+2]) == set((src, dst)):
+                    broken.setdefault(key, set()).add(child)
+                    break
+        return broken
+
+    def missing(self):
+        # key -> children left without a detour, a new link may help
+        return dict((key, set(children))
+                    for key, children in self.uncovered.items())
+
+    def passing(self, dpid):
+        # key -> children whose detour passes the switch
+        passing = {}
+        for key, child in self.nodes.get(dpid, ()):
+            passing.setdefault(key, set()).add(child)
+        return passing
+
+    def _valid(self, path):
+        for i in xrange(len(path) - 1):
+            if not self.graph.has_edge(path[i], path[i+1]):
+                return False
+        return True
+
+    def _drop(self, key, child):
+        detour = self.detours[key].pop(child)
+        for node in detour["path"]:
+            entries = self.nodes.get(node)
+            if entries is not None:
+                entries.discard((key, child))
+                if len(entries) == 0:
+                    del self.nodes[node]
+        self.vids[key_stream_id(key)].discard(detour["vid"])
+        self.ids.free(detour["parent"], "group", "failover", (key, child))
+        return set(detour["path"])
+
+    def _alloc_vid(self, stream_id):
+        used = self.vids.setdefault(stream_id, set())
+        for vid in xrange(DETOUR_VID_BASE, DETOUR_VID_MAX + 1):
+            if vid not in used:
+                used.add(vid)
+                return vid
+        return None
+
+
+class DetourProgrammer(object):
+    # Installs the detours of a tree version on one switch, diffing
+    # against what was installed before like StreamFlowProgrammer. A
+    # state is
+    #   {"ff": child -> (group_id, port, backup_port, vid, tagged),
+    #          group at the parent, tagged trees get their tag rewritten
+    #          on the detour, untagged ones get one pushed,
+    #    "hops": (vid, in_port) -> out_port, along the detour,
+    #    "arrive": (vid, in_port) -> restore, at the child, the tree tag
+    #              to put back or None to pop the detour tag}
+
+    def __init__(self):
+        super(DetourProgrammer, self).__init__()
+        # dpid -> key -> state
+        self.installed = {}
+
+    def forget(self, dpid):
+        self.installed.pop(dpid, None)
+
+    def keys(self, dpid):
+        return self.installed.get(dpid, {}).keys()
+
+    def program(self, datapath, key, eth_dst, state):
+        # Returns the messages to send before the stream flows of the
+        # switch, the ones to send right after them and the ones to send
+        # last. The stream group may only refer to fast failover groups
+        # that exist, the arrive flows only to a stream group that does.
+        ofproto = datapath.ofproto
+        empty = {"ff": {}, "hops": {}, "arrive": {}}
+        prev = self.installed.get(datapath.id, {}).get(key, empty)
+        curr = state if state is not None else empty
+        before = []
+        arrive = []
+        after = []
+        for name, msgs in (("hops", before), ("arrive", arrive)):
+            for match, action in curr[name].items():
+                # The action of an untagged arrive flow is None
+                if match not in prev[name] or prev[name][match] != action:
+                    msgs.append(self.flow_mod(datapath, ofproto.OFPFC_ADD,
+                                              key, eth_dst, name, match,
+                                              action))
+            for match, action in prev[name].items():
+                if match not in curr[name]:
+                    after.append(self.flow_mod(datapath,
+                                               ofproto.OFPFC_DELETE_STRICT,
+                                               key, eth_dst, name, match,
+                                               action))
+        # By group id, an id freed by one child may already be another's
+        prev_ff = dict((ff[0], ff) for ff in prev["ff"].values())
+        curr_ff = dict((ff[0], ff) for ff in curr["ff"].values())
+        for group_id, ff in curr_ff.items():
+            old = prev_ff.get(group_id)
+            if old is None:
+                before.append(self.group_mod(datapath, ofproto.OFPGC_ADD,
+                                             ff))
+            elif old != ff:
+                before.append(self.group_mod(datapath, ofproto.OFPGC_MODIFY,
+                                             ff))
+        for group_id, ff in prev_ff.items():
+            if group_id not in curr_ff:
+                after.append(self.group_mod(datapath, ofproto.OFPGC_DELETE,
+                                            ff))
+        if state is None or state == empty:
+            self.installed.get(datapath.id, {}).pop(key, None)
+        else:
+            self.installed.setdefault(datapath.id, {})[key] = state
+        return before, arrive, after
+
+    def group_mod(self, datapath, command, ff):
+        ofproto = datapath.ofproto
+        parser = datapath.ofproto_parser
+        group_id, port, backup_port, vid, tagged = ff
+        buckets = []
+        if command != ofproto.OFPGC_DELETE:
+            actions = [parser.OFPActionOutput(port)]
+            buckets.append(parser.OFPBucket(watch_port=port,
+                                            actions=actions))
+            actions = []
+            if not tagged:
+                actions.append(parser.OFPActionPushVlan(ether.ETH_TYPE_8021Q))
+            actions.append(parser.OFPActionSetField(
+                vlan_vid=VID_PRESENT | vid))
+            actions.append(parser.OFPActionOutput(backup_port))
+            buckets.append(parser.OFPBucket(watch_port=backup_port,
+                                            actions=actions))
+        return parser.OFPGroupMod(datapath=datapath,
+                                  command=command,
+                                  type_=ofproto.OFPGT_FF,
+                                  group_id=group_id,
+                                  buckets=buckets)
+
+    def flow_mod(self, datapath, command, key, eth_dst, name, match, action):
+        ofproto = datapath.ofproto
+        parser = datapath.ofproto_parser
+        vid, in_port = match
+        of_match = parser.OFPMatch(in_port=in_port,
+                                   vlan_vid=VID_PRESENT | vid,
+                                   eth_dst=eth_dst)
+        inst = []
+        if command != ofproto.OFPFC_DELETE_STRICT:
+            if name == "hops":
+                actions = [parser.OFPActionOutput(action)]
+            elif action is None:
+                actions = [parser.OFPActionPopVlan(),
+                           parser.OFPActionGroup(key, ofproto.OFPGT_ALL)]
+            else:
+                actions = [parser.OFPActionSetField(
+                               vlan_vid=VID_PRESENT | action),
+                           parser.OFPActionGroup(key, ofproto.OFPGT_ALL)]
+            inst.append(parser.OFPInstructionActions(
+                ofproto.OFPIT_APPLY_ACTIONS, actions))
+        return parser.OFPFlowMod(datapath=datapath,
+                                 command=command,
+                                 priority=DETOUR_PRIORITY,
+                                 out_port=ofproto.OFPP_ANY,
+                                 out_group=ofproto.OFPG_ANY,
+                                 match=of_match,
+                                 instructions=inst)
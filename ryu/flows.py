@@ -0,0 +1,198 @@
+from ryu.ofproto import ether
+
+# VLAN tags carrying the tree version are offset by OFPVID_PRESENT
+VID_PRESENT = 0x1000
+# Tagged tree versions run from 1 to MAX_VERSION and are reused in turn
+MAX_VERSION = 255
+
+
+def version_key(stream_id, version):
+    # Group and meter id of a stream tree version, version 0 is the
+    # untagged tree and keeps the stream id
+    return stream_id | (version << 16)
+
+
+def key_stream_id(key):
+    return key & 0xffff
+
+
+def next_version(version):
+    return version % MAX_VERSION + 1
+
+
+class StreamFlowProgrammer(object):
+    # Remembers what was last installed for every (dpid, key) and builds
+    # the minimum OpenFlow messages moving a switch from one state to
+    # another. The key is the group and meter id, see version_key. A
+    # state is
+    #   {"in_port": port the stream comes from, None to only hold the
+    #               group and meter without a flow,
+    #    "tag": VLAN id matched on in_port or None,
+    #    "push": VLAN id pushed before the group or None,
+    #    "buckets": sorted tuple of (out_port, eth_dst, ipv4_dst, pop,
+    #               group), the addresses are rewritten for host ports,
+    #               None otherwise, pop strips the VLAN tag, group is
+    #               the fast failover group guarding a tree link,
+    #    "band": meter rate in Mbps or None}
+    # A switch holds the stream group only with buckets and the meter
+    # only with a band. OpenFlow 1.3 has no bucket level group commands,
+    # a change of buckets is a single OFPGC_MODIFY.
+
+    PRIORITY = 5
+
+    def __init__(self):
+        super(StreamFlowProgrammer, self).__init__()
+        # dpid -> stream_id -> state
+        self.installed = {}
+
+    def get(self, dpid, key):
+        return self.installed.get(dpid, {}).get(key)
+
+    def keys(self, dpid):
+        return self.installed.get(dpid, {}).keys()
+
+    def forget(self, dpid):
+        # The switch is gone, whatever it held is lost with it
+        self.installed.pop(dpid, None)
+
+    def release_flow(self, dpid, key):
+        # The flow entry of key was overwritten by the flow of another
+        # key with the same match, it must not be deleted with key
+        state = self.get(dpid, key)
+        if state is not None:
+            state = dict(state)
+            state["in_port"] = None
+            self.installed[dpid][key] = state
+
+    def program(self, datapath, key, eth_dst, state):
+        prev = self.get(datapath.id, key)
+        msgs = self.diff(datapath, key, eth_dst, prev, state)
+        if state is None:
+            self.installed.get(datapath.id, {}).pop(key, None)
+        else:
+            self.installed.setdefault(datapath.id, {})[key] = state
+        return msgs
+
+    def diff(self, datapath, key, eth_dst, prev, curr):
+        ofproto = datapath.ofproto
+        parser = datapath.ofproto_parser
+        group_id = key
+        meter_id = key
+        prev_group = prev is not None and len(prev["buckets"]) != 0
+        curr_group = curr is not None and len(curr["buckets"]) != 0
+        prev_meter = prev is not None and prev["band"] is not None
+        curr_meter = curr is not None and curr["band"] is not None
+        prev_flow = prev is not None and prev["in_port"] is not None
+        curr_flow = curr is not None and curr["in_port"] is not None
+        same_match = prev_flow and curr_flow and \
+            (prev["in_port"], prev["tag"]) == (curr["in_port"], curr["tag"])
+        msgs = []
+
+        # Meter and group go first, the flow must never point to a
+        # missing one
+        if curr_meter and not prev_meter:
+            msgs.append(self.meter_mod(datapath, ofproto.OFPMC_ADD,
+                                       meter_id, curr["band"]))
+        elif curr_meter and prev["band"] != curr["band"]:
+            msgs.append(self.meter_mod(datapath, ofproto.OFPMC_MODIFY,
+                                       meter_id, curr["band"]))
+
+        if curr_group and not prev_group:
+            msgs.append(self.group_mod(datapath, ofproto.OFPGC_ADD,
+                                       group_id, curr["buckets"]))
+        elif curr_group and prev["buckets"] != curr["buckets"]:
+            msgs.append(self.group_mod(datapath, ofproto.OFPGC_MODIFY,
+                                       group_id, curr["buckets"]))
+
+        # A new match is a new flow, it is added before the old one
+        # goes away so the switch never drops the stream in between
+        if curr_flow:
+            if not same_match:
+                msgs.append(self.flow_mod(datapath, ofproto.OFPFC_ADD,
+                                          key, eth_dst, curr))
+            elif prev_group != curr_group or prev_meter != curr_meter or \
+                    prev["push"] != curr["push"]:
+                msgs.append(self.flow_mod(datapath,
+                                          ofproto.OFPFC_MODIFY_STRICT,
+                                          key, eth_dst, curr))
+        if prev_flow and not same_match:
+            msgs.append(self.flow_mod(datapath,
+                                      ofproto.OFPFC_DELETE_STRICT,
+                                      key, eth_dst, prev))
+
+        if prev_group and not curr_group:
+            msgs.append(self.group_mod(datapath, ofproto.OFPGC_DELETE,
+                                       group_id))
+        if prev_meter and not curr_meter:
+            msgs.append(self.meter_mod(datapath, ofproto.OFPMC_DELETE,
+                                       meter_id))
+        return msgs
+
+    def group_mod(self, datapath, command, group_id, buckets=()):
+        ofproto = datapath.ofproto
+        parser = datapath.ofproto_parser
+        of_buckets = []
+        for port, eth_dst, ipv4_dst, pop, group in buckets:
+            actions = []
+            if pop:
+                actions.append(parser.OFPActionPopVlan())
+            if eth_dst is not None:
+                actions.append(parser.OFPActionSetField(eth_dst=eth_dst))
+            if ipv4_dst is not None:
+                actions.append(parser.OFPActionSetField(ipv4_dst=ipv4_dst))
+            # Set-field applies to the output that follows it
+            if group is None:
+                actions.append(parser.OFPActionOutput(port))
+            else:
+                actions.append(parser.OFPActionGroup(group,
+                                                     ofproto.OFPGT_FF))
+            of_buckets.append(parser.OFPBucket(actions=actions))
+        return parser.OFPGroupMod(datapath=datapath,
+                                  command=command,
+                                  type_=ofproto.OFPGT_ALL,
+                                  group_id=group_id,
+                                  buckets=of_buckets)
+
+    def meter_mod(self, datapath, command, meter_id, band=None):
+        ofproto = datapath.ofproto
+        parser = datapath.ofproto_parser
+        bands = []
+        if band is not None:
+            bands.append(parser.OFPMeterBandDrop(rate=band*1000))
+        return parser.OFPMeterMod(datapath=datapath,
+                                  command=command,
+                                  flags=ofproto.OFPMF_KBPS,
+                                  meter_id=meter_id,
+                                  bands=bands)
+
+    def flow_mod(self, datapath, command, key, eth_dst, state):
+        ofproto = datapath.ofproto
+        parser = datapath.ofproto_parser
+        if state["tag"] is None:
+            match = parser.OFPMatch(in_port=state["in_port"],
+                                    eth_dst=eth_dst)
+        else:
+            match = parser.OFPMatch(in_port=state["in_port"],
+                                    vlan_vid=VID_PRESENT | state["tag"],
+                                    eth_dst=eth_dst)
+        inst = []
+        if command != ofproto.OFPFC_DELETE_STRICT:
+            actions = []
+            if state["push"] is not None:
+                actions.append(parser.OFPActionPushVlan(
+                    ether.ETH_TYPE_8021Q))
+                actions.append(parser.OFPActionSetField(
+                    vlan_vid=VID_PRESENT | state["push"]))
+            if len(state["buckets"]) != 0:
+                actions.append(parser.OFPActionGroup(key, ofproto.OFPGT_ALL))
+            if state["band"] is not None:
+                inst.append(parser.OFPInstructionMeter(meter_id=key))
+            inst.append(parser.OFPInstructionActions(
+                ofproto.OFPIT_APPLY_ACTIONS, actions))
+        return parser.OFPFlowMod(datapath=datapath,
+                                 command=command,
+                                 priority=self.PRIORITY,
+                                 out_port=ofproto.OFPP_ANY,
+                                 out_group=ofproto.OFPG_ANY,
+                                 match=match,
+                                 instructions=inst)
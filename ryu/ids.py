@@ -0,0 +1,95 @@
+# Group and meter ids of a datapath, split between their owners:
+#   stream     version keys of the stream trees, see flows.version_key,
+#              they are fixed by the stream id and never allocated
+#   switching  multipath groups of Switching
+#   failover   fast failover groups of the detours
+#   wrapper    packet-in meters of Wrapper, see ratelimit
+ID_RANGES = {
+    "stream": (1, 1 << 24),
+    "switching": (1 << 24, 1 << 30),
+    "failover": (1 << 30, 0xfffe0000),
+    "wrapper": (0xfffe0000, 0xffff0001)
+}
+
+
+def id_owner(id_):
+    for owner, (base, limit) in ID_RANGES.items():
+        if base <= id_ < limit:
+            return owner
+    return None
+
+
+class IdPool(object):
+    # Ids of one range, freed ids are handed out again before new ones
+
+    def __init__(self, base, limit):
+        super(IdPool, self).__init__()
+        self.next = base
+        self.limit = limit
+        self.released = []
+
+    def alloc(self):
+        if len(self.released) != 0:
+            return self.released.pop()
+        if self.next >= self.limit:
+            return None
+        id_ = self.next
+        self.next += 1
+        return id_
+
+    def free(self, id_):
+        self.released.append(id_)
+
+
+class IdAllocator(object):
+    # Group and meter ids per datapath. Every owner takes its ids from its
+    # own range of ID_RANGES, so no two apps ever hold the same id at a
+    # switch. An id is allocated for a key of its owner, the same key gets
+    # the same id back until it is freed.
+
+    def __init__(self):
+        super(IdAllocator, self).__init__()
+        # dpid -> (kind, owner) -> IdPool, kind is "group" or "meter"
+        self.pools = {}
+        # dpid -> (kind, owner, key) -> id
+        self.ids = {}
+
+    def get(self, dpid, kind, owner, key):
+        return self.ids.get(dpid, {}).get((kind, owner, key))
+
+    def alloc(self, dpid, kind, owner, key):
+        ids = self.ids.setdefault(dpid, {})
+        id_ = ids.get((kind, owner, key))
+        if id_ is not None:
+            return id_
+        pools = self.pools.setdefault(dpid, {})
+        pool = pools.get((kind, owner))
+        if pool is None:
+            pool = IdPool(*ID_RANGES[owner])
+            pools[(kind, owner)] = pool
+        id_ = pool.alloc()
+        if id_ is None:
+            print "out of %s %s ids at dp%d" % (owner, kind, dpid)
+            return None
+        ids[(kind, owner, key)] = id_
+        return id_
+
+    def free(self, dpid, kind, owner, key):
+        id_ = self.ids.get(dpid, {}).pop((kind, owner, key), None)
+        if id_ is not None:
+            self.pools[dpid][(kind, owner)].free(id_)
+        return id_
+
+    def forget(self, dpid):
+        # The switch is gone with all of its groups and meters
+        self.pools.pop(dpid, None)
+        self.ids.pop(dpid, None)
+
+    def to_dict(self):
+        d = {}
+        for dpid, ids in self.ids.items():
+            counts = d.setdefault(dpid, {})
+            for kind, owner, key in ids:
+                name = "%s_%ss" % (owner, kind)
+                counts[name] = counts.get(name, 0) + 1
+        return d
@@ -0,0 +1,158 @@
+import json
+
+# Link cost metrics:
+#   hop        every link costs 1
+#   delay      propagation delay plus jitter, in ms
+#   bandwidth  reference bandwidth over the residual bandwidth, like the
+#              OSPF cost, so saturated links get expensive
+#   composite  weighted sum of the three, weights from the conf
+METRICS = ("hop", "delay", "bandwidth", "composite")
+
+# TCLink defaults of mininet/topo.py
+DEFAULT_ATTRS = {"bw": 10, "delay": 5.0, "jitter": 2.0}
+# Reference bandwidth of the bandwidth metric in Kbps, a link with
+# 100Mbps to spare costs 1
+REF_BW = 100000.0
+# Residual bandwidth of saturated links in Kbps, keeps costs finite
+MIN_RESIDUAL = 10.0
+
+
+def parse_time(value):
+    # TCLink delay/jitter like "5ms", "2.5ms", "100us" or "1s" to ms
+    if value is None:
+        return 0.0
+    if isinstance(value, (int, long, float)):
+        return float(value)
+    value = value.strip()
+    for suffix, scale in (("ms", 1.0), ("us", 0.001), ("s", 1000.0)):
+        if value.endswith(suffix):
+            return float(value[:-len(suffix)]) * scale
+    return float(value)
+
+
+def link_attrs(args, defaults=None):
+    # bw (Mbps), delay and jitter (ms) of TCLink arguments
+    attrs = dict(DEFAULT_ATTRS if defaults is None else defaults)
+    if args is not None:
+        if "bw" in args:
+            attrs["bw"] = args["bw"]
+        if "delay" in args:
+            attrs["delay"] = parse_time(args["delay"])
+        if "jitter" in args:
+            attrs["jitter"] = parse_time(args["jitter"])
+    return attrs
+
+
+class LinkCosts(object):
+    # Costs of the links(src<dst) for one metric, computed once per link
+    # and kept until the attributes or the load of the link change. Load
+    # only moves a cost when the utilisation crosses a step of load_step,
+    # so the path engines are not invalidated on every stream update.
+    #
+    # weight() has the signature of a networkx weight function and can be
+    # handed to the path engines and nx.shortest_path as it is.
+
+    def __init__(self, metric="hop", weights=None, load_step=0.05):
+        super(LinkCosts, self).__init__()
+        if metric not in METRICS:
+            raise ValueError("unknown link cost metric %s" % metric)
+        self.metric = metric
+        # Composite weights of hop, delay and bandwidth costs
+        self.weights = {"hop": 1.0, "delay": 1.0, "bandwidth": 1.0}
+        if weights is not None:
+            self.weights.update(weights)
+        self.load_step = load_step
+        self.defaults = dict(DEFAULT_ATTRS)
+        # link -> {bw, delay, jitter}
+        self.attrs = {}
+        # link -> load in Kbps, as reserved by streams or measured
+        self.loads = {}
+        # link -> load step the cost was computed for
+        self.steps = {}
+        # link -> cost
+        self.costs = {}
+        # Bumped whenever a cost changes
+        self.version = 0
+        # Bumped whenever a load changes, costs may not move with it
+        self.loads_version = 0
+
+    @property
+    def weighted(self):
+        return self.metric != "hop"
+
+    def load_topology(self, fname):
+        # Link attributes of a topology file of mininet/topo.py, its
+        # switch ids are the dpids
+        with open(fname) as f:
+            topo = json.load(f)
+        defaults = topo.get("defaults", {}).get("link")
+        if defaults is not None:
+            self.defaults = link_attrs(defaults)
+        for link_info in topo["links"]:
+            self.set_attrs(link_info["src"], link_info["dst"],
+                           link_attrs(link_info.get("args"), self.defaults))
+
+    def set_attrs(self, u, v, attrs):
+        link = (u, v) if u < v else (v, u)
+        self.attrs[link] = attrs
+        self._changed(link)
+
+    def capacity(self, link):
+        # Kbps
+        return self.attrs.get(link, self.defaults)["bw"] * 1000
+
+    def set_load(self, link, load):
+        # Returns True when the cost of the link changed
+        if self.loads.get(link) != load:
+            self.loads_version += 1
+        self.loads[link] = load
+        if self.metric not in ("bandwidth", "composite"):
+            return False
+        if link not in self.costs or self._step(link) == self.steps[link]:
+            return False
+        self._changed(link)
+        return True
+
+    def forget(self, link):
+        if self.loads.pop(link, None) is not None:
+            self.loads_version += 1
+        self.steps.pop(link, None)
+        self.costs.pop(link, None)
+
+    def _changed(self, link):
+        self.costs.pop(link, None)
+        self.version += 1
+
+    def _step(self, link):
+        util = float(self.loads.get(link, 0)) / self.capacity(link)
+        return int(util / self.load_step) if self.load_step > 0 else util
+
+    def cost(self, link):
+        cost = self.costs.get(link)
+        if cost is None:
+            cost = self._cost(link)
+            self.costs[link] = cost
+            self.steps[link] = self._step(link)
+        return cost
+
+    def _cost(self, link):
+        attrs = self.attrs.get(link, self.defaults)
+        delay = max(attrs["delay"] + attrs["jitter"], 0.01)
+        # Load is taken at the step it falls in, so the cost only moves
+        # with the step
+        capacity = self.capacity(link)
+        load = self._step(link) * self.load_step * capacity \
+            if self.load_step > 0 else self.loads.get(link, 0)
+        residual = max(capacity - load, MIN_RESIDUAL)
+        bandwidth = REF_BW / residual
+        if self.metric == "hop":
+            return 1.0
+        if self.metric == "delay":
+            return delay
+        if self.metric == "bandwidth":
+            return bandwidth
+        return self.weights["hop"] + self.weights["delay"] * delay + \
+            self.weights["bandwidth"] * bandwidth
+
+    def weight(self, u, v, data=None):
+        return self.cost((u, v) if u < v else (v, u))
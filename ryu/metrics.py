@@ -0,0 +1,63 @@
+from bisect import bisect_left
+
+# Bucket upper bounds in seconds
+LATENCY_BOUNDS = [0.0005, 0.001, 0.002, 0.005, 0.01, 0.02, 0.05,
+                  0.1, 0.2, 0.5, 1.0, 2.0, 5.0]
+# Bucket upper bounds for counts
+SIZE_BOUNDS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000]
+
+
+class Histogram(object):
+    # Samples counted per bucket, bucket i holds values <= bounds[i],
+    # the last bucket holds everything above the last bound
+
+    def __init__(self, bounds):
+        super(Histogram, self).__init__()
+        self.bounds = list(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = None
+
+    def add(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def mean(self):
+        if self.count == 0:
+            return None
+        return self.sum / self.count
+
+    def percentile(self, p):
+        # Upper bound of the bucket holding the p-th percentile
+        if self.count == 0:
+            return None
+        rank = p / 100.0 * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if count != 0 and seen >= rank:
+                if i < len(self.bounds):
+                    return min(self.bounds[i], self.max)
+                return self.max
+        return self.max
+
+    def to_dict(self):
+        d = {
+            "bounds": self.bounds,
+            "counts": self.counts,
+            "count": self.count,
+            "sum": self.sum,
+            "max": self.max
+        }
+        return d
+
+    def __str__(self):
+        if self.count == 0:
+            return "Histogram<count=0>"
+        return "Histogram<count=%d, mean=%g, p50=%g, p99=%g, max=%g>" % \
+            (self.count, self.mean(), self.percentile(50),
+             self.percentile(99), self.max)
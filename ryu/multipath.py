@@ -0,0 +1,155 @@
+from itertools import islice
+
+import networkx as nx
+
+# How the buckets of a select group share the flow:
+#   equal     every next hop alike
+#   paths     by the number of paths to the destination behind the hop
+#   residual  by the bandwidth left on the way to the destination
+WEIGHTINGS = ("equal", "paths", "residual")
+# Bucket weights of a group are scaled to 1..MAX_WEIGHT
+MAX_WEIGHT = 100
+# Paths tried per path taken, before giving up on the rest
+MAX_TRIES = 4
+INF = float("inf")
+
+
+def link_cost(u, v, weight=None):
+    return 1 if weight is None else weight(u, v)
+
+
+def path_cost(path, weight=None):
+    cost = 0
+    for i in xrange(len(path) - 1):
+        cost += link_cost(path[i], path[i + 1], weight)
+    return cost
+
+
+class MultipathPlanner(object):
+    # Next hops of the multipath flows to a destination. The paths are the
+    # k shortest simple paths from the source that cost at most stretch
+    # times the shortest one, equal cost ones only with a stretch of 1.
+    # Switches forward by destination alone, so a packet may go from one
+    # path over to another where they meet: a path is left out when its
+    # next hops would loop with those taken so far, or would let a packet
+    # take a way that costs more than the stretch allows.
+
+    def __init__(self, graph):
+        super(MultipathPlanner, self).__init__()
+        self.graph = graph
+        self.k = 16
+        self.stretch = 1.0
+        self.weighting = "paths"
+        # Change of a bucket weight, out of MAX_WEIGHT, before the group
+        # gets modified
+        self.reweight_step = 10
+
+    def config(self, conf):
+        self.k = conf.get("multipath_k", 16)
+        self.stretch = conf.get("multipath_stretch", 1.0)
+        self.weighting = conf.get("multipath_weights", "paths")
+        if self.weighting not in WEIGHTINGS:
+            raise ValueError("unknown multipath weights %s" % self.weighting)
+        self.reweight_step = conf.get("multipath_reweight_step", 10)
+
+    def candidates(self, src, dst, weight=None):
+        # Paths from src to dst, shortest first
+        if self.stretch <= 1.0:
+            return nx.all_shortest_paths(self.graph, source=src, target=dst,
+                                         weight=weight)
+        graph = self.graph
+        attr = None
+        if weight is not None:
+            # shortest_simple_paths only takes an edge attribute
+            graph = self.graph.copy()
+            for u, v, data in graph.edges(data=True):
+                data["weight"] = weight(u, v)
+            attr = "weight"
+        return nx.shortest_simple_paths(graph, src, dst, weight=attr)
+
+    def plan(self, src, dst, weight=None):
+        # node -> set(next hop) towards dst
+        nexts = {}
+        limit = None
+        taken = 0
+        for path in islice(self.candidates(src, dst, weight),
+                           self.k * MAX_TRIES):
+            if limit is None:
+                cost = path_cost(path, weight)
+                limit = cost * self.stretch + 1e-9 * max(cost, 1)
+            elif path_cost(path, weight) > limit:
+                break
+            added = []
+            for i in xrange(len(path) - 1):
+                hops = nexts.setdefault(path[i], set())
+                if path[i + 1] not in hops:
+                    hops.add(path[i + 1])
+                    added.append((path[i], path[i + 1]))
+            if self.longest(nexts, src, weight) > limit:
+                for u, v in added:
+                    nexts[u].discard(v)
+                    if len(nexts[u]) == 0:
+                        del nexts[u]
+                continue
+            taken += 1
+            if taken >= self.k:
+                break
+        return nexts
+
+    def longest(self, nexts, src, weight=None):
+        # Cost of the longest way from src along nexts, INF if they loop
+        return self._longest(nexts, src, weight, {}, set())
+
+    def _longest(self, nexts, node, weight, lengths, active):
+        if node in lengths:
+            return lengths[node]
+        if node in active:
+            return INF
+        active.add(node)
+        length = 0
+        for hop in nexts.get(node, ()):
+            length = max(length,
+                         self._longest(nexts, hop, weight, lengths, active) +
+                         link_cost(node, hop, weight))
+        active.discard(node)
+        lengths[node] = length
+        return length
+
+    def weights(self, nexts, dst, residual=None):
+        # node -> next hop -> bucket weight. residual(u, v) is the
+        # bandwidth left on a link, needed by the residual weights.
+        weights = {}
+        if self.weighting == "equal":
+            for node, hops in nexts.items():
+                weights[node] = dict.fromkeys(hops, MAX_WEIGHT)
+            return weights
+        if self.weighting != "residual":
+            residual = None
+        values = {dst: 1 if residual is None else INF}
+        for node, hops in nexts.items():
+            shares = {}
+            for hop in hops:
+                shares[hop] = self._share(nexts, node, hop, residual, values)
+            top = max(shares.values())
+            for hop, share in shares.items():
+                shares[hop] = max(1, int(round(share * MAX_WEIGHT / top)))
+            weights[node] = shares
+        return weights
+
+    def _share(self, nexts, node, hop, residual, values):
+        # Paths behind hop, or the bandwidth node can pass on through it
+        value = values.get(hop)
+        if value is None:
+            value = 0
+            for next_hop in nexts[hop]:
+                value += self._share(nexts, hop, next_hop, residual, values)
+            values[hop] = value
+        if residual is None:
+            return value
+        return min(residual(node, hop), value)
+
+    def moved(self, old, new):
+        for hop, weight in new.items():
+            if abs(weight - old.get(hop, 0)) >= self.reweight_step:
+                return True
+        return False
@@ -0,0 +1,535 @@
+from collections import deque, OrderedDict
+
+import networkx as nx
+try:
+    import numpy as np
+    from scipy.sparse import csr_matrix
+    from scipy.sparse.csgraph import shortest_path
+except ImportError:
+    np = None
+
+
+def bfs_lengths(adjacency):
+    # Hop counts of all pairs, all sources take a breadth-first level at
+    # once: the frontier of every source is a column and one sparse
+    # product gives the next one. Nodes are unreached while inf.
+    n = adjacency.shape[0]
+    dist = np.full((n, n), np.inf, dtype=np.float32)
+    np.fill_diagonal(dist, 0)
+    frontier = np.eye(n, dtype=np.float32)
+    level = 0
+    while True:
+        new = adjacency.dot(frontier) > 0
+        new &= np.isinf(dist)
+        if not new.any():
+            return dist
+        level += 1
+        dist[new] = level
+        frontier = new.astype(np.float32)
+
+
+class IncrementalPaths(object):
+    # All-pairs shortest paths that are maintained one topology change
+    # at a time. paths/pathlens have the same layout as the output of
+    # nx.shortest_path(graph), but only the single-source trees that a
+    # change can actually affect are recomputed.
+
+    def __init__(self, graph):
+        super(IncrementalPaths, self).__init__()
+        self.graph = graph
+        # src -> dst -> [src, ..., dst]
+        self.paths = {}
+        # src -> dst -> len(path)
+        self.pathlens = {}
+        # Bumped on every change that touches the graph
+        self.version = 0
+        # Number of single-source trees recomputed or repaired so far
+        self.updated = 0
+        for src in self.graph.nodes():
+            self._update_source(src)
+
+    def _update_source(self, src):
+        paths = nx.single_source_shortest_path(self.graph, src)
+        self.paths[src] = paths
+        self.pathlens[src] = dict((dst, len(path))
+                                  for dst, path in paths.items())
+        self.updated += 1
+
+    def _relax_source(self, src, u, v):
+        # The new edge (u, v) shortens the path to v, push the improvement
+        # breadth-first to every node that gets closer through v. Paths
+        # stay prefix-consistent since an improved node always passes its
+        # new prefix on to its old descendants.
+        paths = self.paths[src]
+        pathlens = self.pathlens[src]
+        queue = deque([(u, v)])
+        while len(queue) != 0:
+            parent, node = queue.popleft()
+            new_len = pathlens[parent] + 1
+            if pathlens.get(node, new_len + 1) <= new_len:
+                continue
+            paths[node] = paths[parent] + [node]
+            pathlens[node] = new_len
+            for neighbor in self.graph.neighbors(node):
+                if pathlens.get(neighbor, new_len + 2) > new_len + 1:
+                    queue.append((node, neighbor))
+        self.updated += 1
+
+    def _uses_edge(self, src, u, v):
+        # Paths of a source form a tree, so an edge is only used when
+        # one of its ends is the parent of the other one
+        path = self.paths[src].get(v)
+        if path is not None and len(path) > 1 and path[-2] == u:
+            return True
+        path = self.paths[src].get(u)
+        if path is not None and len(path) > 1 and path[-2] == v:
+            return True
+        return False
+
+    def add_node(self, node):
+        if node in self.graph:
+            return
+        self.graph.add_node(node)
+        self.version += 1
+        # A new node is isolated, nobody else can reach it yet
+        self._update_source(node)
+
+    def remove_node(self, node):
+        if node not in self.graph:
+            return
+        neighbors = list(self.graph.neighbors(node))
+        self.graph.remove_node(node)
+        self.version += 1
+        self.paths.pop(node, None)
+        self.pathlens.pop(node, None)
+        for src in self.paths.keys():
+            if node not in self.pathlens[src]:
+                continue
+            # Only sources routing through the node need a new tree,
+            # for the others the node was a leaf
+            routed = False
+            for neighbor in neighbors:
+                path = self.paths[src].get(neighbor)
+                if path is not None and len(path) > 1 and path[-2] == node:
+                    routed = True
+                    break
+            if routed:
+                self._update_source(src)
+            else:
+                del self.paths[src][node]
+                del self.pathlens[src][node]
+
+    def add_edge(self, u, v):
+        if self.graph.has_edge(u, v):
+            return
+        for node in (u, v):
+            if node not in self.graph:
+                self.add_node(node)
+        self.graph.add_edge(u, v)
+        self.version += 1
+        for src in self.paths.keys():
+            len_u = self.pathlens[src].get(u)
+            len_v = self.pathlens[src].get(v)
+            if len_u is None and len_v is None:
+                continue
+            # Adding an edge never makes a path longer, only the side
+            # that gets closer needs to be repaired
+            if len_v is None or (len_u is not None and len_u + 1 < len_v):
+                self._relax_source(src, u, v)
+            elif len_u is None or len_v + 1 < len_u:
+                self._relax_source(src, v, u)
+
+    def remove_edge(self, u, v):
+        if not self.graph.has_edge(u, v):
+            return
+        self.graph.remove_edge(u, v)
+        self.version += 1
+        for src in self.paths.keys():
+            if self._uses_edge(src, u, v):
+                self._update_source(src)
+
+    def rebuild(self):
+        self.version += 1
+        self.paths.clear()
+        self.pathlens.clear()
+        for src in self.graph.nodes():
+            self._update_source(src)
+
+
+class LazyPaths(object):
+    # Shortest paths computed one source at a time on first use and kept
+    # in a bounded LRU cache, so memory grows with the number of switches
+    # that are actually asked about rather than with V*V.
+    #
+    # paths/pathlens can be indexed like the dicts of IncrementalPaths.
+    # The graph is undirected, so a lookup from src to dst is answered
+    # from the tree of dst when only that one is cached. Misses compute
+    # the tree of dst: the heuristics ask from tree nodes towards stream
+    # endpoints, which keeps the cache down to one tree per endpoint.
+
+    def __init__(self, graph, capacity=256, weight=None):
+        super(LazyPaths, self).__init__()
+        self.graph = graph
+        self.capacity = capacity
+        # Edge attribute holding link costs, hop count if None
+        self.weight = weight
+        self.version = 0
+        # src -> (paths, pathlens), least recently used first
+        self._cache = OrderedDict()
+        self.paths = _PathView(self, False)
+        self.pathlens = _PathView(self, True)
+        self.hits = 0
+        self.misses = 0
+
+    def tree(self, src):
+        entry = self._cache.pop(src, None)
+        if entry is None:
+            self.misses += 1
+            if self.weight is None:
+                paths = nx.single_source_shortest_path(self.graph, src)
+                pathlens = dict((dst, len(path))
+                                for dst, path in paths.items())
+            else:
+                pathlens, paths = nx.single_source_dijkstra(
+                    self.graph, src, weight=self.weight)
+            entry = (paths, pathlens)
+            while len(self._cache) >= self.capacity:
+                self._cache.popitem(last=False)
+        else:
+            self.hits += 1
+        self._cache[src] = entry
+        return entry
+
+    def lookup(self, src, dst, lens):
+        if src not in self.graph or dst not in self.graph:
+            return None
+        if src in self._cache or src == dst:
+            paths, pathlens = self.tree(src)
+            return pathlens.get(dst) if lens else paths.get(dst)
+        paths, pathlens = self.tree(dst)
+        if src not in pathlens:
+            return None
+        return pathlens[src] if lens else paths[src][::-1]
+
+    def reachable(self, src):
+        return iter(self.tree(src)[1])
+
+    def invalidate(self):
+        self.version += 1
+        self._cache.clear()
+
+    def add_node(self, node):
+        if node in self.graph:
+            return
+        self.graph.add_node(node)
+        self.invalidate()
+
+    def remove_node(self, node):
+        if node not in self.graph:
+            return
+        self.graph.remove_node(node)
+        self.invalidate()
+
+    def add_edge(self, u, v):
+        if self.graph.has_edge(u, v):
+            return
+        self.graph.add_edge(u, v)
+        self.invalidate()
+
+    def remove_edge(self, u, v):
+        if not self.graph.has_edge(u, v):
+            return
+        self.graph.remove_edge(u, v)
+        self.invalidate()
+
+    def rebuild(self):
+        self.invalidate()
+
+
+class MatrixPaths(object):
+    # Hop counts (or costs, with weight) of all pairs as a NumPy matrix.
+    # Hop counts come from bfs_lengths, explicit paths for the pairs that
+    # are asked about go down the hop counts from the destination. Costs
+    # come from scipy.sparse.csgraph with the predecessor matrix for the
+    # paths. Topology changes only mark the matrices stale, they are
+    # computed again on the next lookup. Takes 4 bytes per pair of
+    # switches, 8 with weight.
+    #
+    # paths/pathlens can be indexed like the dicts of IncrementalPaths,
+    # the tree heuristics search them with nearest() instead.
+
+    def __init__(self, graph, weight=None):
+        super(MatrixPaths, self).__init__()
+        if np is None:
+            raise ImportError("MatrixPaths needs numpy and scipy")
+        self.graph = graph
+        # Link cost function like the networkx ones, hop count if None
+        self.weight = weight
+        self.version = 0
+        # Version the matrices were computed for
+        self.computed = None
+        # Sorted dpids and dpid -> index
+        self.nodes = []
+        self.index = {}
+        # index -> sorted indexes of its neighbors
+        self.neighbors = []
+        # Hops or costs between indexes, inf when unreachable
+        self.dist = None
+        # Index before the last one on the path, -9999 for none, only
+        # kept with weight
+        self.pred = None
+        self.paths = _PathView(self, False)
+        self.pathlens = _PathView(self, True)
+
+    def refresh(self):
+        if self.computed == self.version:
+            return
+        self.nodes = sorted(self.graph.nodes())
+        self.index = dict((node, i) for i, node in enumerate(self.nodes))
+        n = len(self.nodes)
+        edges = [(self.index[u], self.index[v])
+                 for u, v in self.graph.edges()]
+        self.neighbors = [[] for i in xrange(n)]
+        for u, v in edges:
+            self.neighbors[u].append(v)
+            self.neighbors[v].append(u)
+        for neighbors in self.neighbors:
+            neighbors.sort()
+        rows = np.array([u for u, v in edges] + [v for u, v in edges],
+                        dtype=np.int32)
+        cols = np.array([v for u, v in edges] + [u for u, v in edges],
+                        dtype=np.int32)
+        if self.weight is None:
+            adjacency = csr_matrix((np.ones(len(rows), dtype=np.float32),
+                                    (rows, cols)), shape=(n, n))
+            self.dist = bfs_lengths(adjacency)
+            self.pred = None
+        else:
+            # csgraph drops explicit zeros, costs are kept positive
+            costs = np.array([self.weight(u, v, data) for u, v, data
+                              in self.graph.edges(data=True)],
+                             dtype=np.float64)
+            costs = np.maximum(np.concatenate((costs, costs)), 1e-6)
+            adjacency = csr_matrix((costs, (rows, cols)), shape=(n, n))
+            dist, pred = shortest_path(adjacency, directed=False,
+                                       return_predecessors=True)
+            self.dist = dist.astype(np.float32)
+            self.pred = pred.astype(np.int32)
+        self.computed = self.version
+
+    def path(self, src, dst):
+        self.refresh()
+        i = self.index.get(src)
+        j = self.index.get(dst)
+        if i is None or j is None or np.isinf(self.dist[i, j]):
+            return None
+        path = [dst]
+        if self.pred is not None:
+            pred = self.pred[i]
+            while j != i:
+                j = pred[j]
+                path.append(self.nodes[j])
+            return path[::-1]
+        # Every hop towards src is the lowest neighbor one hop closer
+        row = self.dist[i]
+        hops = row.item(j)
+        while hops > 0:
+            hops -= 1
+            for j in self.neighbors[j]:
+                if row.item(j) == hops:
+                    break
+            path.append(self.nodes[j])
+        return path[::-1]
+
+    def lookup(self, src, dst, lens):
+        if not lens:
+            return self.path(src, dst)
+        self.refresh()
+        i = self.index.get(src)
+        j = self.index.get(dst)
+        if i is None or j is None or np.isinf(self.dist[i, j]):
+            return None
+        if self.weight is not None:
+            return float(self.dist[i, j])
+        return int(self.dist[i, j]) + 1
+
+    def reachable(self, src):
+        self.refresh()
+        row = self.dist[self.index[src]]
+        return iter([self.nodes[j] for j in np.flatnonzero(~np.isinf(row))])
+
+    def nearest(self, clients):
+        return NearestClients(self, clients)
+
+    def nearest_node(self, nodes, dst):
+        # The node closest to dst, None if none of them reaches it
+        self.refresh()
+        j = self.index.get(dst)
+        rows = [self.index[node] for node in sorted(nodes)
+                if node in self.index]
+        if j is None or len(rows) == 0:
+            return None
+        column = self.dist[rows, j]
+        i = column.argmin()
+        if np.isinf(column[i]):
+            return None
+        return self.nodes[rows[i]]
+
+    def add_node(self, node):
+        if node in self.graph:
+            return
+        self.graph.add_node(node)
+        self.version += 1
+
+    def remove_node(self, node):
+        if node not in self.graph:
+            return
+        self.graph.remove_node(node)
+        self.version += 1
+
+    def add_edge(self, u, v):
+        if self.graph.has_edge(u, v):
+            return
+        self.graph.add_edge(u, v)
+        self.version += 1
+
+    def remove_edge(self, u, v):
+        if not self.graph.has_edge(u, v):
+            return
+        self.graph.remove_edge(u, v)
+        self.version += 1
+
+    def rebuild(self):
+        self.version += 1
+
+
+class NearestClients(object):
+    # Prim-style search over MatrixPaths: the distance from the tree to
+    # every pending client is a vector, nodes joining the tree lower it
+    # with a min over their rows and the next client is its argmin. Ties
+    # go to the lowest client dpid. Below SMALL clients the vectors are
+    # lists, NumPy calls cost more than the loops over them.
+
+    SMALL = 64
+
+    def __init__(self, engine, clients):
+        super(NearestClients, self).__init__()
+        engine.refresh()
+        self.engine = engine
+        self.clients = [client for client in sorted(clients)
+                        if client in engine.index]
+        self.cols = np.array([engine.index[client]
+                              for client in self.clients], dtype=np.intp)
+        n = len(self.clients)
+        self.small = n < self.SMALL
+        if self.small:
+            self.best = [np.inf] * n
+            self.branch = [0] * n
+            self.pending = [True] * n
+        else:
+            # Distance from the tree to each client, inf once it is done
+            self.best = np.full(n, np.inf, dtype=np.float32)
+            # Index of the tree node each best distance is from
+            self.branch = np.zeros(n, dtype=np.int32)
+            self.pending = np.ones(n, dtype=bool)
+        # Clients not in the graph can never be reached
+        self.unknown = len(clients) - len(self.clients)
+
+    def add(self, nodes):
+        # All the nodes in one go, the lowest one wins a tie as if they
+        # were added one by one in order
+        index = self.engine.index
+        rows = sorted(index[node] for node in nodes if node in index)
+        if len(rows) == 0 or len(self.clients) == 0:
+            return
+        if self.small:
+            best = self.best
+            pending = self.pending
+            for i in rows:
+                dist = self.engine.dist[i].take(self.cols).tolist()
+                for k in xrange(len(dist)):
+                    if dist[k] < best[k] and pending[k]:
+                        best[k] = dist[k]
+                        self.branch[k] = i
+            return
+        if len(rows) == 1:
+            dist = self.engine.dist[rows[0]].take(self.cols)
+        else:
+            dist = self.engine.dist[rows].take(self.cols, axis=1)
+            nearest = dist.argmin(axis=0)
+            dist = dist.min(axis=0)
+        better = dist < self.best
+        better &= self.pending
+        self.best[better] = dist[better]
+        if len(rows) == 1:
+            self.branch[better] = rows[0]
+        else:
+            self.branch[better] = np.array(rows,
+                                           dtype=np.int32)[nearest[better]]
+
+    def pop(self):
+        # Returns (client, branch), None once no client can be reached
+        if self.unknown != 0 or len(self.clients) == 0:
+            return None
+        if self.small:
+            i = min(xrange(len(self.best)), key=self.best.__getitem__)
+        else:
+            i = self.best.argmin()
+        if self.best[i] == np.inf:
+            return None
+        self.best[i] = np.inf
+        self.pending[i] = False
+        return self.clients[i], self.engine.nodes[int(self.branch[i])]
+
+
+class _PathView(object):
+    # src -> row, rows are created on the fly and never stored
+
+    def __init__(self, provider, lens):
+        super(_PathView, self).__init__()
+        self._provider = provider
+        self._lens = lens
+        # The path provider, for the ones with their own search
+        self.engine = provider
+
+    def __contains__(self, src):
+        return src in self._provider.graph
+
+    def __getitem__(self, src):
+        if src not in self._provider.graph:
+            raise KeyError(src)
+        return _PathRow(self._provider, src, self._lens)
+
+    def __iter__(self):
+        return iter(self._provider.graph)
+
+    def get(self, src, default=None):
+        if src not in self._provider.graph:
+            return default
+        return self[src]
+
+
+class _PathRow(object):
+    # dst -> path or path length for a single source
+
+    def __init__(self, provider, src, lens):
+        super(_PathRow, self).__init__()
+        self._provider = provider
+        self._src = src
+        self._lens = lens
+
+    def __contains__(self, dst):
+        return self._provider.lookup(self._src, dst, True) is not None
+
+    def __getitem__(self, dst):
+        value = self._provider.lookup(self._src, dst, self._lens)
+        if value is None:
+            raise KeyError(dst)
+        return value
+
+    def __iter__(self):
+        return self._provider.reachable(self._src)
+
+    def get(self, dst, default=None):
+        value = self._provider.lookup(self._src, dst, self._lens)
+        return default if value is None else value
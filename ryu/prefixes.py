@@ -0,0 +1,60 @@
+def prefix_mask(plen):
+    return (0xffffffff << (32 - plen)) & 0xffffffff
+
+
+class PrefixTable(object):
+    # IPv4 routes of one switch, host address -> out port, aggregated
+    # into prefixes. Two sibling prefixes with the same out port are
+    # merged into their parent, so a prefix always covers a full block of
+    # routed addresses and nothing else: an address that is not routed
+    # still misses the table.
+
+    def __init__(self):
+        super(PrefixTable, self).__init__()
+        # ip(int) -> out_port
+        self.routes = {}
+        # (net, plen) -> out_port
+        self.prefixes = {}
+        # Bumped whenever the prefixes change
+        self.version = 0
+
+    def __len__(self):
+        return len(self.prefixes)
+
+    def add(self, ip, port):
+        old = self.routes.get(ip)
+        if old == port:
+            return
+        if old is not None:
+            self.remove(ip)
+        self.routes[ip] = port
+        net, plen = ip, 32
+        while plen > 0:
+            sibling = (net ^ (1 << (32 - plen)), plen)
+            if self.prefixes.get(sibling) != port:
+                break
+            del self.prefixes[sibling]
+            plen -= 1
+            net &= prefix_mask(plen)
+        self.prefixes[(net, plen)] = port
+        self.version += 1
+
+    def remove(self, ip):
+        port = self.routes.pop(ip, None)
+        if port is None:
+            return
+        plen = 32
+        while (ip & prefix_mask(plen), plen) not in self.prefixes:
+            plen -= 1
+        del self.prefixes[(ip & prefix_mask(plen), plen)]
+        # The rest of the block goes back as the halves beside ip
+        while plen < 32:
+            plen += 1
+            sibling = (ip & prefix_mask(plen)) ^ (1 << (32 - plen))
+            self.prefixes[(sibling, plen)] = port
+        self.version += 1
+
+    def clear(self):
+        self.routes.clear()
+        self.prefixes.clear()
+        self.version += 1
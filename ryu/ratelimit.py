@@ -0,0 +1,183 @@
+from ryu.lib import addrconv
+
+# Meters of the switches, in the "wrapper" range of ids.ID_RANGES above
+# the ones of the streams. OFPM_MAX is the last meter id a switch can hold.
+PACKET_IN_METER_ID = 0xffff0000
+OFFENDER_METER_ID = 0xfffeffff
+# Offender rules sit right above the table-miss entry, so they only catch
+# what would have gone to the controller anyway
+OFFENDER_PRIORITY = 1
+
+# What the limiter does with a packet-in
+PASS = 0
+DROP = 1
+# Dropped, and the source just became an offender
+BLOCK = 2
+
+
+class TokenBucket(object):
+    # rate tokens per second up to burst, one token per packet
+
+    def __init__(self, rate, burst, now):
+        super(TokenBucket, self).__init__()
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.last = now
+
+    def refill(self, now):
+        if now > self.last:
+            self.tokens = min(self.burst,
+                              self.tokens + (now - self.last) * self.rate)
+            self.last = now
+
+    def take(self, now):
+        self.refill(now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def full(self, now):
+        self.refill(now)
+        return self.tokens >= self.burst
+
+
+class PacketInLimiter(object):
+    # Token buckets on the packet-ins of every switch and of every source
+    # MAC at a switch. A source with strikes packet-ins dropped before its
+    # bucket got full again is an offender: the switch gets a rule for it
+    # that drops or meters its packets there for block seconds. Sources
+    # are kept by their raw MAC as it is in the frames.
+
+    def __init__(self):
+        super(PacketInLimiter, self).__init__()
+        self.enabled = False
+        # packets/s and burst of a switch and of a source
+        self.switch_rate = 1000
+        self.switch_burst = 2000
+        self.source_rate = 100
+        self.source_burst = 200
+        self.strikes = 100
+        self.block = 10
+        # "drop" or "meter", offenders get metered to offender_rate
+        self.offender_action = "drop"
+        self.offender_rate = 10
+        # Packets/s of the table-miss meter, None for no meter
+        self.miss_rate = None
+        # Sources kept at most, full buckets go first
+        self.max_sources = 10000
+        # dpid -> TokenBucket
+        self.switches = {}
+        # (dpid, mac) -> TokenBucket
+        self.sources = {}
+        # (dpid, mac) -> drops since its bucket was last full
+        self.misses = {}
+        # (dpid, mac) -> time its rule expires
+        self.blocked = {}
+        # dpid -> {passed, dropped, throttled}
+        self.counters = {}
+
+    def config(self, conf):
+        self.enabled = conf.get("packet_in_limit", False)
+        self.switch_rate = conf.get("packet_in_rate", 1000)
+        self.switch_burst = conf.get("packet_in_burst", 2 * self.switch_rate)
+        self.source_rate = conf.get("source_rate", 100)
+        self.source_burst = conf.get("source_burst", 2 * self.source_rate)
+        self.strikes = conf.get("offender_strikes", 100)
+        self.block = conf.get("offender_block", 10)
+        self.offender_action = conf.get("offender_action", "drop")
+        self.offender_rate = conf.get("offender_rate", 10)
+        self.miss_rate = conf.get("table_miss_rate")
+        self.max_sources = conf.get("max_sources", 10000)
+
+    def counter(self, dpid):
+        counter = self.counters.get(dpid)
+        if counter is None:
+            counter = {"passed": 0, "dropped": 0, "throttled": 0}
+            self.counters[dpid] = counter
+        return counter
+
+    def check(self, dpid, src, now):
+        # PASS, DROP or BLOCK for a packet-in from src at dpid
+        if not self.enabled:
+            return PASS
+        counter = self.counter(dpid)
+        key = (dpid, src)
+        bucket = self.switches.get(dpid)
+        if bucket is None:
+            bucket = TokenBucket(self.switch_rate, self.switch_burst, now)
+            self.switches[dpid] = bucket
+        source = self.sources.get(key)
+        if source is None:
+            if len(self.sources) >= self.max_sources:
+                self.prune(now)
+            source = TokenBucket(self.source_rate, self.source_burst, now)
+            self.sources[key] = source
+        # The source pays first, a flooding host does not use up the
+        # tokens of the others at the switch. Its strikes only go once
+        # it let its bucket fill up again.
+        calm = source.full(now)
+        if not source.take(now):
+            counter["dropped"] += 1
+            return self.strike(key, now, counter)
+        if calm:
+            self.misses.pop(key, None)
+        if not bucket.take(now):
+            counter["dropped"] += 1
+            return DROP
+        counter["passed"] += 1
+        return PASS
+
+    def strike(self, key, now, counter):
+        misses = self.misses.get(key, 0) + 1
+        self.misses[key] = misses
+        if misses < self.strikes:
+            return DROP
+        if self.blocked.get(key, 0) > now:
+            # Packets the switch had queued before the rule went in
+            return DROP
+        del self.misses[key]
+        self.blocked[key] = now + self.block
+        counter["throttled"] += 1
+        return BLOCK
+
+    def prune(self, now):
+        for key, bucket in self.sources.items():
+            if bucket.full(now) and key not in self.misses:
+                del self.sources[key]
+        if len(self.sources) >= self.max_sources:
+            # Spoofed MACs fill the table faster than buckets fill up,
+            # the sources heard from least recently go
+            keys = sorted(self.sources, key=lambda key: self.sources[key].last)
+            for key in keys[:len(keys) - self.max_sources * 3 / 4]:
+                del self.sources[key]
+                self.misses.pop(key, None)
+        for key, until in self.blocked.items():
+            if until <= now:
+                del self.blocked[key]
+
+    def forget(self, dpid):
+        self.switches.pop(dpid, None)
+        self.counters.pop(dpid, None)
+        for table in (self.sources, self.misses, self.blocked):
+            for key in table.keys():
+                if key[0] == dpid:
+                    del table[key]
+
+    def to_dict(self, now):
+        counters = {}
+        for dpid, counter in self.counters.items():
+            counters[dpid] = dict(counter)
+        blocked = []
+        for (dpid, src), until in self.blocked.items():
+            if until > now:
+                blocked.append({"dpid": dpid,
+                                "mac": addrconv.mac.bin_to_text(src),
+                                "until": until})
+        d = {
+            "enabled": self.enabled,
+            "counters": counters,
+            "blocked": blocked
+        }
+        return d
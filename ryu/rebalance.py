@@ -0,0 +1,141 @@
+from collections import deque
+
+from paths import LazyPaths
+
+
+class Rebalancer(object):
+    # Moves streams off links that run hot. A link is hot once its
+    # utilisation goes above threshold and stays so until it falls below
+    # clear. At most one round runs per interval; a round picks the
+    # biggest streams over the hot links until the projected load is
+    # below clear, at most max_streams of them, and a stream that moved
+    # is held in its new tree for hold seconds. Together that keeps trees
+    # from swinging between two links.
+
+    def __init__(self, network):
+        super(Rebalancer, self).__init__()
+        # Streaming, for loads, capacities, streams and link costs
+        self.network = network
+        self.threshold = 0.9
+        self.clear = 0.7
+        self.interval = 10.0
+        self.hold = 60.0
+        self.max_streams = 2
+        # links(src<dst) above threshold, until they get below clear
+        self.hot = set()
+        # stream_id -> time it may move again
+        self.held = {}
+        self.last_round = None
+        self.rounds = 0
+        self.moved = 0
+        # Streams that found no way around the hot links
+        self.stuck = 0
+        # Peak utilisation before and after the last rounds
+        self.history = deque(maxlen=100)
+
+    def config(self, conf):
+        self.threshold = conf.get("rebalance_threshold", 0.9)
+        self.clear = conf.get("rebalance_clear", 0.7)
+        self.interval = conf.get("rebalance_interval", 10.0)
+        self.hold = conf.get("rebalance_hold", 60.0)
+        self.max_streams = conf.get("rebalance_max_streams", 2)
+
+    def utilisation(self, link):
+        return float(self.network.link_load(link)) / \
+            self.network.link_capacity(link)
+
+    def peak(self):
+        # Highest utilisation of any link a stream runs over
+        peak = 0.0
+        for link, stream_ids in self.network.link_to_streams.items():
+            if len(stream_ids) != 0:
+                peak = max(peak, self.utilisation(link))
+        return peak
+
+    def update(self, links):
+        for link in links:
+            if link not in self.network.link_to_streams:
+                self.hot.discard(link)
+                continue
+            util = self.utilisation(link)
+            if util > self.threshold:
+                self.hot.add(link)
+            elif util < self.clear:
+                self.hot.discard(link)
+
+    def forget(self, links):
+        # Links that went away are not hot any more
+        self.hot -= set(links)
+
+    def plan(self, links, now):
+        # stream_ids to move off the hot links in this round
+        self.update(links)
+        # Links no tree can run over any more are not reported again
+        self.hot = set(link for link in self.hot
+                       if link in self.network.link_to_streams)
+        for stream_id, until in self.held.items():
+            if until <= now or stream_id not in self.network.streams:
+                del self.held[stream_id]
+        if len(self.hot) == 0:
+            return []
+        if self.last_round is not None and \
+                now - self.last_round < self.interval:
+            return []
+        network = self.network
+        picked = []
+        # Load of the hot links without the streams picked so far, a
+        # stream leaves all the hot links of its tree
+        loads = dict((link, network.link_load(link)) for link in self.hot)
+        for link in sorted(self.hot, key=self.utilisation, reverse=True):
+            target = self.clear * network.link_capacity(link)
+            candidates = sorted(
+                (stream_id for stream_id in network.link_to_streams[link]
+                 if stream_id not in self.held and stream_id not in picked),
+                key=lambda stream_id: (-network.stream_rate(stream_id),
+                                       stream_id))
+            for stream_id in candidates:
+                if loads[link] <= target or len(picked) >= self.max_streams:
+                    break
+                picked.append(stream_id)
+                rate = network.stream_rate(stream_id)
+                for other in network.streams[stream_id]["links"] & self.hot:
+                    loads[other] -= rate
+        if len(picked) != 0:
+            self.last_round = now
+        return picked
+
+    def paths(self, stream):
+        # Path engine over the link costs with every hot link the stream
+        # does not have to use made as expensive as going around it
+        graph = self.network.graph.copy()
+        costs = self.network.link_costs
+        avoid = graph.number_of_nodes()
+        for u, v, data in graph.edges(data=True):
+            link = (u, v) if u < v else (v, u)
+            weight = costs.weight(u, v) if costs.weighted else 1.0
+            if link in self.hot:
+                weight += avoid * max(weight, 1.0)
+            data["weight"] = weight
+        return LazyPaths(graph, capacity=len(stream["clients"]) + 1,
+                         weight="weight")
+
+    def hold_streams(self, stream_ids, now):
+        for stream_id in stream_ids:
+            self.held[stream_id] = now + self.hold
+
+    def record(self, now, moved, stuck, before, after):
+        self.rounds += 1
+        self.moved += moved
+        self.stuck += stuck
+        self.history.append({"time": now, "moved": moved, "stuck": stuck,
+                             "peak_before": before, "peak_after": after})
+
+    def to_dict(self):
+        d = {
+            "rounds": self.rounds,
+            "moved": self.moved,
+            "stuck": self.stuck,
+            "hot": sorted(self.hot),
+            "history": list(self.history)
+        }
+        return d
@@ -0,0 +1,370 @@
+import heapq
+import logging
+import random
+import time
+from collections import deque
+
+from ryu.base import app_manager
+from ryu.controller import ofp_event
+from ryu.controller.handler import MAIN_DISPATCHER
+from ryu.controller.handler import set_ev_cls
+from ryu.ofproto import ofproto_v1_3
+from ryu.lib import hub
+
+from ryu.topology.event import *
+from events import *
+from flows import key_stream_id
+from ids import id_owner
+from metrics import *
+
+STAT_KINDS = ("port", "flow", "group", "meter")
+
+
+class RateSeries(object):
+    # Rates in Kbps of monotonic byte counters, kept in a ring buffer of
+    # (time, rate, ...) samples
+
+    def __init__(self, history):
+        super(RateSeries, self).__init__()
+        self.samples = deque(maxlen=history)
+        # (time, counters) of the last reply
+        self.last = None
+
+    def update(self, now, counters):
+        last = self.last
+        self.last = (now, counters)
+        if last is None or now <= last[0]:
+            return None
+        deltas = [curr - prev for curr, prev in zip(counters, last[1])]
+        # Counters start again from zero when a switch reconnects or an
+        # entry is added again
+        if min(deltas) < 0:
+            return None
+        elapsed = now - last[0]
+        rates = tuple(delta * 8 / 1000.0 / elapsed for delta in deltas)
+        self.samples.append((now,) + rates)
+        return rates
+
+    def latest(self):
+        if len(self.samples) == 0:
+            return None
+        return self.samples[-1]
+
+    def to_list(self):
+        return [list(sample) for sample in self.samples]
+
+
+class StatsCollector(app_manager.RyuApp):
+    # Polls port, flow, group and meter statistics of every datapath.
+    # Each datapath is polled every interval seconds, jittered so polls
+    # of switches that came up together spread out, with at most
+    # max_outstanding datapaths waiting for replies at any time. Rates
+    # go into per port, flow, group and meter ring buffers; link loads
+    # and stream rates are passed on with EventTrafficChanged.
+    OFP_VERSIONS = [ofproto_v1_3.OFP_VERSION]
+    _EVENTS = [EventTrafficChanged]
+
+    def __init__(self, *args, **kwargs):
+        super(StatsCollector, self).__init__(*args, **kwargs)
+        self.logger.setLevel(logging.DEBUG)
+        self.interval = 10.0
+        self.jitter = 0.2
+        self.max_outstanding = 8
+        self.timeout = 10.0
+        self.history = 60
+        self.kinds = STAT_KINDS
+        # Heap of (due, dpid), due times of dpids removed are ignored
+        self.schedule = []
+        # dpid -> due time of its next poll
+        self.due = {}
+        # dpid -> xid -> (kind, sent) of the poll waiting for replies
+        self.outstanding = {}
+        # (dpid, xid) -> stats of a multipart reply still coming
+        self.partial = {}
+        # dpid -> port_no -> RateSeries(rx, tx)
+        self.ports = {}
+        # dpid -> "priority match" -> RateSeries(bytes)
+        self.flows = {}
+        # dpid -> group_id -> RateSeries(bytes)
+        self.groups = {}
+        # dpid -> meter_id -> RateSeries(bytes in)
+        self.meters = {}
+        # dpid -> port_no -> link(src<dst)
+        self.port_links = {}
+        # link -> Kbps, the busier direction
+        self.link_loads = {}
+        # stream_id -> source dpid
+        self.stream_sources = {}
+        # stream_id -> RateSeries of its groups at the source
+        self.streams = {}
+        self.poll_latency = Histogram(LATENCY_BOUNDS)
+        self.polls = 0
+        self.deferred = 0
+        self.timeouts = 0
+
+    def config(self, conf):
+        self.conf = conf
+        self.interval = conf.get("interval", 10.0)
+        self.jitter = conf.get("jitter", 0.2)
+        self.max_outstanding = conf.get("max_outstanding", 8)
+        self.timeout = conf.get("timeout", self.interval)
+        self.history = conf.get("history", 60)
+        self.kinds = tuple(conf.get("kinds", STAT_KINDS))
+
+    def reg_DPSet(self, dpset):
+        self.dpset = dpset
+
+    def start(self):
+        thread = super(StatsCollector, self).start()
+        if self.interval > 0:
+            self.threads.append(hub.spawn(self._poll_loop))
+        return thread
+
+    def _poll_loop(self):
+        tick = min(1.0, self.interval / 10.0)
+        while True:
+            self.poll(time.time())
+            hub.sleep(tick)
+
+    def next_due(self, now):
+        return now + self.interval * \
+            (1 + random.uniform(-self.jitter, self.jitter))
+
+    def add_datapath(self, dpid, now):
+        # First poll anywhere within an interval
+        due = now + random.uniform(0, self.interval)
+        self.due[dpid] = due
+        heapq.heappush(self.schedule, (due, dpid))
+
+    def poll(self, now):
+        for dpid, pending in self.outstanding.items():
+            sent = min(sent for kind, sent in pending.values())
+            if now - sent > self.timeout:
+                self.timeouts += 1
+                for xid in pending:
+                    self.partial.pop((dpid, xid), None)
+                del self.outstanding[dpid]
+        while len(self.schedule) != 0 and self.schedule[0][0] <= now:
+            due, dpid = self.schedule[0]
+            if self.due.get(dpid) != due:
+                heapq.heappop(self.schedule)
+                continue
+            if dpid in self.outstanding:
+                # Its last poll is still running, skip a round
+                heapq.heappop(self.schedule)
+                self.reschedule(dpid, now)
+                continue
+            if len(self.outstanding) >= self.max_outstanding:
+                # Stays due, goes out once a poll completes
+                self.deferred += 1
+                break
+            heapq.heappop(self.schedule)
+            self.reschedule(dpid, now)
+            datapath = self.dpset.get(dpid)
+            if datapath is not None:
+                self.send_requests(datapath, now)
+
+    def reschedule(self, dpid, now):
+        due = self.next_due(now)
+        self.due[dpid] = due
+        heapq.heappush(self.schedule, (due, dpid))
+
+    def send_requests(self, datapath, now):
+        ofproto = datapath.ofproto
+        parser = datapath.ofproto_parser
+        pending = {}
+        for kind in self.kinds:
+            if kind == "port":
+                req = parser.OFPPortStatsRequest(datapath, 0,
+                                                 ofproto.OFPP_ANY)
+            elif kind == "flow":
+                req = parser.OFPFlowStatsRequest(datapath)
+            elif kind == "group":
+                req = parser.OFPGroupStatsRequest(datapath, 0,
+                                                  ofproto.OFPG_ALL)
+            else:
+                req = parser.OFPMeterStatsRequest(datapath, 0,
+                                                  ofproto.OFPM_ALL)
+            datapath.set_xid(req)
+            pending[req.xid] = (kind, now)
+            datapath.send_msg(req)
+        self.outstanding[datapath.id] = pending
+        self.polls += 1
+
+    def collect(self, msg):
+        # Returns the stats of a complete reply, None while more parts of
+        # it are coming or for replies nobody waits for
+        dpid = msg.datapath.id
+        pending = self.outstanding.get(dpid)
+        if pending is None or msg.xid not in pending:
+            return None
+        body = self.partial.setdefault((dpid, msg.xid), [])
+        body.extend(msg.body)
+        if msg.flags & msg.datapath.ofproto.OFPMPF_REPLY_MORE:
+            return None
+        del self.partial[(dpid, msg.xid)]
+        kind, sent = pending.pop(msg.xid)
+        if len(pending) == 0:
+            del self.outstanding[dpid]
+            self.poll_latency.add(time.time() - sent)
+        return body
+
+    @set_ev_cls(ofp_event.EventOFPPortStatsReply, MAIN_DISPATCHER)
+    def _port_stats_reply_handler(self, ev):
+        body = self.collect(ev.msg)
+        if body is not None:
+            self.update_ports(ev.msg.datapath.id, body, time.time())
+
+    @set_ev_cls(ofp_event.EventOFPFlowStatsReply, MAIN_DISPATCHER)
+    def _flow_stats_reply_handler(self, ev):
+        body = self.collect(ev.msg)
+        if body is not None:
+            self.update_flows(ev.msg.datapath.id, body, time.time())
+
+    @set_ev_cls(ofp_event.EventOFPGroupStatsReply, MAIN_DISPATCHER)
+    def _group_stats_reply_handler(self, ev):
+        body = self.collect(ev.msg)
+        if body is not None:
+            self.update_groups(ev.msg.datapath.id, body, time.time())
+
+    @set_ev_cls(ofp_event.EventOFPMeterStatsReply, MAIN_DISPATCHER)
+    def _meter_stats_reply_handler(self, ev):
+        body = self.collect(ev.msg)
+        if body is not None:
+            self.update_meters(ev.msg.datapath.id, body, time.time())
+
+    def update_series(self, table, dpid, now, entries):
+        # entries: [(key, counters)], entries gone from the switch go
+        # from the table too. Returns key -> rates of the new samples.
+        old = table.get(dpid, {})
+        new = {}
+        rates = {}
+        for key, counters in entries:
+            series = old.get(key)
+            if series is None:
+                series = RateSeries(self.history)
+            new[key] = series
+            rate = series.update(now, counters)
+            if rate is not None:
+                rates[key] = rate
+        table[dpid] = new
+        return rates
+
+    def update_ports(self, dpid, body, now):
+        rates = self.update_series(
+            self.ports, dpid, now,
+            [(stat.port_no, (stat.rx_bytes, stat.tx_bytes))
+             for stat in body])
+        loads = {}
+        port_links = self.port_links.get(dpid, {})
+        for port_no, (rx, tx) in rates.items():
+            link = port_links.get(port_no)
+            if link is None:
+                continue
+            # Either end sees both directions, the later reply wins
+            loads[link] = max(rx, tx)
+        if len(loads) != 0:
+            self.link_loads.update(loads)
+            self.send_event_to_observers(EventTrafficChanged(loads, {}))
+
+    def update_flows(self, dpid, body, now):
+        self.update_series(
+            self.flows, dpid, now,
+            [(flow_key(stat), (stat.byte_count,)) for stat in body])
+
+    def update_groups(self, dpid, body, now):
+        self.update_series(
+            self.groups, dpid, now,
+            [(stat.group_id, (stat.byte_count,)) for stat in body])
+        # Every tree version of a stream counts at its source
+        counters = {}
+        for stat in body:
+            if id_owner(stat.group_id) != "stream":
+                continue
+            stream_id = key_stream_id(stat.group_id)
+            if self.stream_sources.get(stream_id) == dpid:
+                counters[stream_id] = counters.get(stream_id, 0) + \
+                    stat.byte_count
+        rates = {}
+        for stream_id, count in counters.items():
+            series = self.streams.setdefault(stream_id,
+                                             RateSeries(self.history))
+            rate = series.update(now, (count,))
+            if rate is not None:
+                rates[stream_id] = rate[0]
+        if len(rates) != 0:
+            self.send_event_to_observers(EventTrafficChanged({}, rates))
+
+    def update_meters(self, dpid, body, now):
+        self.update_series(
+            self.meters, dpid, now,
+            [(stat.meter_id, (stat.byte_in_count,)) for stat in body])
+
+    def link_load(self, link):
+        return self.link_loads.get(link)
+
+    def stream_rate(self, stream_id):
+        series = self.streams.get(stream_id)
+        if series is None or series.latest() is None:
+            return None
+        return series.latest()[1]
+
+    @set_ev_cls(EventSwitchEnter)
+    def _switch_enter_handler(self, ev):
+        dpid = int(ev.switch.to_dict()["dpid"], 16)
+        self.add_datapath(dpid, time.time())
+
+    @set_ev_cls(EventSwitchLeave)
+    def _switch_leave_handler(self, ev):
+        dpid = int(ev.switch.to_dict()["dpid"], 16)
+        self.due.pop(dpid, None)
+        for xid in self.outstanding.pop(dpid, {}):
+            self.partial.pop((dpid, xid), None)
+        for table in (self.ports, self.flows, self.groups, self.meters):
+            table.pop(dpid, None)
+        for link in self.port_links.pop(dpid, {}).values():
+            self.link_loads.pop(link, None)
+
+    @set_ev_cls(EventLinkAdd)
+    def _link_add_handler(self, ev):
+        msg = ev.link.to_dict()
+        src_dpid = int(msg["src"]["dpid"], 16)
+        src_port_no = int(msg["src"]["port_no"], 16)
+        dst_dpid = int(msg["dst"]["dpid"], 16)
+        link = (min(src_dpid, dst_dpid), max(src_dpid, dst_dpid))
+        self.port_links.setdefault(src_dpid, {})[src_port_no] = link
+
+    @set_ev_cls(EventLinkDelete)
+    def _link_del_handler(self, ev):
+        msg = ev.link.to_dict()
+        src_dpid = int(msg["src"]["dpid"], 16)
+        src_port_no = int(msg["src"]["port_no"], 16)
+        link = self.port_links.get(src_dpid, {}).pop(src_port_no, None)
+        if link is not None:
+            self.link_loads.pop(link, None)
+
+    @set_ev_cls(EventStreamSourceEnter)
+    def _source_enter_handler(self, ev):
+        self.stream_sources[ev.stream_id] = ev.src_dpid
+        self.streams.pop(ev.stream_id, None)
+
+    @set_ev_cls(EventStreamSourceLeave)
+    def _source_leave_handler(self, ev):
+        self.stream_sources.pop(ev.stream_id, None)
+        self.streams.pop(ev.stream_id, None)
+
+    def to_dict(self):
+        d = {
+            "polls": self.polls,
+            "deferred": self.deferred,
+            "timeouts": self.timeouts,
+            "outstanding": len(self.outstanding),
+            "poll_latency": self.poll_latency.to_dict()
+        }
+        return d
+
+
+def flow_key(stat):
+    return "%d %s" % (stat.priority,
+                      ",".join("%s=%s" % (field, value)
+                               for field, value in sorted(stat.match.items())))
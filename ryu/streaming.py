@@ -1,6 +1,9 @@
+import cPickle
 import logging
 import os
+import select
 import socket
+import time
 from subprocess import Popen
 from random import randint
 
@@ -9,12 +12,128 @@ from ryu.base import app_manager
 from ryu.controller.handler import MAIN_DISPATCHER
 from ryu.controller.handler import set_ev_cls
 from ryu.ofproto import ofproto_v1_3
+from ryu.lib import hub
 from ryu.lib.packet import ethernet, ipv4
 
 from ryu.topology.event import *
 from events import *
 from addrs import *
 from algorithms import *
+from paths import *
+from trees import *
+from metrics import *
+from flows import *
+from failover import *
+from links import *
+from rebalance import *
+from admission import *
+from ids import *
+
+
+# Interval at which a running tree recompute is checked on
+RECOMPUTE_POLL = 0.005
+
+# Streaming app and event of the recompute being forked, the workers
+# build their trees from it
+_recompute_snapshot = None
+
+
+def _recompute_chunk(stream_ids):
+    streaming, ev = _recompute_snapshot
+    results = []
+    for stream_id in stream_ids:
+        stream = streaming.streams[stream_id]
+        algorithm = streaming.algorithms.get(stream["algorithm"])
+        begin = time.time()
+        new_tree, mod_dpids = algorithm.cal(stream, streaming.paths,
+                                            streaming.pathlens, ev)
+        pairs = None
+        if new_tree is not None:
+            pairs = new_tree.to_list()
+        results.append((stream_id, pairs, mod_dpids, time.time() - begin))
+    return results
+
+
+def _forked_call(fd, func, arg):
+    # Runs in the child, sends back what func returned and leaves
+    # without going through the exit handlers of the controller
+    code = 0
+    try:
+        data = cPickle.dumps(func(arg), cPickle.HIGHEST_PROTOCOL)
+        while len(data) != 0:
+            data = data[os.write(fd, data):]
+    except BaseException:
+        code = 1
+    os._exit(code)
+
+
+class ForkedMap(object):
+    # func over args, one forked child per arg, the results come back
+    # over pipes. multiprocessing.Pool hangs once ryu-manager has
+    # patched threads for eventlet, plain fork and pipes do not. Polled
+    # like the AsyncResult of Pool.map_async.
+
+    def __init__(self, func, args):
+        super(ForkedMap, self).__init__()
+        self.pids = []
+        # read fd -> (index, [data read])
+        self.pipes = {}
+        self.data = [None] * len(args)
+        for i, arg in enumerate(args):
+            rfd, wfd = os.pipe()
+            pid = os.fork()
+            if pid == 0:
+                os.close(rfd)
+                _forked_call(wfd, func, arg)
+            os.close(wfd)
+            self.pids.append(pid)
+            self.pipes[rfd] = (i, [])
+
+    def poll(self, timeout=0):
+        # Reads what the children sent so far, True once all are done
+        if len(self.pipes) != 0:
+            readable = select.select(self.pipes.keys(), [], [], timeout)[0]
+            for fd in readable:
+                data = os.read(fd, 65536)
+                if len(data) != 0:
+                    self.pipes[fd][1].append(data)
+                    continue
+                os.close(fd)
+                i, chunks = self.pipes.pop(fd)
+                self.data[i] = "".join(chunks)
+        if len(self.pipes) != 0:
+            return False
+        for pid in self.pids:
+            os.waitpid(pid, 0)
+        self.pids = []
+        return True
+
+    def ready(self):
+        return self.poll()
+
+    def wait(self):
+        while not self.poll(None):
+            pass
+
+    def get(self):
+        # Raises when a child failed and sent nothing back
+        self.wait()
+        return [cPickle.loads(data) for data in self.data]
+
+
+class RecomputeJob(object):
+    # Trees of the streams hit by one topology change, being built in
+    # forked processes
+
+    def __init__(self, stream_ids, ev, version, trees):
+        super(RecomputeJob, self).__init__()
+        self.stream_ids = stream_ids
+        self.ev = ev
+        # Path engine version and stream trees the workers start from
+        self.version = version
+        self.trees = trees
+        self.started = time.time()
+        self.result = None
 
 
 class MininetRPC(object):
@@ -142,21 +261,50 @@ class ExtManager(object):
         del self.vlc[stream_id][hid]
 
 
+class NullManager(object):
+    # Stands in for ExtManager when no Mininet is attached
+
+    def add_stream(self, stream_id, src_hid, fname):
+        pass
+
+    def add_client(self, stream_id, hid, fname):
+        pass
+
+    def del_stream(self, stream_id):
+        pass
+
+    def del_client(self, stream_id, hid):
+        pass
+
+
 class Streaming(app_manager.RyuApp):
     OFP_VERSIONS = [ofproto_v1_3.OFP_VERSION]
     _EVENTS = [EventHostStatChanged,
                EventSwitchStatChanged,
                EventStreamSourceEnter,
-               EventStreamSourceLeave]
+               EventStreamSourceLeave,
+               EventStreamClientEnter]
 
     def __init__(self, *args, **kwargs):
         super(Streaming, self).__init__(*args, **kwargs)
         self.logger.setLevel(logging.DEBUG)
         # nx.Graph for path calculation
         self.graph = nx.Graph()
-        # Shortest path for the whole network
-        self.paths = None
-        self.pathlens = None
+        # Shortest path for the whole network, kept up to date
+        # incrementally on every topology change
+        self.path_engine = IncrementalPaths(self.graph)
+        self.paths = self.path_engine.paths
+        self.pathlens = self.path_engine.pathlens
+        # Link attributes and the costs paths are computed with
+        self.link_costs = LinkCosts()
+        # Measured by the stats collector, link -> Kbps and
+        # stream_id -> Kbps at the source
+        self.measured_loads = {}
+        self.measured_rates = {}
+        # Moves streams off hot links when "rebalance" is enabled
+        self.rebalancer = Rebalancer(self)
+        # Keeps sources and clients off links they would oversubscribe
+        self.admission = AdmissionControl(self)
         # dpid -> port -> host
         self.port_to_host = {}
         # mac -> {host, sourcing, receving}
@@ -172,17 +320,53 @@ class Streaming(app_manager.RyuApp):
         #              eth_dst
         #              ip_dst
         #              fname
-        #              rate
+        #              rate (Kbps)
+        #              algorithm
         #              clients{dpid->out_ports}
-        #              m_tree{dpid->(parent, children)}
+        #              m_tree(MulticastTree){dpid->(parent, children)}
         #              bandwidth{dpid->pri}
         #              links
+        #              version: tree version being programmed
+        #              live: tree version the source sends into
         self.streams = {}
         # link -> stream_id
         self.link_to_streams = {}
+        # dpid -> links(src<dst) of link_to_streams at the switch
+        self.dpid_to_links = {}
+        # dpid -> stream_ids sourced at the switch
+        self.dpid_to_sources = {}
         # streams that fail to build due to topology change
         self.failed_streams = set()
-        self.algorithm = Shortest_Path_Heuristic()
+        # Multicast tree builders, selected per stream
+        self.algorithms = AlgorithmRegistry(self)
+        # stream_id -> [(queued_time, ev)] client joins/leaves waiting
+        # for the next batch
+        self.client_batches = {}
+        self.batch_timer = None
+        self.batch_sizes = Histogram(SIZE_BOUNDS)
+        self.batch_latency = Histogram(LATENCY_BOUNDS)
+        # Installed stream flows, only the differences get sent
+        self.programmer = StreamFlowProgrammer()
+        # Group and meter ids of the switches, shared with Switching
+        self.ids = IdAllocator()
+        # Backup paths around the tree links, preinstalled as fast
+        # failover groups when "failover" is enabled
+        self.detours = DetourPlanner(self.graph, self.ids)
+        self.detour_programmer = DetourProgrammer()
+        # Time from a client join to the switches confirming its flows
+        self.setup_latency = Histogram(LATENCY_BOUNDS)
+        self.setup_failures = 0
+        # Make-before-break migrations, from the topology change to the
+        # source sending into the new tree and to the old one removed
+        self.recovery_latency = Histogram(LATENCY_BOUNDS)
+        self.migration_latency = Histogram(LATENCY_BOUNDS)
+        # Tree recomputes after topology changes, from the change to all
+        # trees built and the time spent programming them
+        self.recompute_jobs = []
+        self.recompute_time = Histogram(LATENCY_BOUNDS)
+        self.apply_time = Histogram(LATENCY_BOUNDS)
+        # Trees built on the pool that had to be built again
+        self.recompute_stale = 0
     
     def __del__(self):
         for stream_id in self.streams.keys():
@@ -191,11 +375,46 @@ class Streaming(app_manager.RyuApp):
 
     def config(self, conf):
         self.conf = conf
-        self.manager = ExtManager(conf["rpc_addr"], conf["rpc_port"], conf["vlc"])
+        self.link_costs = LinkCosts(conf.get("link_cost", "hop"),
+                                    conf.get("link_cost_weights"),
+                                    conf.get("load_step", 0.05))
+        if "link_bw" in conf:
+            self.link_costs.defaults["bw"] = conf["link_bw"]
+        if "topology" in conf:
+            self.link_costs.load_topology(conf["topology"])
+        weight = self.link_costs.weight if self.link_costs.weighted else None
+        engine = conf.get("path_engine", "incremental")
+        if engine == "matrix" and np is None:
+            print "path engine matrix needs numpy and scipy, using incremental"
+            engine = "incremental"
+        if engine == "incremental" and weight is not None:
+            # Incremental repairs rely on hop counts
+            engine = "lazy"
+        if engine == "lazy":
+            self.path_engine = LazyPaths(self.graph,
+                                         conf.get("path_cache_size", 256),
+                                         weight)
+        elif engine == "matrix":
+            self.path_engine = MatrixPaths(self.graph, weight)
+        else:
+            self.path_engine = IncrementalPaths(self.graph)
+        self.paths = self.path_engine.paths
+        self.pathlens = self.path_engine.pathlens
+        self.algorithms.default = conf.get("algorithm", "sph")
+        self.rebalancer.config(conf)
+        self.admission.config(conf)
+        if "rpc_addr" in conf:
+            self.manager = ExtManager(conf["rpc_addr"], conf["rpc_port"],
+                                      conf["vlc"])
+        else:
+            self.manager = NullManager()
 
     def reg_DPSet(self, dpset):
         self.dpset = dpset
 
+    def reg_batcher(self, batcher):
+        self.batcher = batcher
+
     @set_ev_cls(EventHostStatRequest, MAIN_DISPATCHER)
     def _host_stat_request_handler(self, req):
         mac = req.mac
@@ -216,6 +435,15 @@ class Streaming(app_manager.RyuApp):
         rep = EventSwitchStatReply(req.src, sw_stat)
         self.reply_to_request(req, rep)
 
+    @set_ev_cls(EventStreamAdmissionRequest, MAIN_DISPATCHER)
+    def _admission_request_handler(self, req):
+        ev = req.ev
+        decision = self.admit(ev)
+        if decision["decision"] in ("admitted", "downrated"):
+            self.send_event_to_observers(ev)
+        rep = EventStreamAdmissionReply(req.src, decision)
+        self.reply_to_request(req, rep)
+
     @set_ev_cls(EventHostReg)
     def _host_reg_handler(self, ev):
         dpid = ev.host.dpid
@@ -229,33 +457,42 @@ class Streaming(app_manager.RyuApp):
     def _switch_enter_handler(self, ev):
         msg = ev.switch.to_dict()
         dpid = int(msg["dpid"], 16)
-        self.graph.add_node(dpid)
+        self.path_engine.add_node(dpid)
         self.port_to_host[dpid] = {}
         self.switch_table[dpid] = {}
-        self.update_paths()
 
     @set_ev_cls(EventSwitchLeave)
     def _switch_leave_handler(self, ev):
         msg = ev.switch.to_dict()
         dpid = int(msg["dpid"], 16)
-        if dpid in self.graph.nodes():
-            self.graph.remove_node(dpid)
+        self.path_engine.remove_node(dpid)
+        self.programmer.forget(dpid)
+        self.detour_programmer.forget(dpid)
+        broken = self.detours.passing(dpid)
+        # Only what is attached to the switch is looked at. Sources go
+        # first, their hosts are still in host_table.
+        for stream_id in self.dpid_to_sources.get(dpid, set()).copy():
+            self._source_leave_handler(EventStreamSourceLeave(stream_id))
         if dpid in self.port_to_host:
             for host in self.port_to_host[dpid].values():
                 del self.host_table[host.mac]
             del self.port_to_host[dpid]
         if dpid in self.switch_table:
             del self.switch_table[dpid]
-        self.update_paths()
-        for stream_id in self.streams:
-            if self.streams[stream_id]["src"]["dpid"] == dpid:
-                self._source_leave_handler(EventStreamSourceLeave(stream_id))
+        links = self.dpid_to_links.pop(dpid, set())
         inf_streams = set()
-        for (src, dst) in self.link_to_streams.keys():
-            if (src == dpid) or (dst == dpid):
-                inf_streams |= self.link_to_streams[(src, dst)]
-        for stream_id in inf_streams:
-            self.cal_flows_for_stream(stream_id, ev)
+        for link in links:
+            inf_streams |= self.link_to_streams[link]
+        self.recompute_streams(inf_streams, ev)
+        # No tree runs over the links of the switch anymore
+        for link in links:
+            del self.link_to_streams[link]
+            peer = link[0] if link[1] == dpid else link[1]
+            if peer in self.dpid_to_links:
+                self.dpid_to_links[peer].discard(link)
+        self.rebalancer.forget(links)
+        self.refresh_detours(broken)
+        self.ids.forget(dpid)
 
     @set_ev_cls(EventLinkAdd)
     def _link_add_handler(self, ev):
@@ -266,12 +503,15 @@ class Streaming(app_manager.RyuApp):
         dst_port_no = int(msg["dst"]["port_no"], 16)
         self.link_outport[(src_dpid, dst_dpid)] = src_port_no
         self.link_outport[(dst_dpid, src_dpid)] = dst_port_no
-        self.graph.add_edge(src_dpid, dst_dpid)
-        self.update_paths()
+        self.path_engine.add_edge(src_dpid, dst_dpid)
         if src_dpid < dst_dpid:
             self.link_to_streams[(src_dpid, dst_dpid)] = set()
-            for stream_id in self.failed_streams.copy():
-                self.cal_flows_for_stream(stream_id, ev)
+            for dpid in (src_dpid, dst_dpid):
+                self.dpid_to_links.setdefault(dpid, set()).add(
+                    (src_dpid, dst_dpid))
+            self.recompute_streams(self.failed_streams, ev)
+            self.refresh_detours(self.detours.missing())
+            self.admit_queued()
 
     @set_ev_cls(EventLinkDelete)
     def _link_del_handler(self, ev):
@@ -285,13 +525,12 @@ class Streaming(app_manager.RyuApp):
         #    del self.link_outport[(src_dpid, dst_dpid)]
         # if (dst_dpid, src_dpid) in self.link_outport:
         #     del self.link_outport[(dst_dpid, src_dpid)]
-        if (src_dpid, dst_dpid) in self.graph.edges() or \
-                (dst_dpid, src_dpid) in self.graph.edges():
-                    self.graph.remove_edge(src_dpid, dst_dpid)
-        self.update_paths()
-        inf_stream = self.link_to_streams.get((src_dpid, dst_dpid), set()).copy()
-        for stream_id in inf_stream:
-            self.cal_flows_for_stream(stream_id, ev)
+        self.path_engine.remove_edge(src_dpid, dst_dpid)
+        self.measured_loads.pop((src_dpid, dst_dpid), None)
+        self.rebalancer.forget([(src_dpid, dst_dpid)])
+        inf_stream = self.link_to_streams.get((src_dpid, dst_dpid), set())
+        self.recompute_streams(inf_stream, ev)
+        self.refresh_detours(self.detours.broken(src_dpid, dst_dpid))
 
     @set_ev_cls(EventStreamSourceEnter)
     def _source_enter_handler(self, ev):
@@ -300,17 +539,30 @@ class Streaming(app_manager.RyuApp):
         if stream_id in self.streams:
             self.logger.info("source of stream%d already exist", stream_id)
             return
-        self.streams[stream_id] = {"rate": ev.rate,
+        decision = self.admit(ev)
+        if decision["decision"] not in ("admitted", "downrated"):
+            return False
+        self.streams[stream_id] = {"id": stream_id,
+                                   "rate": decision["rate"],
                                    "eth_dst": ev.eth_dst,
                                    "ip_dst": ev.ip_dst,
                                    "fname": ev.fname,
+                                   "algorithm": self.get_stream_algorithm(stream_id),
                                    "clients": {},
-                                   "m_tree": {},
+                                   "m_tree": MulticastTree(),
                                    "bandwidth": {},
                                    "links": set()}
+        # Trees are tagged with their version for make-before-break
+        version = 1 if self.conf.get("make_before_break", False) else 0
+        self.streams[stream_id]["version"] = version
+        self.streams[stream_id]["live"] = version
         self.streams[stream_id]["src"] = {"mac": ev.src_mac,
                                           "dpid": ev.src_dpid,
                                           "in_port": ev.src_in_port}
+        if decision["decision"] == "downrated":
+            self.streams[stream_id]["bandwidth"][ev.src_dpid] = \
+                decision["rate"] / 1000
+        self.dpid_to_sources.setdefault(ev.src_dpid, set()).add(stream_id)
         self.cal_flows_for_stream(stream_id, ev)
         self.update_host_table(ev.src_mac, "add", "sourcing", stream_id)
         self.manager.add_stream(stream_id, ev.src_dpid, ev.fname)
@@ -323,21 +575,33 @@ class Streaming(app_manager.RyuApp):
                              stream_id)
             return False
         m_tree = self.streams[stream_id]["m_tree"]
-        # Clean up
+        self.client_batches.pop(stream_id, None)
+        self.failed_streams.discard(stream_id)
+        # Clean up, every version that is still installed goes
         for dpid in m_tree.keys():
-            self.mod_stream_flow(dpid, stream_id, None)
             self.update_switch_table(dpid, "del", stream_id)
+        self.remove_stream_versions(stream_id)
+        self.batcher.flush()
         for link in self.streams[stream_id]["links"]:
             if link in self.link_to_streams:
                 self.link_to_streams[link].discard(stream_id)
+        self.update_link_loads(self.streams[stream_id]["links"])
         for dpid, ports in self.streams[ev.stream_id]["clients"].items():
             if dpid not in self.port_to_host: continue
             for port in ports:
-                mac = self.port_to_host[dpid][port]
-                self.update_host_table(mac, "del", "receving", stream_id)
+                host = self.port_to_host[dpid].get(port)
+                if host is not None:
+                    self.update_host_table(host.mac, "del", "receving",
+                                           stream_id)
         self.update_host_table(self.streams[stream_id]["src"]["mac"], "del", "sourcing", stream_id)
+        src_dpid = self.streams[stream_id]["src"]["dpid"]
+        self.dpid_to_sources[src_dpid].discard(stream_id)
+        if len(self.dpid_to_sources[src_dpid]) == 0:
+            del self.dpid_to_sources[src_dpid]
         self.manager.del_stream(stream_id)
+        self.measured_rates.pop(stream_id, None)
         del self.streams[stream_id]
+        self.admit_queued()
 
     @set_ev_cls(EventStreamClientEnter)
     def _client_enter_handler(self, ev):
@@ -346,10 +610,19 @@ class Streaming(app_manager.RyuApp):
             self.logger.info("client joining a non-existing stream%d",
                              stream_id)
             return False
+        decision = self.admit(ev)
+        if decision["decision"] not in ("admitted", "downrated"):
+            return False
+        if decision["decision"] == "downrated":
+            self.downrate(stream_id, decision["rate"])
+        if self.conf.get("batch_window", 0) > 0:
+            self.queue_client_event(ev)
+            return True
         client_ports = self.streams[stream_id]["clients"].setdefault(ev.dpid, 
                                                                      set())
         client_ports.add(ev.out_port)
-        self.cal_flows_for_stream(stream_id, ev)
+        self.cal_flows_for_stream(stream_id, ev,
+                                  self.setup_timer([time.time()]))
         self.update_host_table(ev.mac, "add", "receving", stream_id)
         self.manager.add_client(stream_id, ev.dpid, self.streams[stream_id]["fname"])
 
@@ -360,6 +633,9 @@ class Streaming(app_manager.RyuApp):
             self.logger.info("client leaving a non-existing stream%d",
                              stream_id)
             return False
+        if self.conf.get("batch_window", 0) > 0:
+            self.queue_client_event(ev)
+            return True
         client_ports = self.streams[stream_id]["clients"][ev.dpid]
         client_ports.remove(ev.out_port)
         self.cal_flows_for_stream(stream_id, ev)
@@ -367,6 +643,78 @@ class Streaming(app_manager.RyuApp):
             del self.streams[stream_id]["clients"][ev.dpid]
         self.update_host_table(ev.mac, "del", "receving", stream_id)
         self.manager.del_client(stream_id, ev.dpid)
+        self.admit_queued()
+
+    @set_ev_cls(EventStreamBatchFlush)
+    def _batch_flush_handler(self, ev):
+        self.batch_timer = None
+        for stream_id in self.client_batches.keys():
+            self.flush_client_batch(stream_id)
+
+    def queue_client_event(self, ev):
+        batch = self.client_batches.setdefault(ev.stream_id, [])
+        batch.append((time.time(), ev))
+        if len(batch) >= self.conf.get("batch_size", 100):
+            self.flush_client_batch(ev.stream_id)
+        elif self.batch_timer is None:
+            self.batch_timer = hub.spawn_after(self.conf["batch_window"],
+                                               self._batch_timeout)
+
+    def _batch_timeout(self):
+        # Not running in the event loop, let the loop do the flush
+        self.send_event(self.name, EventStreamBatchFlush())
+
+    def flush_client_batch(self, stream_id):
+        batch = self.client_batches.pop(stream_id, [])
+        if len(batch) == 0 or stream_id not in self.streams:
+            return False
+        clients = self.streams[stream_id]["clients"]
+        before = set(clients.keys())
+        changed = set()
+        applied = []
+        for queued, ev in batch:
+            client_ports = clients.setdefault(ev.dpid, set())
+            if isinstance(ev, EventStreamClientEnter):
+                client_ports.add(ev.out_port)
+            elif ev.out_port in client_ports:
+                client_ports.remove(ev.out_port)
+            else:
+                self.logger.info("client %s is not receiving stream%d",
+                                 ev.mac, stream_id)
+                continue
+            changed.add(ev.dpid)
+            applied.append(ev)
+        for dpid in set(ev.dpid for queued, ev in batch):
+            if len(clients[dpid]) == 0:
+                del clients[dpid]
+        joined = set(dpid for dpid in changed
+                     if dpid in clients and dpid not in before)
+        left = set(dpid for dpid in changed
+                   if dpid not in clients and dpid in before)
+        if len(changed) != 0:
+            joins = [queued for queued, ev in batch
+                     if isinstance(ev, EventStreamClientEnter)]
+            self.cal_flows_for_stream(stream_id,
+                EventStreamClientBatch(stream_id, joined, left, changed),
+                self.setup_timer(joins))
+        now = time.time()
+        for queued, ev in batch:
+            self.batch_latency.add(now - queued)
+        self.batch_sizes.add(len(batch))
+        self.logger.debug("stream%d: batch of %d, %d dpids joined, %d left, "
+                          "latency %s", stream_id, len(batch), len(joined),
+                          len(left), self.batch_latency)
+        for ev in applied:
+            fname = self.streams[stream_id]["fname"]
+            if isinstance(ev, EventStreamClientEnter):
+                self.update_host_table(ev.mac, "add", "receving", stream_id)
+                self.manager.add_client(stream_id, ev.dpid, fname)
+            else:
+                self.update_host_table(ev.mac, "del", "receving", stream_id)
+                self.manager.del_client(stream_id, ev.dpid)
+        if len(left) != 0:
+            self.admit_queued()
+        return True
 
     @set_ev_cls(EventStreamBandwidthChange)
     def _bandwidth_change_handler(self, ev):
@@ -375,9 +723,23 @@ class Streaming(app_manager.RyuApp):
         bandwidth = ev.bandwidth
         curr_stat = self.streams[stream_id]["m_tree"].get(dpid)
         self.mod_stream_flow(dpid, stream_id, curr_stat, bandwidth)
+        self.batcher.flush()
         self.streams[stream_id]["bandwidth"][dpid] = bandwidth
         self.update_topology(stream_id)
 
+    @set_ev_cls(EventTrafficChanged)
+    def _traffic_changed_handler(self, ev):
+        self.measured_loads.update(ev.loads)
+        links = set(ev.loads)
+        for stream_id, rate in ev.rates.items():
+            if stream_id in self.streams:
+                self.measured_rates[stream_id] = rate
+                links |= self.streams[stream_id]["links"]
+        self.update_link_loads(links)
+        if self.conf.get("rebalance", False):
+            self.rebalance(links)
+        self.admit_queued()
+
     @set_ev_cls(Event_Streaming_PacketIn, MAIN_DISPATCHER)
     def _streaming_handler(self, ev):
         msg = ev.msg
@@ -413,155 +775,515 @@ class Streaming(app_manager.RyuApp):
                          stream_id)
         return False
 
-    def update_paths(self):
-        self.paths = nx.shortest_path(self.graph)
-        self.pathlens = {}
-        for src in self.paths:
-            self.pathlens[src] = {}
-            for dst in self.paths[src]:
-                self.pathlens[src][dst] = len(self.paths[src][dst])
+    def admit(self, ev):
+        # Admission decision of a source or client entering, taken once
+        # and kept on the event
+        decision = getattr(ev, "admission", None)
+        if decision is not None:
+            return decision
+        if isinstance(ev, EventStreamSourceEnter):
+            if ev.stream_id in self.streams:
+                decision = make_decision("rejected", ev.rate,
+                                         "stream%d already exists" %
+                                         ev.stream_id)
+            else:
+                decision = self.admission.check_source(ev)
+        elif ev.stream_id not in self.streams:
+            decision = make_decision("rejected", 0, "no stream%d" %
+                                     ev.stream_id)
+        else:
+            extra = self.admission.pending_loads(self.pending_joins(),
+                                                 ev.stream_id)
+            decision = self.admission.check_client(ev, extra)
+        ev.admission = decision
+        if decision["decision"] != "admitted":
+            self.logger.info("stream%d: %s %s, %s", ev.stream_id,
+                             ev.__class__.__name__, decision["decision"],
+                             decision.get("reason"))
+        return decision
+
+    def admit_queued(self):
+        # Clients queued for admission that fit now join
+        extra = self.admission.pending_loads(self.pending_joins())
+        for ev in self.admission.admit_queued(extra):
+            self.send_event_to_observers(ev)
 
-    def cal_flows_for_stream(self, stream_id, ev):
-        for link in self.streams[stream_id]["links"]:
-            if link in self.link_to_streams[link]:
-                self.link_to_streams[link].discard(stream_id)
-        self.streams[stream_id]["links"] = set()
-        new_tree, mod_dpids = self.algorithm.cal(self.streams[stream_id],
-                                                 self.paths, 
-                                                 self.pathlens, ev)
+    def pending_joins(self):
+        # Joins admitted and waiting in a batch, not in their trees yet
+        return [ev for batch in self.client_batches.values()
+                for queued, ev in batch
+                if isinstance(ev, EventStreamClientEnter)]
+
+    def downrate(self, stream_id, rate):
+        # Meters the stream down to rate (Kbps) at its source
+        stream = self.streams[stream_id]
+        src_dpid = stream["src"]["dpid"]
+        stream["rate"] = rate
+        if stream_id in self.measured_rates:
+            self.measured_rates[stream_id] = \
+                min(self.measured_rates[stream_id], rate)
+        stream["bandwidth"][src_dpid] = rate / 1000
+        if src_dpid in stream["m_tree"]:
+            self.mod_stream_flow(src_dpid, stream_id,
+                                 stream["m_tree"][src_dpid], rate / 1000)
+            self.batcher.flush()
+            self.update_topology(stream_id)
+        self.update_link_loads(stream["links"])
+
+    def get_stream_algorithm(self, stream_id):
+        # JSON object keys are strings
+        algorithms = self.conf.get("stream_algorithms", {})
+        return algorithms.get(str(stream_id), self.algorithms.default)
+
+    def stream_rate(self, stream_id):
+        # Kbps, as measured at the source once the collector has seen it
+        rate = self.measured_rates.get(stream_id)
+        if rate is None:
+            rate = self.streams[stream_id]["rate"]
+        return rate
+
+    def link_load(self, link):
+        # Sum of the rates (Kbps) of the streams using link(src<dst), or
+        # the measured load of the link when that is higher
+        load = 0
+        for stream_id in self.link_to_streams.get(link, ()):
+            load += self.stream_rate(stream_id)
+        return max(load, self.measured_loads.get(link, 0))
+
+    def link_capacity(self, link):
+        # Link bandwidth in Kbps, as configured for the link or link_bw,
+        # given in Mbps like TCLink bw
+        return self.link_costs.capacity(link)
+
+    def update_link_loads(self, links):
+        # Stream load of the links goes into their costs, paths are
+        # computed again once a cost moved
+        changed = False
+        for link in links:
+            if link in self.link_to_streams and \
+                    self.link_costs.set_load(link, self.link_load(link)):
+                changed = True
+        if changed:
+            self.path_engine.rebuild()
+
+    def rebalance(self, links):
+        # Rebuilds the trees of the streams picked by the rebalancer with
+        # the hot links penalised and moves the ones that got off them
+        now = time.time()
+        stream_ids = self.rebalancer.plan(links, now)
+        if len(stream_ids) == 0:
+            return
+        before = self.rebalancer.peak()
+        hot = set(self.rebalancer.hot)
+        ev = EventStreamRebalance(stream_ids)
+        results = []
+        stuck = 0
+        for stream_id in stream_ids:
+            stream = self.streams[stream_id]
+            engine = self.rebalancer.paths(stream)
+            new_tree, mod_dpids = self.algorithms.cal(
+                stream["algorithm"], stream, engine.paths, engine.pathlens,
+                ev)
+            if new_tree is None or len(tree_links(new_tree) & hot) >= \
+                    len(stream["links"] & hot):
+                stuck += 1
+                continue
+            results.append((stream_id, new_tree, mod_dpids))
+        self.rebalancer.hold_streams(stream_ids, now)
+        old_links = dict((stream_id, set(self.streams[stream_id]["links"]))
+                         for stream_id, new_tree, mod_dpids in results)
+        if len(results) != 0:
+            self.apply_trees(results, ev, now)
+        # Measured loads lag until the next poll, the moved streams are
+        # taken off and put on them in the meantime
+        touched = set()
+        for stream_id, links in old_links.items():
+            rate = self.stream_rate(stream_id)
+            new_links = self.streams[stream_id]["links"]
+            for link in links - new_links:
+                if link in self.measured_loads:
+                    self.measured_loads[link] = \
+                        max(self.measured_loads[link] - rate, 0)
+                touched.add(link)
+            for link in new_links - links:
+                if link in self.measured_loads:
+                    self.measured_loads[link] += rate
+                touched.add(link)
+        self.update_link_loads(touched)
+        self.rebalancer.update(touched)
+        after = self.rebalancer.peak()
+        self.rebalancer.record(now, len(results), stuck, before, after)
+        self.logger.info("rebalanced %d of %d streams, peak link load "
+                         "%.0f%% -> %.0f%%", len(results), len(stream_ids),
+                         before * 100, after * 100)
+
+    def setup_timer(self, started):
+        # Completion callback for the flush of a tree update, records
+        # the time from each join to the switches confirming it
+        def done(ok):
+            now = time.time()
+            for queued in started:
+                self.setup_latency.add(now - queued)
+            if not ok:
+                self.setup_failures += 1
+        return done
+
+    def cal_flows_for_stream(self, stream_id, ev, callback=None):
+        started = time.time()
+        stream = self.streams[stream_id]
+        new_tree, mod_dpids = self.algorithms.cal(
+            stream["algorithm"], stream, self.paths, self.pathlens, ev)
+        callback = self.apply_tree(stream_id, ev, new_tree, mod_dpids,
+                                   started, callback)
+        # The whole update goes out at once per switch
+        self.batcher.flush(callback)
+
+    def recompute_streams(self, stream_ids, ev):
+        # Rebuilds the trees of the streams hit by a topology change.
+        # With "workers" set, enough of them ("parallel_min_streams") are
+        # built in forked processes and applied once all are done,
+        # packet-ins are served in the meantime.
+        stream_ids = sorted(stream_id for stream_id in stream_ids
+                            if stream_id in self.streams)
+        if len(stream_ids) == 0:
+            return
+        workers = min(self.conf.get("workers", 0), len(stream_ids))
+        if workers > 1 and \
+                len(stream_ids) >= self.conf.get("parallel_min_streams", 32):
+            self.start_recompute(stream_ids, ev, workers)
+            return
+        started = time.time()
+        results = []
+        for stream_id in stream_ids:
+            stream = self.streams[stream_id]
+            new_tree, mod_dpids = self.algorithms.cal(
+                stream["algorithm"], stream, self.paths, self.pathlens, ev)
+            results.append((stream_id, new_tree, mod_dpids))
+        self.recompute_time.add(time.time() - started)
+        self.apply_trees(results, ev, started)
+
+    def start_recompute(self, stream_ids, ev, workers):
+        # The workers are forked for every recompute, they build the
+        # trees on their copy of the app as it is now
+        global _recompute_snapshot
+        job = RecomputeJob(stream_ids, ev, self.path_engine.version,
+                           dict((stream_id, self.streams[stream_id]["m_tree"])
+                                for stream_id in stream_ids))
+        _recompute_snapshot = (self, ev)
+        try:
+            job.result = ForkedMap(_recompute_chunk,
+                                   [stream_ids[i::workers]
+                                    for i in xrange(workers)])
+        finally:
+            _recompute_snapshot = None
+        self.recompute_jobs.append(job)
+        hub.spawn(self._recompute_wait, job)
+
+    def _recompute_wait(self, job):
+        # Not running in the event loop, let the loop apply the trees
+        while not job.result.ready():
+            hub.sleep(RECOMPUTE_POLL)
+        self.send_event(self.name, EventStreamRecomputeDone(job))
+
+    @set_ev_cls(EventStreamRecomputeDone)
+    def _recompute_done_handler(self, ev):
+        job = ev.job
+        if job not in self.recompute_jobs:
+            return
+        self.recompute_jobs.remove(job)
+        self.recompute_time.add(time.time() - job.started)
+        built = {}
+        try:
+            for chunk in job.result.get():
+                for stream_id, pairs, mod_dpids, elapsed in chunk:
+                    built[stream_id] = (pairs, mod_dpids, elapsed)
+        except Exception as e:
+            self.logger.info("tree recompute failed: %s", e)
+        results = []
+        for stream_id in job.stream_ids:
+            stream = self.streams.get(stream_id)
+            if stream is None:
+                continue
+            if stream_id not in built or \
+                    stream["m_tree"] is not job.trees[stream_id] or \
+                    self.path_engine.version != job.version:
+                # The stream or the topology changed since the snapshot
+                self.recompute_stale += 1
+                new_tree, mod_dpids = self.algorithms.cal(
+                    stream["algorithm"], stream, self.paths, self.pathlens,
+                    job.ev)
+            else:
+                pairs, mod_dpids, elapsed = built[stream_id]
+                new_tree = None
+                if pairs is not None:
+                    new_tree = MulticastTree.from_list(pairs)
+                self.algorithms.record(stream["algorithm"], stream,
+                                       new_tree, elapsed)
+            results.append((stream_id, new_tree, mod_dpids))
+        self.apply_trees(results, job.ev, job.started)
+
+    def apply_trees(self, results, ev, started):
+        # Trees of several streams go out in one flush, in stream order
+        begin = time.time()
+        callbacks = []
+        for stream_id, new_tree, mod_dpids in results:
+            callback = self.apply_tree(stream_id, ev, new_tree, mod_dpids,
+                                       started)
+            if callback is not None:
+                callbacks.append(callback)
+        self.apply_time.add(time.time() - begin)
+
+        def done(ok):
+            for callback in callbacks:
+                callback(ok)
+        self.batcher.flush(done)
+
+    def apply_tree(self, stream_id, ev, new_tree, mod_dpids, started,
+                   callback=None):
+        # Programs the switches for the new tree of a stream, returns the
+        # callback to flush with
+        stream = self.streams[stream_id]
         if new_tree is None:
-            new_tree = {}
-            src_dpid = self.streams[stream_id]["src"]["dpid"]
-            new_tree[src_dpid] = {"parent": -1,
-                                  "children": set()}
-            mod_dpids = self.streams[stream_id]["m_tree"].keys()
+            new_tree = MulticastTree()
+            src_dpid = stream["src"]["dpid"]
+            new_tree.add_node(src_dpid, -1)
+            mod_dpids = stream["m_tree"].keys()
             self.failed_streams.add(stream_id)
         else:
             if stream_id in self.failed_streams:
                 self.failed_streams.remove(stream_id)
 
+        # On topology changes the new tree is built next to the old one
+        # under a new version, see flip_source
+        migrate = stream["version"] != 0 and \
+            isinstance(ev, (EventLinkAdd, EventLinkDelete, EventSwitchLeave,
+                            EventStreamRebalance))
+        if migrate:
+            stream["version"] = next_version(stream["version"])
+            mod_dpids = set(stream["m_tree"].keys()) | set(new_tree.keys())
+        detour_dpids = set()
+        if self.conf.get("failover", False):
+            key = version_key(stream_id, stream["version"])
+            detour_dpids = self.detours.plan(key, new_tree, mod_dpids)
         for dpid in mod_dpids:
             new_stat = new_tree.get(dpid)
-            curr_band = self.streams[stream_id]["bandwidth"].get(dpid)
+            curr_band = stream["bandwidth"].get(dpid)
             self.mod_stream_flow(dpid, stream_id, new_stat, curr_band)
             if new_stat is None:
                 self.update_switch_table(dpid, "del", stream_id)
-        for dpid, stat in new_tree.items():
-            if stat["parent"] != -1:
+        for dpid in detour_dpids - set(mod_dpids):
+            self.mod_stream_flow(dpid, stream_id, new_tree.get(dpid),
+                                 stream["bandwidth"].get(dpid))
+        # Only modified nodes can have a new parent link. Old links are
+        # all dropped first as a link may be kept in the other direction.
+        m_tree = stream["m_tree"]
+        links = stream["links"]
+        touched = set()
+        for dpid in mod_dpids:
+            stat = m_tree.get(dpid)
+            if stat is not None and stat["parent"] != -1:
                 src, dst = dpid, stat["parent"]
                 if src > dst:
                     src, dst = dst, src
-                self.streams[stream_id]["links"].add((src, dst))
+                links.discard((src, dst))
+                touched.add((src, dst))
+                if (src, dst) in self.link_to_streams:
+                    self.link_to_streams[(src, dst)].discard(stream_id)
+        for dpid in mod_dpids:
+            stat = new_tree.get(dpid)
+            if stat is not None and stat["parent"] != -1:
+                src, dst = dpid, stat["parent"]
+                if src > dst:
+                    src, dst = dst, src
+                links.add((src, dst))
+                touched.add((src, dst))
                 self.link_to_streams[(src, dst)].add(stream_id)
-        self.streams[stream_id]["m_tree"] = new_tree
+        stream["m_tree"] = new_tree
+        self.update_link_loads(touched)
         self.update_topology(stream_id)
+        if migrate:
+            callback = self.flip_source(stream_id, stream["version"],
+                                        started, callback)
+        return callback
+
+    def flip_source(self, stream_id, version, started, callback):
+        # Completion callback for the install of a new tree version. Every
+        # switch holds it now, the source flow is overwritten to push the
+        # new tag, then the older versions are removed.
+        def done(ok):
+            stream = self.streams.get(stream_id)
+            if stream is None or stream["version"] != version:
+                # The stream ended or a later migration took over
+                return
+            if not ok:
+                self.logger.info("stream%d: tree version %d is incomplete",
+                                 stream_id, version)
+            src_dpid = stream["src"]["dpid"]
+            old_key = version_key(stream_id, stream["live"])
+            stream["live"] = version
+            self.mod_stream_flow(src_dpid, stream_id,
+                                 stream["m_tree"].get(src_dpid),
+                                 stream["bandwidth"].get(src_dpid))
+            self.programmer.release_flow(src_dpid, old_key)
+            self.batcher.flush(self.collect_versions(stream_id, version,
+                                                     started, callback))
+        return done
+
+    def collect_versions(self, stream_id, version, started, callback):
+        # Completion callback for the flip of the source
+        def done(ok):
+            self.recovery_latency.add(time.time() - started)
+            stream = self.streams.get(stream_id)
+            if stream is None or stream["live"] != version:
+                return
+            # A later migration may already be installing its version
+            self.remove_stream_versions(stream_id,
+                                        (version, stream["version"]))
+            self.batcher.flush(self.migration_done(stream_id, version,
+                                                   started, callback))
+        return done
+
+    def migration_done(self, stream_id, version, started, callback):
+        def done(ok):
+            self.migration_latency.add(time.time() - started)
+            self.logger.info("stream%d: moved to tree version %d in %.3fs, "
+                             "recovery %s", stream_id, version,
+                             time.time() - started, self.recovery_latency)
+            if callback is not None:
+                callback(ok)
+        return done
+
+    def remove_stream_versions(self, stream_id, keep=()):
+        # Removes the flows, groups and meters of every version of the
+        # stream but the ones to keep from all switches, detours included
+        eth_dst = self.streams[stream_id]["eth_dst"]
+        keep = [version_key(stream_id, version) for version in keep]
+        for key in self.detours.detours.keys():
+            if key_stream_id(key) == stream_id and key not in keep:
+                self.detours.drop(key)
+        dpids = set(self.programmer.installed.keys()) | \
+            set(self.detour_programmer.installed.keys())
+        for dpid in dpids:
+            datapath = self.dpset.get(dpid)
+            if datapath is None:
+                continue
+            keys = set(self.programmer.keys(dpid)) | \
+                set(self.detour_programmer.keys(dpid))
+            for key in keys:
+                if key_stream_id(key) != stream_id or key in keep:
+                    continue
+                msgs = self.programmer.program(datapath, key, eth_dst, None)
+                # The stream group goes before the groups it refers to
+                msgs += self.detour_programmer.program(datapath, key,
+                                                       eth_dst, None)[2]
+                for msg in msgs:
+                    self.batcher.send(datapath, msg)
+
+    def refresh_detours(self, children):
+        # Plans the detours of key -> children again after a topology
+        # change, only the current version of a stream is kept up to date
+        if not self.conf.get("failover", False):
+            return
+        for key, nodes in children.items():
+            stream_id = key_stream_id(key)
+            stream = self.streams.get(stream_id)
+            if stream is None or \
+                    key != version_key(stream_id, stream["version"]):
+                continue
+            m_tree = stream["m_tree"]
+            for dpid in self.detours.plan(key, m_tree, nodes):
+                self.mod_stream_flow(dpid, stream_id, m_tree.get(dpid),
+                                     stream["bandwidth"].get(dpid))
+        self.batcher.flush()
 
     def mod_stream_flow(self, dpid, stream_id, new_stat, new_band=None):
         datapath = self.dpset.get(dpid)
-        if datapath is None: return
-        ofproto = datapath.ofproto
-        parser = datapath.ofproto_parser
         if datapath is None:
             return False
-
-        prev_stat = self.streams[stream_id]["m_tree"].get(dpid)
-        prev_band = self.streams[stream_id]["bandwidth"].get(dpid)
-        if prev_stat is not None:
-            if self.streams[stream_id]["src"]["dpid"] == dpid:
-                prev_in_port = self.streams[stream_id]["src"]["in_port"]
-            else:
-                prev_in_port = self.link_outport.get((dpid, prev_stat["parent"]), -1)
-            prev_out_ports = map(lambda c: self.link_outport[(dpid, c)],\
-                    prev_stat["children"])
+        new_state = None
         if new_stat is not None:
-            if self.streams[stream_id]["src"]["dpid"] == dpid:
-                curr_in_port = self.streams[stream_id]["src"]["in_port"]
+            new_state = self.stream_flow_state(dpid, stream_id,
+                                               new_stat, new_band)
+        stream = self.streams[stream_id]
+        key = version_key(stream_id, stream["version"])
+        msgs = self.programmer.program(datapath, key, stream["eth_dst"],
+                                       new_state)
+        if self.conf.get("failover", False):
+            # Fast failover groups have to exist before the stream group
+            # refers to them and stay until it does not any more, the
+            # arrive flows refer to the stream group
+            before, arrive, after = self.detour_programmer.program(
+                datapath, key, stream["eth_dst"],
+                self.detour_state(dpid, stream_id))
+            msgs = before + msgs + arrive + after
+        for msg in msgs:
+            self.batcher.send(datapath, msg)
+        return True
+
+    def detour_state(self, dpid, stream_id):
+        version = self.streams[stream_id]["version"]
+        key = version_key(stream_id, version)
+        state = {"ff": {}, "hops": {}, "arrive": {}}
+        for entry_key, child in self.detours.nodes.get(dpid, ()):
+            if entry_key != key:
+                continue
+            detour = self.detours.get(key, child)
+            path = detour["path"]
+            vid = detour["vid"]
+            i = path.index(dpid)
+            if i == 0:
+                state["ff"][child] = (detour["group"],
+                                      self.link_outport[(dpid, child)],
+                                      self.link_outport[(dpid, path[1])],
+                                      vid, version != 0)
+            elif i == len(path) - 1:
+                in_port = self.link_outport[(dpid, path[i-1])]
+                state["arrive"][(vid, in_port)] = \
+                    version if version != 0 else None
             else:
-                curr_in_port = self.link_outport.get((dpid, new_stat["parent"]), -1)
-            curr_out_ports = map(lambda c: self.link_outport[(dpid, c)],\
-                    new_stat["children"])
-            if dpid in self.streams[stream_id]["clients"]:
-                for port in self.streams[stream_id]["clients"][dpid]:
-                    curr_out_ports.append(port)
-
-        if prev_stat is not None and len(prev_out_ports) != 0:
-            # Del existing group
-            gmod = parser.OFPGroupMod(datapath=datapath,
-                                      command=ofproto.OFPGC_DELETE,
-                                      type_=ofproto.OFPGT_ALL,
-                                      group_id=stream_id)
-            datapath.send_msg(gmod)
-
-        if new_stat is not None and len(curr_out_ports) != 0:
-            # Add new group
-            buckets = []
-            for port in curr_out_ports:
-                actions = [parser.OFPActionOutput(port)]
-                if port in self.port_to_host[dpid]:
-                    host = self.port_to_host[dpid][port]
-                    eth_dst = host.mac
-                    ipv4_dst = host.ip
-                    actions.append(parser.OFPActionSetField(eth_dst=eth_dst))
-                    actions.append(parser.OFPActionSetField(ipv4_dst=ipv4_dst))
-                buckets.append(parser.OFPBucket(actions=actions))
-            gmod = parser.OFPGroupMod(datapath=datapath,
-                                      command=ofproto.OFPGC_ADD,
-                                      type_=ofproto.OFPGT_ALL,
-                                      group_id=stream_id,
-                                      buckets=buckets)
-            datapath.send_msg(gmod)
-
-        if prev_band is not None:
-            mmod = parser.OFPMeterMod(datapath=datapath,
-                                      command=ofproto.OFPMC_DELETE,
-                                      meter_id=stream_id)
-            datapath.send_msg(mmod)
-
-        if new_band is not None:
-            bands = [parser.OFPMeterBandDrop(rate=new_band*1000)]
-            mmod = parser.OFPMeterMod(datapath=datapath,
-                                      command=ofproto.OFPMC_ADD,
-                                      flags=ofproto.OFPMF_KBPS,
-                                      meter_id=stream_id,
-                                      bands=bands)
-            datapath.send_msg(mmod)
-
-        if prev_stat is not None:
-            # Del first
-            out_port = ofproto.OFPP_ANY
-            out_group = ofproto.OFPG_ANY
-            if len(prev_out_ports) != 0:
-                out_group = stream_id
-            eth_dst = self.streams[stream_id]["eth_dst"]
-            match = parser.OFPMatch(in_port=prev_in_port, eth_dst=eth_dst)
-            mod = parser.OFPFlowMod(datapath=datapath,
-                                    command=ofproto.OFPFC_DELETE,
-                                    out_port=out_port,
-                                    out_group=out_group,
-                                    match=match,
-                                    instructions=[])
-            datapath.send_msg(mod)
+                in_port = self.link_outport[(dpid, path[i-1])]
+                state["hops"][(vid, in_port)] = \
+                    self.link_outport[(dpid, path[i+1])]
+        return state
 
-        if new_stat is not None:
-            # Add new flow
-            priority = 5
-            eth_dst = self.streams[stream_id]["eth_dst"]
-            match = parser.OFPMatch(in_port=curr_in_port, eth_dst=eth_dst)
-            actions = []
-            if len(curr_out_ports) != 0:
-                actions.append(parser.OFPActionGroup(stream_id,
-                                                     ofproto.OFPGT_ALL))
-            inst = []
-            if new_band is not None:
-                inst.append(parser.OFPInstructionMeter(meter_id=stream_id))
-            inst.append(parser.OFPInstructionActions(ofproto.OFPIT_APPLY_ACTIONS,
-                                                     actions))
-            mod = parser.OFPFlowMod(datapath=datapath,
-                                    priority=priority,
-                                    match=match,
-                                    instructions=inst)
-            datapath.send_msg(mod)
-        return True
+    def stream_flow_state(self, dpid, stream_id, stat, band):
+        stream = self.streams[stream_id]
+        version = stream["version"]
+        tag = None
+        push = None
+        if stream["src"]["dpid"] == dpid:
+            in_port = stream["src"]["in_port"]
+            if version != 0:
+                push = version
+            # The source only moves over to a version once it is
+            # installed everywhere, until then it holds the group only
+            if version != stream["live"]:
+                in_port = None
+        else:
+            in_port = self.link_outport.get((dpid, stat["parent"]), -1)
+            if version != 0:
+                tag = version
+        key = version_key(stream_id, version)
+        buckets = []
+        for child in stat["children"]:
+            group = None
+            detour = self.detours.get(key, child)
+            if self.conf.get("failover", False) and detour is not None:
+                group = detour["group"]
+            buckets.append((self.link_outport[(dpid, child)], None, None,
+                            False, group))
+        for port in stream["clients"].get(dpid, ()):
+            host = self.port_to_host[dpid].get(port)
+            if host is None:
+                buckets.append((port, None, None, version != 0, None))
+            else:
+                buckets.append((port, host.mac, host.ip, version != 0,
+                                None))
+        return {"in_port": in_port,
+                "tag": tag,
+                "push": push,
+                "buckets": tuple(sorted(buckets)),
+                "band": band}
 
     def update_topology(self, stream_id):
         src_dpid = self.streams[stream_id]["src"]["dpid"]
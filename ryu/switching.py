@@ -6,7 +6,14 @@ from ryu.controller.handler import set_ev_cls
 from ryu.ofproto import ofproto_v1_3
 from ryu.topology.event import *
 from events import *
-from ryu.lib.packet import ethernet
+from addrs import *
+from prefixes import *
+from ids import *
+from links import MIN_RESIDUAL
+from multipath import *
+
+# Proactive routes sit below the flows created on packet-ins
+PROACTIVE_PRIORITY = 3
 
 
 class Switching(app_manager.RyuApp):
@@ -18,28 +25,92 @@ class Switching(app_manager.RyuApp):
         self.multipath = False
         # mac -> host
         self.hosts = {}
+        # dpid -> macs of the hosts at the switch
+        self.dpid_to_hosts = {}
         # (src, dst) -> out_port
         self.link_outport = {}
-        # flow_id - > [{"dpid", "match", "action"}]
+        # flow_id(eth_dst) - > [{"dpid", "match", "action"}]
         self.flows = {}
         # link(src<dst) -> flows
         self.link_to_flows = {}
         # flow -> links(src<dst)
         self.flow_to_links = {}
+        # dpid -> links(src<dst) of link_to_flows at the switch
+        self.dpid_to_links = {}
         self.graph = nx.Graph()
+        # LinkCosts shared with Streaming, hop count if None
+        self.link_costs = None
+        # Group ids of the switches, shared with Streaming
+        self.ids = IdAllocator()
+        self.planner = MultipathPlanner(self.graph)
+        # flow_id -> (dst_dpid, next hops) of the multipath flows
+        self.next_hops = {}
+        # link(src<dst) -> Kbps measured by the stats collector
+        self.measured_loads = {}
+        # Routes to every discovered host by IPv4 destination, installed
+        # ahead of the traffic when "proactive" is enabled
+        self.proactive = False
+        # dpid -> PrefixTable
+        self.tables = {}
+        # dpid -> {(net, plen) -> out_port} installed on the switch
+        self.installed = {}
+        # dpid -> version of the table installed
+        self.synced = {}
+
+    def config(self, conf):
+        self.conf = conf
+        self.proactive = conf.get("proactive", False)
+        self.planner.config(conf)
 
     def reg_DPSet(self, dpset):
         self.dpset = dpset
 
+    def reg_batcher(self, batcher):
+        self.batcher = batcher
+
     def set_wrapper(self, wrapper):
         self.wrapper = wrapper
 
+    def reg_link_costs(self, link_costs):
+        self.link_costs = link_costs
+
+    def reg_ids(self, ids):
+        self.ids = ids
+
+    def link_weight(self):
+        if self.link_costs is None or not self.link_costs.weighted:
+            return None
+        return self.link_costs.weight
+
     def enable_multipath(self):
         self.multipath = True
 
+    def residual(self, u, v):
+        # Kbps left on link u-v by the stream reservations and the load
+        # measured on it
+        link = (u, v) if u < v else (v, u)
+        load = max(self.link_costs.loads.get(link, 0),
+                   self.measured_loads.get(link, 0))
+        return max(self.link_costs.capacity(link) - load, MIN_RESIDUAL)
+
+    def group_weights(self, flow_id):
+        dst_dpid, nexts = self.next_hops[flow_id]
+        residual = self.residual if self.link_costs is not None else None
+        return self.planner.weights(nexts, dst_dpid, residual)
+
     @set_ev_cls(EventHostReg, MAIN_DISPATCHER)
     def _host_reg_handler(self, ev):
-        self.hosts[ev.host.mac] = ev.host
+        host = ev.host
+        old = self.hosts.get(host.mac)
+        if old is not None:
+            self.dpid_to_hosts[old.dpid].discard(host.mac)
+        self.hosts[host.mac] = host
+        self.dpid_to_hosts.setdefault(host.dpid, set()).add(host.mac)
+        if self.proactive:
+            if old is not None and old.ip != host.ip:
+                self.route_all()
+            else:
+                self.route_host(host)
 
     @set_ev_cls(EventHostRequest, MAIN_DISPATCHER)
     def _host_request_handler(self, req):
@@ -49,9 +120,8 @@ class Switching(app_manager.RyuApp):
             for host in self.hosts.values():
                 hosts.append(host)
         elif self.dpset.get(dpid):
-            for host in self.hosts.values():
-                if host.dpid == dpid:
-                    hosts.append(host)
+            for mac in self.dpid_to_hosts.get(dpid, ()):
+                hosts.append(self.hosts[mac])
 
         rep = EventHostReply(req.src, hosts)
         self.reply_to_request(req, rep)
@@ -61,19 +131,30 @@ class Switching(app_manager.RyuApp):
         msg = ev.switch.to_dict()
         dpid = int(msg["dpid"], 16)
         self.graph.add_node(dpid)
+        if self.proactive:
+            self.route_all()
 
     @set_ev_cls(EventSwitchLeave)
     def _switch_leave_handler(self, ev):
         msg = ev.switch.to_dict()
         dpid = int(msg["dpid"], 16)
-        if dpid in self.graph.nodes():
+        if dpid in self.graph:
             self.graph.remove_node(dpid)
-        for mac in self.hosts.keys():
-            if dpid == self.hosts[mac].dpid:
-                del self.hosts[mac]
-        for (src, dst) in self.link_to_flows.keys():
-            if (src == dpid) or (dst == dpid):
-                self.del_related_flows(src, dst)
+        for mac in self.dpid_to_hosts.pop(dpid, ()):
+            del self.hosts[mac]
+        # No flow is left on the links of the switch afterwards
+        for (src, dst) in self.dpid_to_links.pop(dpid, ()):
+            self.del_related_flows(src, dst)
+            del self.link_to_flows[(src, dst)]
+            self.measured_loads.pop((src, dst), None)
+            peer = src if dst == dpid else dst
+            if peer in self.dpid_to_links:
+                self.dpid_to_links[peer].discard((src, dst))
+        self.tables.pop(dpid, None)
+        self.installed.pop(dpid, None)
+        self.synced.pop(dpid, None)
+        if self.proactive:
+            self.route_all()
 
     @set_ev_cls(EventLinkAdd)
     def _link_add_handler(self, ev):
@@ -87,6 +168,11 @@ class Switching(app_manager.RyuApp):
         self.graph.add_edge(src_dpid, dst_dpid)
         if src_dpid < dst_dpid:
             self.link_to_flows[(src_dpid, dst_dpid)] = set()
+            for dpid in (src_dpid, dst_dpid):
+                self.dpid_to_links.setdefault(dpid, set()).add(
+                    (src_dpid, dst_dpid))
+            if self.proactive:
+                self.route_all()
 
     @set_ev_cls(EventLinkDelete)
     def _link_del_handler(self, ev):
@@ -99,11 +185,115 @@ class Switching(app_manager.RyuApp):
             del self.link_outport[(src_dpid, dst_dpid)]
         if (dst_dpid, src_dpid) in self.link_outport:
             del self.link_outport[(dst_dpid, src_dpid)]
-        if (src_dpid, dst_dpid) in self.graph.edges() or \
-                (dst_dpid, src_dpid) in self.graph.edges():
-                    self.graph.remove_edge(src_dpid, dst_dpid)
+        if self.graph.has_edge(src_dpid, dst_dpid):
+            self.graph.remove_edge(src_dpid, dst_dpid)
         if (src_dpid, dst_dpid) in self.link_to_flows:
             self.del_related_flows(src_dpid, dst_dpid)
+            self.measured_loads.pop((src_dpid, dst_dpid), None)
+            if self.proactive:
+                self.route_all()
+
+    def host_ip(self, host):
+        if not host.ip or host.ip == "0.0.0.0":
+            return None
+        return ipv4_text_to_int(host.ip)
+
+    def route_port(self, host, path):
+        # Out port towards host at the first switch of path
+        if len(path) == 1:
+            return host.port_no
+        return self.link_outport[(path[0], path[1])]
+
+    def route_host(self, host):
+        # Route to a new host on every switch, along the shortest paths
+        # to its switch
+        ip = self.host_ip(host)
+        if ip is None:
+            return
+        paths = {}
+        if host.dpid in self.graph:
+            paths = nx.shortest_path(self.graph, target=host.dpid,
+                                     weight=self.link_weight())
+        for dpid in self.graph.nodes():
+            table = self.tables.setdefault(dpid, PrefixTable())
+            if dpid in paths:
+                table.add(ip, self.route_port(host, paths[dpid]))
+            else:
+                table.remove(ip)
+        self.sync_routes()
+
+    def route_all(self):
+        # Routes to every host from scratch, after topology changes
+        for table in self.tables.values():
+            table.clear()
+        for dst_dpid, macs in self.dpid_to_hosts.items():
+            if dst_dpid not in self.graph or len(macs) == 0:
+                continue
+            paths = nx.shortest_path(self.graph, target=dst_dpid,
+                                     weight=self.link_weight())
+            for mac in macs:
+                host = self.hosts[mac]
+                ip = self.host_ip(host)
+                if ip is None:
+                    continue
+                for dpid, path in paths.items():
+                    table = self.tables.setdefault(dpid, PrefixTable())
+                    table.add(ip, self.route_port(host, path))
+        self.sync_routes()
+
+    def sync_routes(self):
+        # Sends the differences of the tables to the switches, the new
+        # prefixes go in before the ones they replace are deleted
+        for dpid, table in self.tables.items():
+            if self.synced.get(dpid) == table.version:
+                continue
+            datapath = self.dpset.get(dpid)
+            if datapath is None:
+                continue
+            installed = self.installed.setdefault(dpid, {})
+            for prefix, port in table.prefixes.items():
+                if installed.get(prefix) != port:
+                    self.add_route_flow(datapath, prefix, port)
+            for prefix in installed:
+                if prefix not in table.prefixes:
+                    self.del_route_flow(datapath, prefix)
+            self.installed[dpid] = dict(table.prefixes)
+            self.synced[dpid] = table.version
+        self.batcher.flush()
+
+    def route_match(self, parser, prefix):
+        net, plen = prefix
+        if plen == 32:
+            return parser.OFPMatch(eth_type=0x0800,
+                                   ipv4_dst=ipv4_int_to_text(net))
+        return parser.OFPMatch(eth_type=0x0800,
+                               ipv4_dst=(ipv4_int_to_text(net),
+                                         ipv4_int_to_text(prefix_mask(plen))))
+
+    def add_route_flow(self, datapath, prefix, out_port):
+        ofproto = datapath.ofproto
+        parser = datapath.ofproto_parser
+
+        match = self.route_match(parser, prefix)
+        actions = [parser.OFPActionOutput(out_port)]
+        inst = [parser.OFPInstructionActions(ofproto.OFPIT_APPLY_ACTIONS, actions)]
+        mod = parser.OFPFlowMod(datapath=datapath,
+                                priority=PROACTIVE_PRIORITY,
+                                match=match, instructions=inst)
+        self.batcher.send(datapath, mod)
+
+    def del_route_flow(self, datapath, prefix):
+        ofproto = datapath.ofproto
+        parser = datapath.ofproto_parser
+
+        mod = parser.OFPFlowMod(datapath=datapath,
+                                command=ofproto.OFPFC_DELETE_STRICT,
+                                priority=PROACTIVE_PRIORITY,
+                                out_port=ofproto.OFPP_ANY,
+                                out_group=ofproto.OFPG_ANY,
+                                match=self.route_match(parser, prefix),
+                                instructions=[])
+        self.batcher.send(datapath, mod)
 
     def del_related_flows(self, src, dst):
         inf_flows = self.link_to_flows[(src, dst)].copy()
@@ -115,6 +305,8 @@ class Switching(app_manager.RyuApp):
             return
         for entry in self.flows[flow_id]:
             dpid = entry["dpid"]
+            if entry["out_group"] != ofproto_v1_3.OFPG_ANY:
+                self.ids.free(dpid, "group", "switching", flow_id)
             datapath = self.dpset.get(dpid)
             if datapath is None:
                 continue
@@ -123,21 +315,55 @@ class Switching(app_manager.RyuApp):
             match = entry["match"]
             self.del_switch_flow(dpid, out_port, out_group, match)
         del self.flows[flow_id]
+        self.next_hops.pop(flow_id, None)
         for link in self.flow_to_links[flow_id]:
             self.link_to_flows[link].discard(flow_id)
         del self.flow_to_links[flow_id]
+        self.batcher.flush()
+
+    @set_ev_cls(EventTrafficChanged)
+    def _traffic_changed_handler(self, ev):
+        if len(ev.loads) == 0:
+            return
+        self.measured_loads.update(ev.loads)
+        self.reweight(ev.loads)
+
+    def reweight(self, links):
+        # Groups of the multipath flows over links get the weights of the
+        # loads now, once a weight moved by the reweight step
+        if self.planner.weighting != "residual":
+            return
+        flow_ids = set()
+        for link in links:
+            flow_ids |= self.link_to_flows.get(link, set())
+        for flow_id in flow_ids:
+            if flow_id not in self.next_hops:
+                continue
+            weights = self.group_weights(flow_id)
+            for entry in self.flows[flow_id]:
+                if "next_hops" not in entry:
+                    continue
+                new = weights[entry["dpid"]]
+                if not self.planner.moved(entry["weights"], new):
+                    continue
+                datapath = self.dpset.get(entry["dpid"])
+                if datapath is None:
+                    continue
+                self.mod_mp_group(datapath, datapath.ofproto.OFPGC_MODIFY,
+                                  entry["out_group"], entry["next_hops"], new)
+                entry["weights"] = new
+        self.batcher.flush()
 
     @set_ev_cls(Event_Switching_PacketIn, MAIN_DISPATCHER)
     def _switching_handler(self, ev):
         msg = ev.msg
-        pkt = ev.pkt
 
         datapath = msg.datapath
         ofproto = datapath.ofproto
         parser = datapath.ofproto_parser
         dpid = datapath.id
-        eth_src = pkt.get_protocol(ethernet.ethernet).src
-        eth_dst = pkt.get_protocol(ethernet.ethernet).dst
+        eth_src = ev.eth_src
+        eth_dst = ev.eth_dst
         in_port = msg.match["in_port"]
 
         if eth_dst not in self.hosts:
@@ -167,6 +393,7 @@ class Switching(app_manager.RyuApp):
             self.create_mp_flow(dpid, eth_dst, dst_dpid, dst_out_port)
         else:
             self.create_flow(dpid, eth_dst, dst_dpid, dst_out_port)
+        self.batcher.flush()
         # Send to last switch directly
         datapath = self.dpset.get(dst_dpid)
         ofproto = datapath.ofproto
@@ -182,11 +409,13 @@ class Switching(app_manager.RyuApp):
         return True
 
     def create_flow(self, src_dpid, eth_dst, dst_dpid, dst_out_port):
-        flow_id = hash(eth_dst) % (2 ** 30)
+        flow_id = eth_dst
         self.flows[flow_id] = []
         self.flow_to_links[flow_id] = set()
         if src_dpid != dst_dpid:
-            path = nx.shortest_path(self.graph, source=src_dpid, target=dst_dpid)
+            path = nx.shortest_path(self.graph, source=src_dpid,
+                                    target=dst_dpid,
+                                    weight=self.link_weight())
             for i in xrange(len(path)-1):
                 out_port = self.link_outport[(path[i], path[i+1])]
                 self.add_switch_flow(flow_id, path[i], eth_dst, out_port)
@@ -198,38 +427,40 @@ class Switching(app_manager.RyuApp):
         self.add_switch_flow(flow_id, dst_dpid, eth_dst, dst_out_port)
 
     def create_mp_flow(self, src_dpid, eth_dst, dst_dpid, dst_out_port):
-        flow_id = hash(eth_dst) % (2 ** 30)
+        flow_id = eth_dst
+        # Flow created again from another switch, its old groups go
+        # unless the new next hops keep them
+        stale = self.flows.get(flow_id, [])
+        for link in self.flow_to_links.get(flow_id, ()):
+            self.link_to_flows[link].discard(flow_id)
         self.flows[flow_id] = []
         self.flow_to_links[flow_id] = set()
+        nexts = {}
         if src_dpid != dst_dpid:
-            paths = nx.all_shortest_paths(self.graph, source=src_dpid, target=dst_dpid)
-            paths = list(paths)
-            path_count = len(paths)
-            path_len = len(paths[0])
-            for i in xrange(path_len-1):
-                rules = {}
-                # Aggregrate rules
-                for j in xrange(path_count):
-                    out_ports = rules.setdefault(paths[j][i], set())
-                    port = self.link_outport[(paths[j][i], paths[j][i+1])]
-                    out_ports.add(port)
-                    src, dst = paths[j][i], paths[j][i+1]
-                    if src > dst:
-                        src, dst = dst, src
-                    self.link_to_flows[(src, dst)].add(flow_id)
-                    self.flow_to_links[flow_id].add((src, dst))
-                for src_dpid in rules.keys():
-                    if len(rules[src_dpid]) > 1:
-                        self.add_mp_switch_flow(flow_id, 
-                                                src_dpid, 
-                                                eth_dst, 
-                                                rules[src_dpid])
-                    else:
-                        self.add_switch_flow(flow_id, 
-                                             src_dpid, 
-                                             eth_dst, 
-                                             rules[src_dpid].pop())
+            nexts = self.planner.plan(src_dpid, dst_dpid, self.link_weight())
+        self.next_hops[flow_id] = (dst_dpid, nexts)
+        weights = self.group_weights(flow_id)
+        for dpid, hops in nexts.items():
+            for hop in hops:
+                src, dst = dpid, hop
+                if src > dst:
+                    src, dst = dst, src
+                self.link_to_flows[(src, dst)].add(flow_id)
+                self.flow_to_links[flow_id].add((src, dst))
+            if len(hops) > 1:
+                self.add_mp_switch_flow(flow_id, dpid, eth_dst, sorted(hops),
+                                        weights[dpid])
+            else:
+                out_port = self.link_outport[(dpid, list(hops)[0])]
+                self.add_switch_flow(flow_id, dpid, eth_dst, out_port)
         self.add_switch_flow(flow_id, dst_dpid, eth_dst, dst_out_port)
+        grouped = set(entry["dpid"] for entry in self.flows[flow_id]
+                      if "next_hops" in entry)
+        for entry in stale:
+            if "next_hops" in entry and entry["dpid"] not in grouped:
+                self.ids.free(entry["dpid"], "group", "switching", flow_id)
+                self.del_switch_flow(entry["dpid"], entry["out_port"],
+                                     entry["out_group"], entry["match"])
 
     def add_switch_flow(self, flow_id, dpid, eth_dst, out_port):
         datapath = self.dpset.get(dpid)
@@ -244,32 +475,28 @@ class Switching(app_manager.RyuApp):
         inst = [parser.OFPInstructionActions(ofproto.OFPIT_APPLY_ACTIONS, actions)]
         mod = parser.OFPFlowMod(datapath=datapath, priority=priority,
                                 match=match, instructions=inst, idle_timeout=300)
-        datapath.send_msg(mod)
+        self.batcher.send(datapath, mod)
         self.flows[flow_id].append({"dpid": dpid,
                                     "out_port": out_port,
                                     "out_group": ofproto.OFPG_ANY,
                                     "match": match})
 
-    def add_mp_switch_flow(self, flow_id, dpid, eth_dst, out_ports):
+    def add_mp_switch_flow(self, flow_id, dpid, eth_dst, hops, weights):
         datapath = self.dpset.get(dpid)
         if datapath is None: 
             return
         ofproto = datapath.ofproto
         parser = datapath.ofproto_parser
 
-        group_id = flow_id
-        buckets = []
-        for port in out_ports:
-            actions = [parser.OFPActionOutput(port)]
-            buckets.append(parser.OFPBucket(weight=1,
-                                            actions=actions))
-
-        gmod = parser.OFPGroupMod(datapath=datapath,
-                                  command=ofproto.OFPGC_ADD,
-                                  type_=ofproto.OFPGT_SELECT,
-                                  group_id=group_id,
-                                  buckets=buckets)
-        datapath.send_msg(gmod)
+        # A flow created again keeps its group, only the buckets change
+        group_id = self.ids.get(dpid, "group", "switching", flow_id)
+        command = ofproto.OFPGC_MODIFY
+        if group_id is None:
+            group_id = self.ids.alloc(dpid, "group", "switching", flow_id)
+            command = ofproto.OFPGC_ADD
+        if group_id is None:
+            return
+        self.mod_mp_group(datapath, command, group_id, hops, weights)
 
         priority = 5
         match = parser.OFPMatch(eth_dst=eth_dst)
@@ -277,13 +504,32 @@ class Switching(app_manager.RyuApp):
         inst = [parser.OFPInstructionActions(ofproto.OFPIT_APPLY_ACTIONS, actions)]
         mod = parser.OFPFlowMod(datapath=datapath, priority=priority,
                                 match=match, instructions=inst, idle_timeout=300)
-        datapath.send_msg(mod)
+        self.batcher.send(datapath, mod)
         self.flows[flow_id].append({"dpid": dpid,
                                     "out_port": ofproto.OFPP_ANY,
                                     "out_group": group_id,
-                                    "out_ports": list(out_ports),
+                                    "next_hops": hops,
+                                    "weights": weights,
                                     "match": match})
 
+    def mod_mp_group(self, datapath, command, group_id, hops, weights):
+        ofproto = datapath.ofproto
+        parser = datapath.ofproto_parser
+
+        buckets = []
+        for hop in hops:
+            port = self.link_outport[(datapath.id, hop)]
+            actions = [parser.OFPActionOutput(port)]
+            buckets.append(parser.OFPBucket(weight=weights[hop],
+                                            actions=actions))
+
+        gmod = parser.OFPGroupMod(datapath=datapath,
+                                  command=command,
+                                  type_=ofproto.OFPGT_SELECT,
+                                  group_id=group_id,
+                                  buckets=buckets)
+        self.batcher.send(datapath, gmod)
+
     def del_switch_flow(self, dpid, out_port, out_group, match):
         datapath = self.dpset.get(dpid)
         if datapath is None:
@@ -296,7 +542,7 @@ class Switching(app_manager.RyuApp):
                                       command=ofproto.OFPGC_DELETE,
                                       type_=ofproto.OFPGT_SELECT,
                                       group_id=out_group)
-            datapath.send_msg(gmod)
+            self.batcher.send(datapath, gmod)
 
         mod = parser.OFPFlowMod(datapath=datapath,
                                 command=ofproto.OFPFC_DELETE,
@@ -304,4 +550,4 @@ class Switching(app_manager.RyuApp):
                                 out_group=out_group,
                                 match=match,
                                 instructions=[])
-        datapath.send_msg(mod)
+        self.batcher.send(datapath, mod)
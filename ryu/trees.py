@@ -0,0 +1,160 @@
+import weakref
+
+# Marks a node that did not exist in the tree an undo log belongs to
+_ABSENT = object()
+
+
+def tree_links(tree):
+    # links(src<dst) of a tree
+    links = set()
+    for node, entry in tree.items():
+        if entry["parent"] != -1:
+            links.add((min(node, entry["parent"]), max(node, entry["parent"])))
+    return links
+
+
+class MulticastTree(object):
+    # dpid -> {"parent", "children"}, parent is -1 for the source
+    #
+    # Reads look like a dict of entries. Writes go through add_node,
+    # remove_node, add_child and remove_child, entries must not be
+    # modified in place.
+    #
+    # fork() hands the node table over to the new tree in O(1) and turns
+    # this tree into a read-only view: the first time the new tree writes
+    # a node it logs the previous entry here, so this tree keeps reading
+    # as before. Entries are copied on write, one node at a time. The
+    # latest tree is a plain dict, older ones walk their undo logs.
+
+    def __init__(self):
+        super(MulticastTree, self).__init__()
+        # dpid -> entry, None once forked
+        self._nodes = {}
+        # Once forked: dpid -> entry or _ABSENT for nodes the next tree
+        # changed, and the next tree itself
+        self._undo = None
+        self._next = None
+        # Weak reference to the tree this one was forked from
+        self._prev = None
+        # Nodes whose entry belongs to this tree and can be mutated
+        self._owned = set()
+        # Nodes written since the fork
+        self.modified = set()
+
+    def fork(self):
+        tree = MulticastTree()
+        if self._nodes is None:
+            # Forking an old view again, it has to be materialized
+            tree._nodes = dict((node, self._entry(node))
+                               for node in self.keys())
+            return tree
+        tree._nodes = self._nodes
+        tree._prev = weakref.ref(self)
+        self._nodes = None
+        self._undo = {}
+        self._next = tree
+        return tree
+
+    def _entry(self, node):
+        tree = self
+        while tree._nodes is None:
+            if node in tree._undo:
+                entry = tree._undo[node]
+                return None if entry is _ABSENT else entry
+            tree = tree._next
+        return tree._nodes.get(node)
+
+    def _writable(self, node):
+        if self._nodes is None:
+            raise RuntimeError("multicast tree was forked, it is read-only")
+        entry = self._nodes.get(node)
+        if node not in self._owned:
+            prev = self._prev() if self._prev is not None else None
+            if prev is not None and node not in prev._undo:
+                prev._undo[node] = _ABSENT if entry is None else entry
+            if entry is not None:
+                entry = {"parent": entry["parent"],
+                         "children": set(entry["children"])}
+                self._nodes[node] = entry
+            self._owned.add(node)
+        self.modified.add(node)
+        return entry
+
+    def add_node(self, node, parent):
+        self._writable(node)
+        self._nodes[node] = {"parent": parent, "children": set()}
+        if parent != -1:
+            self.add_child(parent, node)
+
+    def remove_node(self, node):
+        entry = self._writable(node)
+        if entry is None:
+            return
+        del self._nodes[node]
+        if entry["parent"] != -1 and entry["parent"] in self._nodes:
+            self.remove_child(entry["parent"], node)
+
+    def add_child(self, node, child):
+        self._writable(node)["children"].add(child)
+
+    def remove_child(self, node, child):
+        self._writable(node)["children"].discard(child)
+
+    def __getitem__(self, node):
+        entry = self._entry(node)
+        if entry is None:
+            raise KeyError(node)
+        return entry
+
+    def get(self, node, default=None):
+        entry = self._entry(node)
+        return default if entry is None else entry
+
+    def __contains__(self, node):
+        return self._entry(node) is not None
+
+    def keys(self):
+        if self._nodes is not None:
+            return self._nodes.keys()
+        views = []
+        tree = self
+        while tree._nodes is None:
+            views.append(tree)
+            tree = tree._next
+        # Replay undo logs from the latest tree back to this one
+        keys = set(tree._nodes.keys())
+        for view in reversed(views):
+            for node, entry in view._undo.items():
+                if entry is _ABSENT:
+                    keys.discard(node)
+                else:
+                    keys.add(node)
+        return list(keys)
+
+    def items(self):
+        return [(node, self._entry(node)) for node in self.keys()]
+
+    def to_list(self):
+        # (node, parent) pairs, parents first, to hand a tree over to
+        # another process
+        pairs = [(node, -1) for node, entry in self.items()
+                 if entry["parent"] == -1]
+        for node, parent in pairs:
+            for child in sorted(self[node]["children"]):
+                pairs.append((child, node))
+        return pairs
+
+    @classmethod
+    def from_list(cls, pairs):
+        tree = cls()
+        for node, parent in pairs:
+            tree.add_node(node, parent)
+        return tree
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        if self._nodes is not None:
+            return len(self._nodes)
+        return len(self.keys())
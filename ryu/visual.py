@@ -1,5 +1,6 @@
 import os
 import json
+import time
 import logging
 from webob import Response
 from webob.static import DirectoryApp
@@ -11,7 +12,7 @@ from ryu.app.wsgi import WebSocketRPCClient, websocket
 from ryu.contrib.tinyrpc.exc import InvalidReplyError
 from socket import error as SocketError
 from ryu.controller.handler import set_ev_cls
-from ryu.lib.dpid import DPID_PATTERN, str_to_dpid
+from ryu.lib.dpid import DPID_PATTERN, dpid_to_str, str_to_dpid
 from ryu.lib.port_no import str_to_port_no
 from ryu.topology.event import *
 from events import *
@@ -41,9 +42,16 @@ class VisualServer(app_manager.RyuApp):
     def reg_DPSet(self, dpset):
         self.dpset = dpset
 
+    def reg_stats(self, stats):
+        self.stats = stats
+
+    def reg_rebalancer(self, rebalancer):
+        self.rebalancer = rebalancer
+
     def reg_controllers(self, wsgi):
         wsgi.register(TopologyController, {"visual_server": self})
         wsgi.register(StreamController, {"visual_server": self})
+        wsgi.register(StatsController, {"visual_server": self})
         wsgi.register(WebSocketTopologyController, {"visual_server": self})
         wsgi.register(StaticFileController)
 
@@ -78,11 +86,39 @@ class VisualServer(app_manager.RyuApp):
                 hosts[i]["receving"] = list(host_stat[mac]["receving"])
         return hosts
 
+    def admit(self, ev):
+        # Streaming decides and passes ev on if it is let in
+        rep = self.send_request(EventStreamAdmissionRequest(ev))
+        return rep.decision
+
     def get_files(self):
         files = filter(lambda x: x.rfind("ts") == len(x)-2, 
                        os.listdir(self.conf["src_dir"]))
         return files
 
+    def get_stat_series(self, table, dpid):
+        # key -> [[time, Kbps, ...]] of one datapath
+        series = getattr(self.stats, table).get(dpid, {})
+        return dict((str(key), s.to_list()) for key, s in series.items())
+
+    def get_link_loads(self):
+        loads = []
+        for (src, dst), load in self.stats.link_loads.items():
+            loads.append({"src": dpid_to_str(src),
+                          "dst": dpid_to_str(dst),
+                          "load": load})
+        return loads
+
+    def get_packet_in_stats(self):
+        return self.wrapper.limiter.to_dict(time.time())
+
+    def get_stream_rates(self):
+        rates = {}
+        for stream_id, series in self.stats.streams.items():
+            rates[stream_id] = {"rate": self.stats.stream_rate(stream_id),
+                                "samples": series.to_list()}
+        return rates
+
 
     @set_ev_cls(EventSwitchEnter)
     def _event_switch_enter_handler(self, ev):
@@ -208,10 +244,11 @@ class StreamController(ControllerBase):
             fname = data["fname"]
         except KeyError, message:
             return Response(status=400, body=str(message))
-        self.visual_server.send_event_to_observers(\
-                EventStreamSourceEnter(stream_id, mac, dpid, port_no, fname))
-        body = json.dumps({"stat": "succ"})
-        return Response(content_type="application/json", body=body)
+        rate = data.get("rate", 100)
+        decision = self.visual_server.admit(\
+                EventStreamSourceEnter(stream_id, mac, dpid, port_no, fname,
+                                       rate))
+        return self._admission_response(decision)
 
     @route("stream", "/streaming/receive_from", methods=["POST"])
     def _receive_from_handler(self, req, **kwargs):
@@ -228,9 +265,15 @@ class StreamController(ControllerBase):
             stream_id = data["stream_id"]
         except KeyError, message:
             return Response(status=400, body=str(message))
-        self.visual_server.send_event_to_observers(\
+        decision = self.visual_server.admit(\
                 EventStreamClientEnter(stream_id, mac, dpid, port_no))
-        body = json.dumps({"stat": "succ"})
+        return self._admission_response(decision)
+
+    def _admission_response(self, decision):
+        admitted = decision["decision"] in ("admitted", "downrated")
+        body = dict(decision)
+        body["stat"] = "succ" if admitted else "fail"
+        body = json.dumps(body)
         return Response(content_type="application/json", body=body)
 
     @route("stream", "/streaming/bandwidth_change", methods=["POST"])
@@ -259,10 +302,55 @@ class StatsController(ControllerBase):
         super(StatsController, self).__init__(req, link, data, **config)
         self.visual_server = data["visual_server"]
 
+    def _series_response(self, table, dpid):
+        series = self.visual_server.get_stat_series(table, str_to_dpid(dpid))
+        body = json.dumps(series)
+        return Response(content_type="application/json", body=body)
+
     @route("stats", "/stats/flow/{dpid}", methods=["GET"],
            requirements={"dpid": DPID_PATTERN})
     def _flow_stat_handler(self, req, **kwargs):
-        pass
+        return self._series_response("flows", kwargs["dpid"])
+
+    @route("stats", "/stats/port/{dpid}", methods=["GET"],
+           requirements={"dpid": DPID_PATTERN})
+    def _port_stat_handler(self, req, **kwargs):
+        return self._series_response("ports", kwargs["dpid"])
+
+    @route("stats", "/stats/group/{dpid}", methods=["GET"],
+           requirements={"dpid": DPID_PATTERN})
+    def _group_stat_handler(self, req, **kwargs):
+        return self._series_response("groups", kwargs["dpid"])
+
+    @route("stats", "/stats/meter/{dpid}", methods=["GET"],
+           requirements={"dpid": DPID_PATTERN})
+    def _meter_stat_handler(self, req, **kwargs):
+        return self._series_response("meters", kwargs["dpid"])
+
+    @route("stats", "/stats/links", methods=["GET"])
+    def _link_stat_handler(self, req, **kwargs):
+        body = json.dumps(self.visual_server.get_link_loads())
+        return Response(content_type="application/json", body=body)
+
+    @route("stats", "/stats/streams", methods=["GET"])
+    def _stream_stat_handler(self, req, **kwargs):
+        body = json.dumps(self.visual_server.get_stream_rates())
+        return Response(content_type="application/json", body=body)
+
+    @route("stats", "/stats/collector", methods=["GET"])
+    def _collector_stat_handler(self, req, **kwargs):
+        body = json.dumps(self.visual_server.stats.to_dict())
+        return Response(content_type="application/json", body=body)
+
+    @route("stats", "/stats/rebalance", methods=["GET"])
+    def _rebalance_stat_handler(self, req, **kwargs):
+        body = json.dumps(self.visual_server.rebalancer.to_dict())
+        return Response(content_type="application/json", body=body)
+
+    @route("stats", "/stats/packet_in", methods=["GET"])
+    def _packet_in_stat_handler(self, req, **kwargs):
+        body = json.dumps(self.visual_server.get_packet_in_stats())
+        return Response(content_type="application/json", body=body)
 
     @route("stats", "/stats/priority_get/{dpid}", methods=["GET"],
            requirements={"dpid": DPID_PATTERN})
@@ -1,5 +1,5 @@
-import logging
 import json
+import time
 
 from ryu import cfg
 from ryu.base import app_manager
@@ -12,16 +12,18 @@ from ryu.topology.event import *
 from ryu.app.wsgi import WSGIApplication
 from ryu.lib.packet import packet, ethernet, arp, ipv4, icmp
 from ryu.lib.mac import haddr_to_bin
-from ryu.lib.dpid import dpid_to_str
-from ryu.lib.port_no import port_no_to_str
 
 from arp_proxy import ARPProxy
 from switching import Switching
 from streaming import Streaming
 from visual import VisualServer
+from batcher import FlowBatcher
+from stats import StatsCollector
 
 from events import *
 from addrs import *
+from classify import *
+from ratelimit import *
 
 cfg.CONF.observe_links = True
 cfg.CONF.explicit_drop = False
@@ -38,7 +40,9 @@ class Wrapper(app_manager.RyuApp):
         "ARPProxy": ARPProxy,
         "Switching": Switching,
         "Streaming": Streaming,
-        "Visual": VisualServer
+        "Visual": VisualServer,
+        "FlowBatcher": FlowBatcher,
+        "StatsCollector": StatsCollector
     }
     _EVENTS = [Event_ARP_PacketIn,
                Event_Switching_PacketIn,
@@ -47,36 +51,56 @@ class Wrapper(app_manager.RyuApp):
 
     def __init__(self, *args, **kwargs):
         super(Wrapper, self).__init__(*args, **kwargs)
-        self.logger.setLevel(logging.DEBUG)
+        # Left at ryu-manager's level, the packet-in debug lines would go
+        # out for every packet otherwise
         self.dpset = kwargs["dpset"]
         self._wsgi = kwargs["wsgi"]
         self._arp_proxy = kwargs["ARPProxy"]
         self._switching = kwargs["Switching"]
         self._streaming = kwargs["Streaming"]
         self._visual = kwargs["Visual"]
+        self._batcher = kwargs["FlowBatcher"]
+        self._stats = kwargs["StatsCollector"]
+        # Bounds the packet-ins handled per switch and per source
+        self.limiter = PacketInLimiter()
 
         with file(CONFIG_FILE) as f:
             conf = json.load(f)
             for app in conf.keys():
-                kwargs[app].config(conf[app])
+                if app == self.name:
+                    self.config(conf[app])
+                else:
+                    kwargs[app].config(conf[app])
     
+        self._batcher.reg_DPSet(self.dpset)
+        self._stats.reg_DPSet(self.dpset)
         self._arp_proxy.reg_DPSet(self.dpset)
         self._arp_proxy.set_wrapper(self)
         self._switching.reg_DPSet(self.dpset)
         self._switching.set_wrapper(self)
+        self._switching.reg_batcher(self._batcher)
+        self._switching.reg_link_costs(self._streaming.link_costs)
+        self._switching.reg_ids(self._streaming.ids)
         self._switching.enable_multipath()
         self._streaming.reg_DPSet(self.dpset)
+        self._streaming.reg_batcher(self._batcher)
         self._visual.reg_DPSet(self.dpset)
         self._visual.set_wrapper(self)
+        self._visual.reg_stats(self._stats)
+        self._visual.reg_rebalancer(self._streaming.rebalancer)
         self._visual.reg_controllers(self._wsgi)
 
-        # dpid -> set(mac)
+        # dpid -> set(mac), raw 6 bytes as in the frames
         self.hostmac = {}
         # dpid -> set(port)
         self.flood_ports = {}
 
         self._arp_proxy.insert_entry(HOST_DIS_IP_SRC, HOST_DIS_ETH_SRC)
 
+    def config(self, conf):
+        self.conf = conf
+        self.limiter.config(conf)
+
     def get_flood_ports(self):
         port_list = []
         for dpid, ports in self.flood_ports.items():
@@ -125,6 +149,7 @@ class Wrapper(app_manager.RyuApp):
         msg = ev.switch.to_dict()
         dpid = int(msg["dpid"], 16)
         del self.hostmac[int(msg["dpid"], 16)]
+        self.limiter.forget(dpid)
         if dpid in self.flood_ports:
             del self.flood_ports[dpid]
 
@@ -164,12 +189,21 @@ class Wrapper(app_manager.RyuApp):
         dpid = datapath.id
         # table-miss flow entry
         miss_match = parser.OFPMatch()
+        miss_meter = None
         if dpid == NAT_SW_DPID:
             miss_actions = [parser.OFPActionOutput(ofproto.OFPP_NORMAL)]
         else:
             miss_actions = [parser.OFPActionOutput(ofproto.OFPP_CONTROLLER,
                                                    ofproto.OFPCML_NO_BUFFER)]
-        self.add_flow(datapath, 0, miss_match, miss_actions)
+            if self.limiter.enabled and self.limiter.miss_rate is not None:
+                # Packet-ins beyond the rate never leave the switch
+                miss_meter = PACKET_IN_METER_ID
+                self.add_pktps_meter(datapath, miss_meter,
+                                     self.limiter.miss_rate)
+        self.add_flow(datapath, 0, miss_match, miss_actions, miss_meter)
+        if self.limiter.enabled and self.limiter.offender_action == "meter":
+            self.add_pktps_meter(datapath, OFFENDER_METER_ID,
+                                 self.limiter.offender_rate)
 
         # ipv6 discovery entry
         ipv6_match = parser.OFPMatch()
@@ -184,60 +218,94 @@ class Wrapper(app_manager.RyuApp):
         datapath = msg.datapath
         in_port = msg.match["in_port"]
 
-        pkt = packet.Packet(msg.data)
-        arp_protocol = pkt.get_protocol(arp.arp)
-        ip_protocol = pkt.get_protocol(ipv4.ipv4)
+        data = msg.data
+        kind, ethertype, offset = classify(data)
 
-        eth_src = pkt.get_protocol(ethernet.ethernet).src
-        eth_dst = pkt.get_protocol(ethernet.ethernet).dst
+        if kind == PKT_LLDP or kind == PKT_SHORT:
+            return
 
-        if eth_dst == LLDP:
+        verdict = self.limiter.check(datapath.id, data[6:12], time.time())
+        if verdict == BLOCK:
+            self.block_source(datapath, in_port, raw_eth_src(data))
+        if verdict != PASS:
             return
 
         hosts = self.hostmac.get(datapath.id)
-        if hosts is not None and eth_src not in hosts:
-            src_ip = None
-            if arp_protocol is not None:
-                src_ip = arp_protocol.src_ip
-            elif ip_protocol is not None:
-                src_ip = ip_protocol.src
+        if hosts is not None and data[6:12] not in hosts:
+            src_ip = raw_src_ip(data, ethertype, offset)
             if src_ip is not None:
+                eth_src = raw_eth_src(data)
                 print "disc ip%s mac%s" % (src_ip, eth_src)
-                hosts.add(eth_src)
+                hosts.add(data[6:12])
                 host = Host(eth_src, src_ip, datapath.id, in_port)
                 self.send_event_to_observers(EventHostReg(host))
  
         # Active Host Discovery
-        if eth_dst == HOST_DIS_ETH_SRC:
+        if kind == PKT_HOST_DIS:
             self.logger.info("recv HOST_DIS_ETH_SRC")
             return
 
         # Passive Host Discovery
-        if arp_protocol:
-            self.send_event_to_observers(Event_ARP_PacketIn(msg, pkt))
+        if kind == PKT_ARP:
+            self.send_event_to_observers(Event_ARP_PacketIn(msg))
             return
 
-        if eth_dst == ETHERNET_FLOOD:
+        if kind == PKT_FLOOD:
             # Ignore LLDP packets and flooding packets
             return
-        elif is_multicast(eth_dst):
+        elif kind == PKT_STREAMING:
             # Streaming
-            print "Streaming"
-            self.send_event_to_observers(Event_Streaming_PacketIn(msg, pkt))
+            self.logger.debug("streaming packet-in at dp%d", datapath.id)
+            self.send_event_to_observers(Event_Streaming_PacketIn(msg))
         else:
             # Switching
-            print "Switching"
-            self.send_event_to_observers(Event_Switching_PacketIn(msg, pkt))
+            self.logger.debug("switching packet-in at dp%d", datapath.id)
+            self.send_event_to_observers(Event_Switching_PacketIn(msg))
 
-    def add_flow(self, datapath, priority, match, actions):
+    def add_flow(self, datapath, priority, match, actions, meter_id=None,
+                 hard_timeout=0):
         ofproto = datapath.ofproto
         parser = datapath.ofproto_parser
 
-        inst = [parser.OFPInstructionActions(ofproto.OFPIT_APPLY_ACTIONS, actions)]
+        inst = []
+        if meter_id is not None:
+            inst.append(parser.OFPInstructionMeter(meter_id))
+        inst.append(parser.OFPInstructionActions(ofproto.OFPIT_APPLY_ACTIONS, actions))
         mod = parser.OFPFlowMod(datapath=datapath, priority=priority,
-                                match=match, instructions=inst)
+                                match=match, instructions=inst,
+                                hard_timeout=hard_timeout)
+        datapath.send_msg(mod)
+
+    def add_pktps_meter(self, datapath, meter_id, rate):
+        ofproto = datapath.ofproto
+        parser = datapath.ofproto_parser
+
+        bands = [parser.OFPMeterBandDrop(rate=rate)]
+        mod = parser.OFPMeterMod(datapath=datapath,
+                                 command=ofproto.OFPMC_ADD,
+                                 flags=ofproto.OFPMF_PKTPS,
+                                 meter_id=meter_id,
+                                 bands=bands)
         datapath.send_msg(mod)
 
+    def block_source(self, datapath, in_port, eth_src):
+        # Packets of an offender that miss every flow stay at the switch
+        # or reach the controller through the offender meter
+        ofproto = datapath.ofproto
+        parser = datapath.ofproto_parser
+
+        self.logger.info("packet-ins of %s at dp%d throttled for %ds",
+                         eth_src, datapath.id, self.limiter.block)
+        match = parser.OFPMatch(in_port=in_port, eth_src=eth_src)
+        actions = []
+        meter_id = None
+        if self.limiter.offender_action == "meter":
+            actions = [parser.OFPActionOutput(ofproto.OFPP_CONTROLLER,
+                                              ofproto.OFPCML_NO_BUFFER)]
+            meter_id = OFFENDER_METER_ID
+        self.add_flow(datapath, OFFENDER_PRIORITY, match, actions, meter_id,
+                      int(self.limiter.block))
+
     def flush_flows(self, datapath):
         ofproto = datapath.ofproto
         parser = datapath.ofproto_parser
@@ -250,26 +318,3 @@ class Wrapper(app_manager.RyuApp):
                                 instructions=[])
         datapath.send_msg(mod)
 
-
-class Host(object):
-    # This is data class passed by EventHostXXX
-
-    def __init__(self, mac, ip, dpid, port_no):
-        super(Host, self).__init__()
-        self.mac = mac
-        self.ip = ip
-        self.dpid = dpid
-        self.port_no = port_no
-
-    def to_dict(self):
-        d = {
-            "mac": self.mac,
-            "ip": self.ip,
-            "dpid": dpid_to_str(self.dpid),
-            "port_no": port_no_to_str(self.port_no)
-        }
-        return d
-
-    def __str__(self):
-        msg = 'Host<mac=%s,ip=%s>' % (self.mac, self.ip)
-        return msg
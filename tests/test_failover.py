@@ -0,0 +1,105 @@
+import os
+import sys
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Controller modules use flat imports, as they do when started from ryu/
+sys.path.insert(0, os.path.join(ROOT, "ryu"))
+
+from ryu.ofproto import ofproto_v1_3, ofproto_v1_3_parser
+
+from failover import *
+from test_flows import RecordingDatapath
+
+ofp = ofproto_v1_3
+DPID = 1
+ETH_DST = "01:00:5e:01:00:07"
+VID = DETOUR_VID_BASE
+GROUP = 0x40000000
+
+
+def state(ff=None, hops=None, arrive=None):
+    return {"ff": ff or {}, "hops": hops or {}, "arrive": arrive or {}}
+
+
+def summary(msg):
+    # (message, command, group id or in_port of the match)
+    if isinstance(msg, ofproto_v1_3_parser.OFPGroupMod):
+        return ("group", msg.command, msg.group_id)
+    return ("flow", msg.command, msg.match["in_port"])
+
+
+def action_types(flow):
+    return [action.__class__.__name__
+            for action in flow.instructions[0].actions]
+
+
+class DetourProgrammerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.programmer = DetourProgrammer()
+        self.datapath = RecordingDatapath(DPID)
+
+    def program(self, key, curr):
+        # before, arrive and after as summaries
+        return [[summary(msg) for msg in msgs]
+                for msgs in self.programmer.program(self.datapath, key,
+                                                    ETH_DST, curr)]
+
+    def test_untagged_arrive(self):
+        # Version 0 trees pop the detour tag, the restore tag is None
+        key = version_key(7, 0)
+        before, arrive, after = self.programmer.program(
+            self.datapath, key, ETH_DST, state(arrive={(VID, 3): None}))
+        self.assertEqual((before, after), ([], []))
+        self.assertEqual([summary(msg) for msg in arrive],
+                         [("flow", ofp.OFPFC_ADD, 3)])
+        self.assertEqual(action_types(arrive[0]),
+                         ["OFPActionPopVlan", "OFPActionGroup"])
+        self.assertEqual(self.program(key, state(arrive={(VID, 3): None})),
+                         [[], [], []])
+
+    def test_arrive_after_stream_group(self):
+        # The arrive flow refers to the stream group, it comes after it
+        key = version_key(7, 1)
+        before, arrive, after = self.program(key, state(
+            ff={2: (GROUP, 2, 4, VID, True)},
+            hops={(VID + 1, 5): 6},
+            arrive={(VID + 2, 3): 1}))
+        self.assertEqual(sorted(before), [("flow", ofp.OFPFC_ADD, 5),
+                                          ("group", ofp.OFPGC_ADD, GROUP)])
+        self.assertEqual(arrive, [("flow", ofp.OFPFC_ADD, 3)])
+        self.assertEqual(after, [])
+
+    def test_group_id_reused(self):
+        # A group id freed by one child and taken by another is modified,
+        # not added and then deleted
+        key = version_key(7, 1)
+        self.program(key, state(ff={2: (GROUP, 2, 4, VID, True)}))
+        before, arrive, after = self.program(key, state(
+            ff={3: (GROUP, 3, 4, VID + 1, True)}))
+        self.assertEqual(before, [("group", ofp.OFPGC_MODIFY, GROUP)])
+        self.assertEqual((arrive, after), ([], []))
+
+    def test_group_replaced(self):
+        key = version_key(7, 1)
+        self.program(key, state(ff={2: (GROUP, 2, 4, VID, True)}))
+        before, arrive, after = self.program(key, state(
+            ff={2: (GROUP + 1, 2, 5, VID + 1, True)}))
+        self.assertEqual(before, [("group", ofp.OFPGC_ADD, GROUP + 1)])
+        self.assertEqual(after, [("group", ofp.OFPGC_DELETE, GROUP)])
+
+    def test_removed(self):
+        # Flows go before the group, nothing is left installed
+        key = version_key(7, 0)
+        self.program(key, state(ff={2: (GROUP, 2, 4, VID, False)},
+                                arrive={(VID, 3): None}))
+        before, arrive, after = self.program(key, None)
+        self.assertEqual((before, arrive), ([], []))
+        self.assertEqual(after, [("flow", ofp.OFPFC_DELETE_STRICT, 3),
+                                 ("group", ofp.OFPGC_DELETE, GROUP)])
+        self.assertEqual(self.programmer.keys(DPID), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,147 @@
+import os
+import sys
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Controller modules use flat imports, as they do when started from ryu/
+sys.path.insert(0, os.path.join(ROOT, "ryu"))
+
+from ryu.ofproto import ofproto_v1_3, ofproto_v1_3_parser
+
+from flows import *
+
+ofp = ofproto_v1_3
+DPID = 1
+KEY = version_key(7, 0)
+ETH_DST = "01:00:5e:01:00:07"
+
+
+class RecordingDatapath(object):
+    # Enough of a Datapath for the programmer, keeps what was sent
+
+    def __init__(self, dpid):
+        super(RecordingDatapath, self).__init__()
+        self.id = dpid
+        self.ofproto = ofproto_v1_3
+        self.ofproto_parser = ofproto_v1_3_parser
+        self.sent = []
+
+    def send_msg(self, msg):
+        msg.serialize()
+        self.sent.append(msg)
+        return True
+
+
+def state(in_port=1, ports=(2,), band=None, tag=None, push=None):
+    buckets = tuple(sorted((port, None, None, False, None)
+                           for port in ports))
+    return {"in_port": in_port, "tag": tag, "push": push,
+            "buckets": buckets, "band": band}
+
+
+def summary(msg):
+    # (message, command, group/meter id or in_port of the match)
+    if isinstance(msg, ofproto_v1_3_parser.OFPGroupMod):
+        return ("group", msg.command, msg.group_id)
+    if isinstance(msg, ofproto_v1_3_parser.OFPMeterMod):
+        return ("meter", msg.command, msg.meter_id)
+    return ("flow", msg.command, msg.match["in_port"])
+
+
+def bucket_ports(msg):
+    return [bucket.actions[-1].port for bucket in msg.buckets]
+
+
+class StreamFlowProgrammerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.programmer = StreamFlowProgrammer()
+        self.datapath = RecordingDatapath(DPID)
+
+    def program(self, curr):
+        self.datapath.sent = []
+        for msg in self.programmer.program(self.datapath, KEY, ETH_DST,
+                                           curr):
+            self.datapath.send_msg(msg)
+        return self.datapath.sent
+
+    def test_new_node(self):
+        sent = self.program(state(ports=(2, 3), band=5))
+        self.assertEqual([summary(msg) for msg in sent],
+                         [("meter", ofp.OFPMC_ADD, KEY),
+                          ("group", ofp.OFPGC_ADD, KEY),
+                          ("flow", ofp.OFPFC_ADD, 1)])
+        self.assertEqual(sent[0].bands[0].rate, 5000)
+        self.assertEqual(bucket_ports(sent[1]), [2, 3])
+        flow = sent[2]
+        self.assertEqual(flow.match["eth_dst"], ETH_DST)
+        meter, actions = flow.instructions
+        self.assertEqual(meter.meter_id, KEY)
+        self.assertEqual(actions.actions[0].group_id, KEY)
+        self.assertEqual(self.programmer.get(DPID, KEY),
+                         state(ports=(2, 3), band=5))
+
+    def test_unchanged(self):
+        self.program(state(ports=(2, 3), band=5))
+        self.assertEqual(self.program(state(ports=(2, 3), band=5)), [])
+
+    def test_port_added(self):
+        self.program(state(ports=(2,)))
+        sent = self.program(state(ports=(2, 3)))
+        self.assertEqual([summary(msg) for msg in sent],
+                         [("group", ofp.OFPGC_MODIFY, KEY)])
+        self.assertEqual(bucket_ports(sent[0]), [2, 3])
+
+    def test_port_removed(self):
+        self.program(state(ports=(2, 3)))
+        sent = self.program(state(ports=(3,)))
+        self.assertEqual([summary(msg) for msg in sent],
+                         [("group", ofp.OFPGC_MODIFY, KEY)])
+        self.assertEqual(bucket_ports(sent[0]), [3])
+
+    def test_bandwidth_changed(self):
+        self.program(state(band=5))
+        sent = self.program(state(band=8))
+        self.assertEqual([summary(msg) for msg in sent],
+                         [("meter", ofp.OFPMC_MODIFY, KEY)])
+        self.assertEqual(sent[0].bands[0].rate, 8000)
+
+    def test_meter_added(self):
+        # The flow gets the meter instruction once the meter is there
+        self.program(state())
+        sent = self.program(state(band=5))
+        self.assertEqual([summary(msg) for msg in sent],
+                         [("meter", ofp.OFPMC_ADD, KEY),
+                          ("flow", ofp.OFPFC_MODIFY_STRICT, 1)])
+
+    def test_in_port_changed(self):
+        # The new flow goes in before the old one is deleted
+        self.program(state(in_port=1))
+        sent = self.program(state(in_port=4))
+        self.assertEqual([summary(msg) for msg in sent],
+                         [("flow", ofp.OFPFC_ADD, 4),
+                          ("flow", ofp.OFPFC_DELETE_STRICT, 1)])
+
+    def test_node_removed(self):
+        self.program(state(ports=(2, 3), band=5))
+        sent = self.program(None)
+        self.assertEqual([summary(msg) for msg in sent],
+                         [("flow", ofp.OFPFC_DELETE_STRICT, 1),
+                          ("group", ofp.OFPGC_DELETE, KEY),
+                          ("meter", ofp.OFPMC_DELETE, KEY)])
+        self.assertEqual(self.programmer.get(DPID, KEY), None)
+
+    def test_switch_leave(self):
+        # Nothing is sent to a switch that is gone, it comes back empty
+        self.program(state(ports=(2, 3), band=5))
+        self.programmer.forget(DPID)
+        self.assertEqual(self.programmer.keys(DPID), [])
+        sent = self.program(state(ports=(2, 3), band=5))
+        self.assertEqual([summary(msg) for msg in sent],
+                         [("meter", ofp.OFPMC_ADD, KEY),
+                          ("group", ofp.OFPGC_ADD, KEY),
+                          ("flow", ofp.OFPFC_ADD, 1)])
+
+
+if __name__ == "__main__":
+    unittest.main()
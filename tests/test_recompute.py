@@ -0,0 +1,59 @@
+import os
+import sys
+import time
+import unittest
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Controller modules use flat imports, as they do when started from ryu/
+sys.path.insert(0, os.path.join(ROOT, "ryu"))
+
+from streaming import ForkedMap
+
+# ryu-manager patches threads before the apps are loaded, the workers
+# have to come back all the same
+PATCHED = """
+import sys
+from ryu.lib import hub
+hub.patch(thread=True)
+sys.path.insert(0, %r)
+from streaming import ForkedMap
+result = ForkedMap(range, [3, 100000])
+while not result.ready():
+    hub.sleep(0.005)
+print sum(len(r) for r in result.get())
+""" % os.path.join(ROOT, "ryu")
+
+
+def fail(arg):
+    raise ValueError(arg)
+
+
+class ForkedMapTest(unittest.TestCase):
+
+    def test_results(self):
+        # In order, a result bigger than a pipe buffer included
+        result = ForkedMap(range, [3, 0, 100000])
+        self.assertEqual(result.get(), [range(3), [], range(100000)])
+        self.assertTrue(result.ready())
+
+    def test_child_failure(self):
+        result = ForkedMap(fail, [1])
+        self.assertRaises(EOFError, result.get)
+
+    def test_threads_patched(self):
+        proc = subprocess.Popen([sys.executable, "-c", PATCHED],
+                                stdout=subprocess.PIPE)
+        deadline = time.time() + 30
+        while proc.poll() is None and time.time() < deadline:
+            time.sleep(0.05)
+        if proc.poll() is None:
+            proc.kill()
+            proc.wait()
+            self.fail("workers hang with threads patched")
+        self.assertEqual(proc.returncode, 0)
+        self.assertEqual(proc.stdout.read().strip(), "100003")
+
+
+if __name__ == "__main__":
+    unittest.main()